@@ -0,0 +1,88 @@
+########## bench_datetime.py ##########
+"""
+Wall time of building `date_time` from the `date`/`time`/`season` columns:
+    - legacy: str.split(expand=True), DataFrame.replace for the months, the hour from time.str[0]
+      and pd.to_datetime on a year/month/day/hour frame
+    - vectorized: `add_datetime_column`, every distinct date/time string parsed once
+
+on synthetic rows drawn from the date/time values of Data/scraped_data.csv (plus 10/11/12 o'clock and
+AM kickoffs). The outputs are compared on the rows the legacy function gets right (single digit PM hours,
+minutes dropped), the rest are the rows it parses wrong.
+
+Usage:
+    python -m benchmarks.bench_datetime [--rows 1000000] [--repeat 3]
+"""
+
+
+# common imports
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data_preparation import MONTH_MAP, add_datetime_column
+
+EXTRA_TIMES = ["10:00AM ET", "12:30PM ET", "12:05AM ET", "11:35PM ET", "9:30AM ET"]
+
+
+def legacy_add_datetime_column(df: pd.DataFrame) -> pd.DataFrame:
+    # add_datetime_column before it was vectorized
+    df[['month', 'day']] = df['date'].str.split(' ', expand=True)
+    df['day'] = df['day'].astype(int)
+    df = df.replace({"month": MONTH_MAP})
+    df['year'] = df['season']
+    df.loc[(df['month'] == 1) | (df['month'] == 2), 'year'] = df['year'] + 1
+    df['hour'] = df['time'].str[0].astype(int)
+    df['hour'] += df['time'].str.contains('PM').astype(int) * 12
+    df['date_time'] = pd.to_datetime(df[['year', 'month', 'day', 'hour']])
+    return df
+
+
+def synthetic_rows(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    scraped = pd.read_csv(Path(__file__).resolve().parent.parent / "Data" / "scraped_data.csv",
+                          usecols=['season', 'date', 'time'])
+    rng = np.random.default_rng(seed)
+    rows = scraped.iloc[rng.integers(0, len(scraped), n_rows)].reset_index(drop=True)
+    extra = rng.random(n_rows) < 0.05
+    rows.loc[extra, 'time'] = rng.choice(EXTRA_TIMES, extra.sum())
+    return rows
+
+
+def best_time(func, data: pd.DataFrame, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        copy = data.copy()
+        start = time.perf_counter()
+        result = func(copy)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = synthetic_rows(args.rows)
+    legacy_time, legacy = best_time(legacy_add_datetime_column, data, args.repeat)
+    vectorized_time, vectorized = best_time(add_datetime_column, data, args.repeat)
+
+    # the legacy hour is only right for 1-9 o'clock PM kickoffs, and it has no minutes
+    comparable = data['time'].str.match(r'^[1-9]:\d{2}PM')
+    np.testing.assert_array_equal(
+        legacy.loc[comparable, 'date_time'].to_numpy(),
+        vectorized.loc[comparable, 'date_time'].dt.floor('H').to_numpy(),
+    )
+    wrong = (legacy['date_time'] != vectorized['date_time'].dt.floor('H')).sum()
+
+    print(f"rows: {args.rows:,}")
+    print(f"legacy:     {legacy_time:.3f} s")
+    print(f"vectorized: {vectorized_time:.3f} s ({legacy_time / vectorized_time:.1f}x)")
+    print(f"rows with a wrong legacy hour: {wrong:,} ({wrong / args.rows:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+########## bench_page_parser.py ##########
+"""
+Per-page parse time and peak memory of the team page parsers, on saved pages:
+    - old: `pd.read_html(..., match="Schedule & Game Results")` on the whole page + droplevel
+    - new: `parse_games_table`, which only parses the games table with lxml
+
+Each path runs in its own process so the peak RSS of one does not hide the other.
+
+Usage:
+    python -m benchmarks.bench_page_parser [--fixtures DIR] [--repeat 3]
+"""
+
+
+# common imports
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from benchmarks.common import load_team_pages
+from src import parallel
+from src.page_parser import parse_games_table
+
+
+def old_parse(page_html: str) -> pd.DataFrame:
+    df = pd.read_html(page_html, header=None, match="Schedule & Game Results")[0]
+    df.columns = df.columns.droplevel()
+    return df
+
+
+def new_parse(page_html: str) -> pd.DataFrame:
+    return parse_games_table(page_html)
+
+
+PARSERS = {"old": old_parse, "new": new_parse}
+
+
+def run_parser(name: str, fixtures: str, repeat: int) -> dict:
+    pages = load_team_pages(fixtures)
+    if not pages:
+        raise SystemExit("No saved team pages found - run scrape() once or pass --fixtures")
+    parse = PARSERS[name]
+
+    baseline_rss = parallel.peak_rss_bytes()
+    failures = 0
+    timings = []
+    for _ in range(repeat):
+        for page in pages:
+            start = time.perf_counter()
+            try:
+                parse(page)
+            except ValueError:
+                # pd.read_html can't see tables hidden in html comments
+                failures += 1
+            timings.append(time.perf_counter() - start)
+
+    timings = pd.Series(timings)
+    return {
+        "parser": name,
+        "pages": len(pages),
+        "failures": failures // repeat,
+        "mean_ms": timings.mean() * 1000,
+        "p50_ms": timings.quantile(0.5) * 1000,
+        "p99_ms": timings.quantile(0.99) * 1000,
+        "peak_rss_delta_mb": (parallel.peak_rss_bytes() - baseline_rss) / 1024 ** 2,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=None, help="folder with saved team pages (default: the HTTP cache)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", choices=list(PARSERS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.only:
+        print(json.dumps(run_parser(args.only, args.fixtures, args.repeat)))
+        return
+
+    results = []
+    for name in PARSERS:
+        command = [sys.executable, "-m", "benchmarks.bench_page_parser", "--only", name, "--repeat", str(args.repeat)]
+        if args.fixtures:
+            command += ["--fixtures", args.fixtures]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output))
+
+    print(pd.DataFrame(results).set_index("parser").round(2).to_string())
+
+
+if __name__ == "__main__":
+    main()
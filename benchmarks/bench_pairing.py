@@ -0,0 +1,91 @@
+########## bench_pairing.py ##########
+"""
+Wall time of building the game level data (one row per game, home and away team side by side):
+    - merge: the split/add_prefix/merge/sort/drop/rename steps of 03_data_prep.ipynb
+    - paired: `pair_home_away_games`, one hash pass over integer game keys
+
+on the prepared data of Data/scraped_data.csv stacked 1x, 10x, 100x and 1000x (every copy shifted to its own
+seasons and kickoff times, so the games stay distinct). Only a couple of feature columns are carried to keep the largest
+scale in memory. The outputs are checked to hold the same games.
+
+Usage:
+    python -m benchmarks.bench_pairing [--factors 1 10 100 1000] [--repeat 3]
+"""
+
+
+# common imports
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import load_prepared_data, stack_seasons
+from src import parallel
+from src.data_preparation import add_rolling_features, pair_home_away_games
+
+FEATURES = ['win_rate_last_4_games', 'points_scored_rate_last_4_games']
+
+
+def merge_home_away_games(data: pd.DataFrame) -> pd.DataFrame:
+    # the game level data steps of 03_data_prep.ipynb
+    columns = ['season', 'week', 'team', 'opp', 'date_time'] + FEATURES + ['win']
+    home = data[data['home_or_away'] == 'HOME'][columns].add_prefix('home_team_')
+    away = data[data['home_or_away'] == 'AWAY'][columns].add_prefix('away_team_')
+    games = home.merge(
+        away, how='right',
+        left_on=['home_team_opp', 'home_team_date_time'], right_on=['away_team_team', 'away_team_date_time'],
+    )
+    games = games.sort_values(by=['home_team_date_time'], ignore_index=True)
+    games = games.drop(columns=['away_team_win', 'home_team_opp', 'away_team_opp', 'away_team_season',
+                                'away_team_week', 'away_team_date_time'])
+    return games.rename(columns={'home_team_season': 'season', 'home_team_week': 'week', 'home_team_team': 'home_team',
+                                 'home_team_date_time': 'date_time', 'away_team_team': 'away_team'})
+
+
+
+def best_time(func, data: pd.DataFrame, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(data)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--factors", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    base = add_rolling_features(load_prepared_data(), n_games=[4])
+    base = base[['season', 'week', 'team', 'opp', 'date_time', 'home_or_away'] + FEATURES + ['win']]
+
+    rows = []
+    for factor in args.factors:
+        data = stack_seasons(base, factor)
+        merge_time, merged = best_time(merge_home_away_games, data, args.repeat)
+        paired_time, paired = best_time(lambda df: pair_home_away_games(df, columns=FEATURES), data, args.repeat)
+
+        keys = ['season', 'week', 'home_team']
+        np.testing.assert_array_equal(
+            merged.sort_values(keys)[keys + ['away_team']].to_numpy(),
+            paired.sort_values(keys)[keys + ['away_team']].to_numpy(),
+        )
+        rows.append({
+            'factor': factor,
+            'rows': len(data),
+            'merge (s)': round(merge_time, 3),
+            'paired (s)': round(paired_time, 3),
+            'speedup': round(merge_time / paired_time, 1),
+            'paired ns/row': round(paired_time / len(data) * 1e9),
+        })
+        del data, merged, paired
+
+    print(pd.DataFrame(rows).to_string(index=False))
+    print(f"peak RSS: {parallel.peak_rss_bytes() / 1024 ** 2:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+########## bench_parallel_features.py ##########
+"""
+Scaling of `add_rolling_features(..., n_jobs=k)` with the number of processes on a synthetic dataset of
+1000 teams x 100 seasons x 17 games (1.7M team-game rows, 12 source columns, windows [1, 4, 8]).
+Every parallel output is checked to be identical to the serial one.
+
+Usage:
+    python -m benchmarks.bench_parallel_features [--teams 1000] [--seasons 100] [--jobs 1 2 4 8] [--repeat 3]
+"""
+
+
+# common imports
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data_preparation import ROLLING_FEATURES, add_rolling_features, rolling_feature_name
+
+N_GAMES = [1, 4, 8]
+GAMES_PER_SEASON = 17
+
+
+def synthetic_team_games(n_teams: int, n_seasons: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    n_rows = n_teams * n_seasons * GAMES_PER_SEASON
+    team = np.repeat(np.arange(n_teams), n_seasons * GAMES_PER_SEASON)
+    season = np.tile(np.repeat(np.arange(1900, 1900 + n_seasons), GAMES_PER_SEASON), n_teams)
+    week = np.tile(np.arange(GAMES_PER_SEASON), n_teams * n_seasons)
+
+    data = pd.DataFrame({
+        'team': pd.Categorical.from_codes(team, [f'Team {i:04d}' for i in range(n_teams)]).astype(object),
+        'season': season,
+        'date_time': pd.to_datetime((season - 1970) * 365 + 250 + week * 7, unit='D'),
+        'result': np.where(rng.random(n_rows) < 0.5, 'W', 'L'),
+        'ot': np.where(rng.random(n_rows) < 0.05, 'OT', None),
+    })
+    for source in ROLLING_FEATURES:
+        if source not in data:
+            data[source] = rng.integers(0, 400, n_rows).astype(np.float64)
+    # blank turnovers, like on the website
+    data.loc[rng.random(n_rows) < 0.2, 'to'] = np.nan
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teams", type=int, default=1000)
+    parser.add_argument("--seasons", type=int, default=100)
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = synthetic_team_games(args.teams, args.seasons)
+    features = [rolling_feature_name(source, n) for source in ROLLING_FEATURES for n in N_GAMES]
+    print(f"rows: {len(data):,}, CPUs: {os.cpu_count()}")
+
+    rows, serial = [], None
+    for n_jobs in args.jobs:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = add_rolling_features(data, n_games=N_GAMES, n_jobs=n_jobs)[features]
+            timings.append(time.perf_counter() - start)
+        if serial is None:
+            serial, serial_time = result, min(timings)
+        else:
+            pd.testing.assert_frame_equal(serial, result, check_exact=True)
+        rows.append({'n_jobs': n_jobs, 'time (s)': round(min(timings), 3), 'speedup': round(serial_time / min(timings), 2)})
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
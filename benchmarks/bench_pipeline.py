@@ -0,0 +1,97 @@
+########## bench_pipeline.py ##########
+"""
+Wall time and peak memory of the whole preparation of 03_data_prep.ipynb, from scraped_data.csv to the game
+level data: the cleansing steps, the twelve add_*_rates_last_n_games functions (windows [1, 4, 8]) and
+`pair_home_away_games`.
+
+The scraped data is stacked `factor` times (every copy with its kickoff times moved by a few seconds, so a
+team plays `factor` games per week), and every factor runs in its own process so the peak RSS of one run
+does not hide the others. The RSS reported is the peak of the process minus its RSS before the pipeline.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--factors 1 10 50] [--repeat 3]
+"""
+
+
+# common imports
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from benchmarks.common import stacked_scraped_data
+from src import data_preparation as dp
+from src import parallel
+
+N_GAMES = [1, 4, 8]
+RATE_FUNCTIONS = [
+    dp.add_win_rates_last_n_games, dp.add_passing_rates_last_n_games, dp.add_rushing_rates_last_n_games,
+    dp.add_passing_allowed_rates_last_n_games, dp.add_rushing_allowed_rates_last_n_games, dp.add_ot_rates_last_n_games,
+    dp.add_to_rates_last_n_games, dp.add_to_forced_rates_last_n_games, dp.add_points_scored_rates_last_n_games,
+    dp.add_points_allowed_rates_last_n_games, dp.add_1st_down_rates_last_n_games,
+    dp.add_1st_down_allowed_rates_last_n_games,
+]
+
+
+
+def run_pipeline(data: pd.DataFrame) -> pd.DataFrame:
+    # the cells of 03_data_prep.ipynb
+    data = dp.fix_opponent_names(data)
+    data = dp.map_team_abbreviations_to_names(data)
+    data = dp.add_home_or_away_column(data)
+    data = dp.add_datetime_column(data)
+    data = dp.convert_week_objects(data)
+    for add_rates in RATE_FUNCTIONS:
+        data = add_rates(data, N_GAMES)
+    return dp.pair_home_away_games(data, unpaired='warn')
+
+
+def run_factor(factor: int, repeat: int) -> dict:
+    data = stacked_scraped_data(factor)
+    baseline_rss = parallel.peak_rss_bytes()
+    timings = []
+    for _ in range(repeat):
+        copy = data.copy()
+        start = time.perf_counter()
+        run_pipeline(copy)
+        timings.append(time.perf_counter() - start)
+        del copy
+    return {
+        'factor': factor,
+        'rows': len(data),
+        'time (s)': round(min(timings), 3),
+        'peak RSS (MB)': round((parallel.peak_rss_bytes() - baseline_rss) / 1024 ** 2, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--factors", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        import warnings
+        # stacked copies of the same game are reported as duplicated games, that's expected here, but a frame
+        # fragmented by inserting columns one at a time is an error
+        warnings.simplefilter('ignore')
+        warnings.simplefilter('error', pd.errors.PerformanceWarning)
+        print(json.dumps(run_factor(args.worker, args.repeat)))
+        return
+
+    rows = []
+    for factor in args.factors:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_pipeline", "--worker", str(factor), "--repeat", str(args.repeat)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        rows.append(json.loads(output.strip().splitlines()[-1]))
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+########## bench_predictor.py ##########
+"""
+Latency of the `Predictor` (p50/p99 over many requests) for a single game and for a 16-game slate:
+    - in process: `predict` / `predict_slate`
+    - http: GET /predict and POST /slate of `make_server`, on localhost with a keep-alive connection
+    - matchups: the same requests once the matchup matrix is loaded (`load_matchups`), i.e. lookups
+
+The model is trained on the game level data of Data/scraped_data.csv up to 2021 and the slates are drawn
+at random among the 32 teams.
+
+Usage:
+    python -m benchmarks.bench_predictor [--requests 2000]
+"""
+
+
+# common imports
+import argparse
+import http.client
+import json
+import tempfile
+import threading
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import load_prepared_data
+from src import data_preparation as dp
+from src import teams
+from src.predictor import Predictor, make_server, train_model
+
+SLATE_SIZE = 16
+
+
+def random_slates(n_slates: int, size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    slates = []
+    for _ in range(n_slates):
+        ids = rng.permutation(len(teams.TEAMS))[:2 * size]
+        slates.append([(teams.TEAM_NAMES[home], teams.TEAM_NAMES[away]) for home, away in ids.reshape(-1, 2)])
+    return slates
+
+
+def latencies(func, requests) -> dict:
+    timings = np.empty(len(requests))
+    for i, request in enumerate(requests):
+        start = time.perf_counter()
+        func(request)
+        timings[i] = time.perf_counter() - start
+    return {'p50 (us)': round(np.percentile(timings, 50) * 1e6), 'p99 (us)': round(np.percentile(timings, 99) * 1e6)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    data = load_prepared_data()
+    with warnings.catch_warnings():
+        # the last games of the data are not played yet
+        warnings.simplefilter('ignore')
+        games = dp.pair_home_away_games(dp.add_rolling_features(data, n_games=[1, 4, 8]))
+    games = dp.add_team_id_columns(games, ['home_team', 'away_team'])
+    predictor = Predictor(train_model(games, last_season=2021), data)
+
+    singles = [slate[:1] for slate in random_slates(args.requests, 1, seed=1)]
+    slates = random_slates(args.requests, SLATE_SIZE, seed=2)
+    # warm up
+    predictor.predict_slate(slates[0])
+
+    server = make_server(predictor, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+
+    def get(games):
+        (home, away), = games
+        connection.request('GET', f'/predict?home={home.replace(" ", "+")}&away={away.replace(" ", "+")}')
+        return json.loads(connection.getresponse().read())
+
+    def post(games):
+        connection.request('POST', '/slate', body=json.dumps({'games': games}), headers={'Content-Type': 'application/json'})
+        return json.loads(connection.getresponse().read())
+
+    def run_requests(mode: str) -> list:
+        return [
+            {'mode': mode, 'request': 'predict (1 game)', **latencies(lambda g: predictor.predict(*g[0]), singles)},
+            {'mode': mode, 'request': f'predict_slate ({SLATE_SIZE} games)', **latencies(predictor.predict_slate, slates)},
+            {'mode': mode, 'request': 'GET /predict (1 game)', **latencies(get, singles)},
+            {'mode': mode, 'request': f'POST /slate ({SLATE_SIZE} games)', **latencies(post, slates)},
+        ]
+
+    rows = run_requests('model')
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        predictor.load_matchups(directory)
+        build_time = time.perf_counter() - start
+        rows += run_requests('matchups')
+        predictor.matchups = None
+    server.shutdown()
+
+    print(pd.DataFrame(rows).to_string(index=False))
+    print(f"matchup matrix built and mapped in {build_time * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
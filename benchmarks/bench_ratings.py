@@ -0,0 +1,65 @@
+########## bench_ratings.py ##########
+"""
+Time of the Elo ratings of src/ratings.py on Data/scraped_data.csv:
+    - replay: every game of the history in one `update`
+    - weekly: the last season fed a week at a time, after replaying the seasons before it
+    - features: `add_elo_features` on the game level rows of Data/transformed.csv
+
+Usage:
+    python -m benchmarks.bench_ratings [--repeat 5]
+"""
+
+
+# common imports
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import load_prepared_data
+from src.ratings import EloRatings, add_elo_features
+
+
+def best_time(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = load_prepared_data()
+    game_level_data = pd.read_csv(Path(__file__).resolve().parent.parent / "Data" / "transformed.csv")
+    last_season = data['season'].max()
+    history, season = data[data['season'] < last_season], data[data['season'] == last_season]
+    weeks = [season[season['week'] == week] for week in np.unique(season['week'])]
+
+    def weekly():
+        elo = EloRatings()
+        elo.update(history)
+        start = time.perf_counter()
+        for rows in weeks:
+            elo.update(rows)
+        return time.perf_counter() - start
+
+    rows = [
+        {'run': f'replay ({data["season"].min()}-{last_season}, {len(data)} rows)',
+         'time (ms)': best_time(lambda: EloRatings().update(data), args.repeat) * 1e3},
+        {'run': f'weekly ({len(weeks)} updates of {last_season})',
+         'time (ms)': min(weekly() for _ in range(args.repeat)) * 1e3},
+        {'run': f'add_elo_features ({len(game_level_data)} games)',
+         'time (ms)': best_time(lambda: add_elo_features(game_level_data, data), args.repeat) * 1e3},
+    ]
+    print(pd.DataFrame(rows).round(1).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+########## bench_rolling_features.py ##########
+"""
+Wall time of the rolling features of 03_data_prep.ipynb (12 source columns x windows [1, 4, 8]):
+    - legacy: one function per source column, each one re-sorting the frame and running
+      groupby().shift(1).rolling(n).mean() for every window
+    - fused: `add_rolling_features`, one sort and one cumulative-sum pass for every column and window
+
+on Data/scraped_data.csv scaled up 1x, 10x and 100x. The outputs are checked to be identical.
+
+Usage:
+    python -m benchmarks.bench_rolling_features [--factors 1 10 100] [--repeat 3]
+"""
+
+
+# common imports
+import argparse
+import time
+from typing import List
+
+import pandas as pd
+
+from benchmarks.common import load_prepared_data, scale_up
+from src.data_preparation import (
+    ROLLING_FEATURES, add_rolling_features, add_rolling_source_columns, rolling_feature_name,
+    sort_data_by_team_and_datetime,
+)
+
+N_GAMES = [1, 4, 8]
+
+
+def legacy_rolling_features(data: pd.DataFrame, n_games: List[int] = N_GAMES) -> pd.DataFrame:
+    # what the twelve add_*_rates_last_n_games functions did before they shared the fused engine
+    for source in ROLLING_FEATURES:
+        data = add_rolling_source_columns(data, [source])
+        data = sort_data_by_team_and_datetime(data)
+        for n in n_games:
+            data[rolling_feature_name(source, n)] = (
+                data
+                .groupby(['team', 'season'])[source]
+                .shift(1)
+                .rolling(n, min_periods=n).mean()
+                .reset_index(drop=True)
+            )
+    return data
+
+
+def fused_rolling_features(data: pd.DataFrame, n_games: List[int] = N_GAMES) -> pd.DataFrame:
+    return add_rolling_features(data, n_games=n_games)
+
+
+def best_time(func, data: pd.DataFrame, repeat: int, columns: List[str]):
+    # only the feature columns of the last run are kept, so the 100x scale fits in memory
+    timings = []
+    for _ in range(repeat):
+        copy = data.copy()
+        start = time.perf_counter()
+        result = func(copy)
+        timings.append(time.perf_counter() - start)
+        del copy
+        result = result[columns]
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--factors", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    base = load_prepared_data()
+    features = [rolling_feature_name(source, n) for source in ROLLING_FEATURES for n in N_GAMES]
+
+    rows = []
+    for factor in args.factors:
+        data = scale_up(base, factor)
+        legacy_time, legacy = best_time(legacy_rolling_features, data, args.repeat, features)
+        fused_time, fused = best_time(fused_rolling_features, data, args.repeat, features)
+        pd.testing.assert_frame_equal(legacy, fused, check_exact=True)
+        del legacy, fused
+        rows.append({
+            "scale": f"{factor}x",
+            "rows": len(data),
+            "legacy_s": legacy_time,
+            "fused_s": fused_time,
+            "speedup": legacy_time / fused_time,
+        })
+
+    print(pd.DataFrame(rows).set_index("scale").round(3).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+########## bench_simulation.py ##########
+"""
+Time of `simulate_season` for the 2022 season as it stood after a few weeks, serial and with one process per
+CPU, for growing numbers of simulated seasons. The win probabilities come from the model trained on the game
+level data of Data/scraped_data.csv up to 2021 (`model_probabilities`).
+
+Usage:
+    python -m benchmarks.bench_simulation [--after-week 0 8 14] [--sims 10000 100000 1000000]
+"""
+
+
+# common imports
+import argparse
+import time
+import warnings
+
+import pandas as pd
+
+from benchmarks.common import load_prepared_data
+from src import data_preparation as dp
+from src import parallel
+from src.predictor import Predictor, train_model
+from src.simulation import model_probabilities, season_state, simulate_season
+
+SEASON = 2022
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--after-week", type=int, nargs="+", default=[0, 8, 14])
+    parser.add_argument("--sims", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--n-jobs", type=int, default=-1, help="processes of the parallel runs")
+    args = parser.parse_args()
+
+    data = load_prepared_data()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        games = dp.pair_home_away_games(dp.add_rolling_features(data, n_games=[1, 4, 8]))
+    bundle = train_model(dp.add_team_id_columns(games, ['home_team', 'away_team']), last_season=SEASON - 1)
+
+    rows = []
+    for after_week in args.after_week:
+        state = season_state(data, SEASON, after_week)
+        known = data[(data['season'] < SEASON) | ((data['season'] == SEASON) & (data['week'] <= after_week))]
+        probabilities, matchups = model_probabilities(Predictor(bundle, known), state)
+        for n_sims in args.sims:
+            for n_jobs in (None, args.n_jobs):
+                start = time.perf_counter()
+                simulate_season(state, probabilities, matchups, n_sims, n_jobs=n_jobs)
+                rows.append({'after week': after_week, 'games left': len(state.home), 'seasons': n_sims,
+                             'processes': parallel.resolve_n_jobs(n_jobs), 'time (s)': round(time.perf_counter() - start, 3)})
+
+    print(pd.DataFrame(rows).to_string(index=False))
+    print(f"peak RSS: {parallel.peak_rss_bytes() / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
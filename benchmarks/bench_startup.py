@@ -0,0 +1,107 @@
+########## bench_startup.py ##########
+"""
+Startup cost of the entry points, each in a fresh interpreter:
+    - the import time of the modules a command starts from (`python -X importtime`), with its slowest imports
+    - the wall time of the `nfl-predict` commands that answer without the heavy libraries
+    - which heavy libraries (pandas, scikit-learn, bs4, ...) the light modules load
+
+The import and command times are checked against a budget, and the light modules must not load any heavy
+library: the exit status is 1 otherwise. The budgets leave room for slower machines, the wall times include
+the interpreter startup (`python -c pass`, printed first).
+
+Usage:
+    python -m benchmarks.bench_startup [--repeat 5] [--top 5]
+"""
+
+
+# common imports
+import argparse
+import time
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+
+from benchmarks.common import import_times, run_python
+
+# cumulative import time budget (ms), None is only reported
+IMPORT_BUDGETS = {
+    'src.paths': 5,
+    'src.cli': 20,
+    'src.fetching': 40,
+    'src.teams': 150,
+    'src.scraping': 200,
+    'src.predictor': None,
+    'src.pipeline': None,
+}
+SCRAPED_DATA = str(Path(__file__).resolve().parent.parent / "Data" / "scraped_data.csv")
+# wall time budget (ms) of a command, interpreter startup included
+COMMAND_BUDGETS = {
+    ('--help',): 200,
+    ('latest', '--input', SCRAPED_DATA): 300,
+}
+# the modules `nfl-predict --help`/`latest` and the scraping constants go through
+LIGHT_MODULES = ['src.paths', 'src.cli', 'src.fetching', 'src.teams', 'src.scraping']
+HEAVY_MODULES = ['pandas', 'sklearn', 'bs4', 'lxml', 'requests', 'pyarrow', 'scipy']
+
+
+def wall_time(*args: str) -> float:
+    start = time.perf_counter()
+    run_python(*args)
+    return time.perf_counter() - start
+
+
+def heavy_imports(module: str) -> List[str]:
+    """
+    Heavy libraries in sys.modules once `module` is imported.
+    """
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    return run_python('-c', code).stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="slowest imports listed under every module")
+    args = parser.parse_args()
+
+    print(f"interpreter startup: {min(wall_time('-c', 'pass') for _ in range(args.repeat)) * 1e3:.1f} ms\n")
+    failures = []
+    rows = []
+    for module, budget in IMPORT_BUDGETS.items():
+        runs = [import_times(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run[-1]['cumulative_us'])
+        ms = best[-1]['cumulative_us'] / 1e3
+        heavy = heavy_imports(module) if module in LIGHT_MODULES else []
+        over = budget is not None and ms > budget
+        if over or heavy:
+            failures.append(module)
+        rows.append({'module': module, 'import (ms)': round(ms, 1), 'budget (ms)': '' if budget is None else budget,
+                     'heavy imports': ' '.join(heavy), 'status': 'FAIL' if over or heavy else ''})
+        # the slowest imports under it: the rows printed since the previous top-level import (interpreter startup)
+        start = max((i + 1 for i, row in enumerate(best[:-1]) if row['depth'] == 0), default=0)
+        children = sorted(best[start:-1], key=lambda row: -row['cumulative_us'])[:args.top]
+        rows += [{'module': f"  {row['module']}", 'import (ms)': round(row['cumulative_us'] / 1e3, 1)}
+                 for row in children]
+    table = pd.DataFrame(rows).fillna('')
+    width = table['module'].str.len().max()
+    # left aligned, so the imports are indented under their module
+    print(table.to_string(index=False, formatters={'module': f'{{:<{width}}}'.format}))
+
+    rows = []
+    for command, budget in COMMAND_BUDGETS.items():
+        ms = min(wall_time('-m', 'src.cli', *command) for _ in range(args.repeat)) * 1e3
+        if ms > budget:
+            failures.append(' '.join(command))
+        rows.append({'command': ' '.join(['nfl-predict', *command]).replace(SCRAPED_DATA, 'Data/scraped_data.csv'),
+                     'wall (ms)': round(ms, 1), 'budget (ms)': budget, 'status': 'FAIL' if ms > budget else ''})
+    print()
+    print(pd.DataFrame(rows).to_string(index=False))
+
+    if failures:
+        print(f"\nover budget or loading heavy libraries: {', '.join(failures)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
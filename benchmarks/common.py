@@ -0,0 +1,133 @@
+########## common.py ##########
+
+
+# common imports
+import gzip
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.http_cache import HTTP_CACHE_DIR
+
+
+def load_team_pages(fixtures_dir: Optional[Path] = None) -> List[str]:
+    """
+    Loads saved team pages to benchmark the parsers with.
+
+    Args:
+        fixtures_dir (Path, optional): folder with saved team pages (*.htm / *.html). Default is to use the
+        team pages stored in the HTTP cache by `scrape()`.
+
+    Returns:
+        List[str]: html of every page found
+    """
+    if fixtures_dir is not None:
+        paths = sorted(Path(fixtures_dir).rglob("*.htm*"))
+        return [path.read_text(encoding="utf-8") for path in paths]
+
+    pages = []
+    for meta_path in sorted(HTTP_CACHE_DIR.glob("*/*.json")):
+        if "/teams/" not in json.loads(meta_path.read_text())["url"]:
+            continue
+        body_path = meta_path.with_name(meta_path.name.replace(".json", ".html.gz"))
+        pages.append(gzip.decompress(body_path.read_bytes()).decode("utf-8"))
+    return pages
+
+
+def load_prepared_data() -> "pd.DataFrame":
+    """
+    Data/scraped_data.csv run through the cleansing steps of 03_data_prep.ipynb, i.e. what the
+    feature engineering functions get as input.
+    """
+    import pandas as pd
+    from src import data_preparation as dp
+
+    data = pd.read_csv(Path(__file__).resolve().parent.parent / "Data" / "scraped_data.csv")
+    data = dp.fix_opponent_names(data)
+    data = dp.map_team_abbreviations_to_names(data)
+    data = dp.add_home_or_away_column(data)
+    data = dp.add_datetime_column(data)
+    data = dp.convert_week_objects(data)
+    return data
+
+
+def scale_up(data: "pd.DataFrame", factor: int) -> "pd.DataFrame":
+    """
+    Stacks `factor` copies of the data, every copy with its own team names, so the result has
+    `factor` times more rows and (team, season) groups.
+    """
+    import pandas as pd
+
+    if factor == 1:
+        return data.copy()
+    copies = []
+    for k in range(factor):
+        copy = data.copy()
+        copy["team"] = copy["team"] + f" #{k}"
+        copy["opp"] = copy["opp"] + f" #{k}"
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def stack_seasons(data: "pd.DataFrame", factor: int) -> "pd.DataFrame":
+    """
+    Stacks `factor` copies of prepared data, every copy moved to its own seasons (and its kickoff times by a
+    few seconds), so the result has `factor` times more seasons and games with the same 32 teams.
+    """
+    import pandas as pd
+
+    span = int(data['season'].max() - data['season'].min() + 1)
+    # the kickoff times are moved by k seconds too, the notebook merge matches the games on the date
+    copies = [
+        data.assign(season=data['season'] + k * span, date_time=data['date_time'] + pd.Timedelta(seconds=k))
+        for k in range(factor)
+    ]
+    return pd.concat(copies, ignore_index=True)
+
+
+def stacked_scraped_data(factor: int) -> "pd.DataFrame":
+    """
+    Data/scraped_data.csv stacked `factor` times, every copy with its kickoff times moved by k minutes,
+    i.e. raw rows for the cleansing steps (team names and seasons stay valid).
+    """
+    import pandas as pd
+
+    scraped = pd.read_csv(Path(__file__).resolve().parent.parent / "Data" / "scraped_data.csv")
+    if factor == 1:
+        return scraped
+    copies = []
+    for k in range(factor):
+        copy = scraped.copy()
+        # "1:00PM ET" -> "1:00PM ET" k seconds later would need seconds, so the copies get their own minute instead
+        copy['time'] = copy['time'].str.replace(r':(\d\d)', lambda m: f':{(int(m[1]) + k) % 60:02d}', regex=True)
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    """
+    Runs `args` in a fresh interpreter from the root of the repository (e.g. `run_python('-m', 'src.cli', 'latest')`),
+    i.e. with the startup cost a command line pays. Raises CalledProcessError if it fails.
+    """
+    root = Path(__file__).resolve().parent.parent
+    return subprocess.run([sys.executable, *args], cwd=root, capture_output=True, text=True, check=True)
+
+
+def import_times(module: str) -> List[Dict[str, Any]]:
+    """
+    `python -X importtime -c "import <module>"` in a fresh interpreter: the self and cumulative import time (us)
+    of every module it loads, in the order they finished loading, with how deep they were imported. The last
+    row is `module` itself, its cumulative time is the cost of the import.
+    """
+    stderr = run_python('-X', 'importtime', '-c', f'import {module}').stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # one space before a top-level name, two more per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append({'module': name.strip(), 'depth': depth, 'self_us': int(self_us), 'cumulative_us': int(cumulative_us)})
+    return rows
@@ -0,0 +1,399 @@
+########## suite.py ##########
+"""
+Benchmark suite of the scraping -> preparation -> model path, to tell whether a change made something slower.
+
+Every benchmark times one function on a fixture built from Data/scraped_data.csv, most of them at several
+scales: the data stacked 10x, 100x (1000x on request) with more teams (rolling features) or more seasons
+(pairing). The page parsing benchmarks use saved team pages (the HTTP cache of `scrape()` or --fixtures) and
+are skipped without them. The startup benchmarks run a fresh interpreter: the import time of the entry point
+modules (`python -X importtime`, whose rows are kept in the JSON too) and the wall time of `nfl-predict` commands.
+
+A run is written as JSON with the machine metadata (CPU, platform, Python and package versions, git commit),
+and `--compare` checks it against an earlier run: a benchmark whose best time grew by more than `--threshold`
+is flagged as a regression and the exit status is 1. Only runs of the same machine are comparable, and on shared
+or virtual machines the times of two processes can differ by more than 20% - use a larger --threshold there.
+The exit status is 1 as well when a benchmark raised a pandas PerformanceWarning (a fragmented frame).
+
+Usage:
+    python -m benchmarks.suite [--scales 1 10 100] [--repeat 5] [--filter rolling] [--output run.json]
+    python -m benchmarks.suite --compare DATA_DIR/benchmarks/<baseline>.json [--threshold 0.2]
+    python -m benchmarks.suite --list
+"""
+
+
+# common imports
+import argparse
+import datetime
+import importlib.metadata
+import json
+import math
+import os
+import platform
+import re
+import statistics
+import subprocess
+import time
+import warnings
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import (
+    import_times, load_prepared_data, load_team_pages, run_python, scale_up, stack_seasons, stacked_scraped_data,
+)
+from src import data_preparation as dp
+from src.paths import DATA_DIR
+
+RESULTS_DIR = DATA_DIR / "benchmarks"
+ROOT = Path(__file__).resolve().parent.parent
+
+N_GAMES = [1, 4, 8]
+RATE_FUNCTIONS = [
+    dp.add_win_rates_last_n_games, dp.add_passing_rates_last_n_games, dp.add_rushing_rates_last_n_games,
+    dp.add_passing_allowed_rates_last_n_games, dp.add_rushing_allowed_rates_last_n_games, dp.add_ot_rates_last_n_games,
+    dp.add_to_rates_last_n_games, dp.add_to_forced_rates_last_n_games, dp.add_points_scored_rates_last_n_games,
+    dp.add_points_allowed_rates_last_n_games, dp.add_1st_down_rates_last_n_games,
+    dp.add_1st_down_allowed_rates_last_n_games,
+]
+SLATE_SIZE = 16
+# a sample lasts at least this long, fast functions are called several times per sample
+MIN_SAMPLE_TIME = 0.01
+# slowdowns smaller than this are noise, whatever the ratio
+MIN_DIFFERENCE = 50e-6
+PACKAGES = ['numpy', 'pandas', 'scikit-learn', 'lxml', 'threadpoolctl']
+# entry points of the startup benchmarks, see benchmarks/bench_startup.py for their budgets
+STARTUP_MODULES = ['src.cli', 'src.scraping', 'src.predictor']
+
+
+### FIXTURES ###
+
+
+class Fixtures:
+    """
+    Inputs of the benchmarks, built on first use and kept until `release(scale)`.
+    """
+
+    def __init__(self, pages_dir: Optional[Path] = None):
+        self.pages_dir = pages_dir
+        self._cache: Dict[Tuple[str, int], Any] = {}
+
+    def _cached(self, name: str, scale: int, build: Callable[[], Any]) -> Any:
+        if (name, scale) not in self._cache:
+            self._cache[name, scale] = build()
+        return self._cache[name, scale]
+
+    def release(self, scale: int) -> None:
+        # the scale 1 fixtures are the base of the others
+        if scale != 1:
+            self._cache = {key: value for key, value in self._cache.items() if key[1] != scale}
+
+    def scraped(self, scale: int) -> pd.DataFrame:
+        """raw scraped rows, the copies in their own minutes"""
+        return self._cached('scraped', scale, lambda: stacked_scraped_data(scale))
+
+    def prepared(self, scale: int) -> pd.DataFrame:
+        """cleansed team-game rows, the copies with their own teams"""
+        return self._cached('prepared', scale, lambda: scale_up(load_prepared_data(), scale)
+                            if scale > 1 else load_prepared_data())
+
+    def rolled(self, scale: int) -> pd.DataFrame:
+        """team-game rows with every rolling feature, the copies in their own seasons"""
+        return self._cached('rolled', scale, lambda: stack_seasons(self.rolled(1), scale) if scale > 1
+                            else dp.add_rolling_features(self.prepared(1), n_games=N_GAMES))
+
+    def game_level(self) -> pd.DataFrame:
+        def build():
+            with warnings.catch_warnings():
+                # a few games of the scraped data have a single row
+                warnings.simplefilter('ignore')
+                games = dp.pair_home_away_games(self.rolled(1))
+            return dp.add_team_id_columns(games, ['home_team', 'away_team'])
+        return self._cached('game_level', 1, build)
+
+    def bundle(self) -> Dict[str, Any]:
+        from src.predictor import train_model
+        return self._cached('bundle', 1, lambda: train_model(self.game_level(), last_season=2021))
+
+    def predictor(self):
+        from src.predictor import Predictor
+        return self._cached('predictor', 1, lambda: Predictor(self.bundle(), self.prepared(1)))
+
+    def pages(self) -> List[str]:
+        return self._cached('pages', 1, lambda: load_team_pages(self.pages_dir))
+
+
+class Benchmark(NamedTuple):
+    name: str
+    # fixtures, scale -> (arguments of func, number of rows/items processed)
+    setup: Callable[[Fixtures, int], Tuple[tuple, int]]
+    func: Callable
+    scaled: bool = True
+    # func returns the time to record (e.g. measured in a subprocess) instead of being timed
+    self_timed: bool = False
+
+
+def _parse_pages(pages: List[str]) -> None:
+    from src.page_parser import parse_games_table
+    for page in pages:
+        parse_games_table(page)
+
+
+def _random_slate(size: int, seed: int = 0) -> List[Tuple[str, str]]:
+    from src import teams
+    ids = np.random.default_rng(seed).permutation(len(teams.TEAMS))[:2 * size]
+    return [(teams.TEAM_NAMES[home], teams.TEAM_NAMES[away]) for home, away in ids.reshape(-1, 2)]
+
+
+def _all_matchups() -> List[Tuple[str, str]]:
+    from src import teams
+    return [(home, away) for home in teams.TEAM_NAMES for away in teams.TEAM_NAMES if home != away]
+
+
+def _import_time(module: str) -> float:
+    return import_times(module)[-1]['cumulative_us'] / 1e6
+
+
+def _rate_benchmark(add_rates: Callable) -> Benchmark:
+    return Benchmark(f'rolling/{add_rates.__name__}',
+                     lambda fx, scale: ((fx.prepared(scale), N_GAMES), len(fx.prepared(scale))), add_rates)
+
+
+def _fit(game_level_data: pd.DataFrame):
+    from src.predictor import train_model
+    return train_model(game_level_data, last_season=2021)
+
+
+BENCHMARKS: List[Benchmark] = [
+    Benchmark('scraping/parse_games_table', lambda fx, scale: ((fx.pages(),), len(fx.pages())), _parse_pages,
+              scaled=False),
+    Benchmark('cleansing/fix_opponent_names', lambda fx, scale: ((fx.scraped(scale),), len(fx.scraped(scale))),
+              dp.fix_opponent_names),
+    Benchmark('cleansing/map_team_abbreviations_to_names',
+              lambda fx, scale: ((fx.scraped(scale),), len(fx.scraped(scale))), dp.map_team_abbreviations_to_names),
+    Benchmark('cleansing/add_home_or_away_column', lambda fx, scale: ((fx.scraped(scale),), len(fx.scraped(scale))),
+              dp.add_home_or_away_column),
+    Benchmark('cleansing/add_datetime_column', lambda fx, scale: ((fx.scraped(scale),), len(fx.scraped(scale))),
+              dp.add_datetime_column),
+    Benchmark('cleansing/convert_week_objects', lambda fx, scale: ((fx.scraped(scale),), len(fx.scraped(scale))),
+              dp.convert_week_objects),
+    *[_rate_benchmark(add_rates) for add_rates in RATE_FUNCTIONS],
+    Benchmark('rolling/add_rolling_features (all)',
+              lambda fx, scale: ((fx.prepared(scale), None, N_GAMES), len(fx.prepared(scale))), dp.add_rolling_features),
+    # 9 windows of every source: over a hundred columns added at once
+    Benchmark('rolling/add_rolling_features (9 windows)',
+              lambda fx, scale: ((fx.prepared(scale), None, list(range(1, 10))), len(fx.prepared(scale))),
+              dp.add_rolling_features),
+    Benchmark('pairing/pair_home_away_games', lambda fx, scale: ((fx.rolled(scale),), len(fx.rolled(scale))),
+              lambda data: dp.pair_home_away_games(data, unpaired='warn')),
+    Benchmark('model/train_model', lambda fx, scale: ((fx.game_level(),), len(fx.game_level())), _fit, scaled=False),
+    Benchmark('predict/predict (1 game)', lambda fx, scale: ((fx.predictor(), *_random_slate(1)[0]), 1),
+              lambda predictor, home, away: predictor.predict(home, away), scaled=False),
+    Benchmark(f'predict/predict_slate ({SLATE_SIZE} games)',
+              lambda fx, scale: ((fx.predictor(), _random_slate(SLATE_SIZE)), SLATE_SIZE),
+              lambda predictor, games: predictor.predict_slate(games), scaled=False),
+    Benchmark('predict/predict_slate (all matchups)',
+              lambda fx, scale: ((fx.predictor(), _all_matchups()), len(_all_matchups())),
+              lambda predictor, games: predictor.predict_slate(games), scaled=False),
+    *[Benchmark(f'startup/import {module}', lambda fx, scale, module=module: ((module,), 1), _import_time,
+                scaled=False, self_timed=True) for module in STARTUP_MODULES],
+    Benchmark('startup/nfl-predict --help', lambda fx, scale: (('-m', 'src.cli', '--help'), 1), run_python,
+              scaled=False),
+    Benchmark('startup/nfl-predict latest',
+              lambda fx, scale: (('-m', 'src.cli', 'latest', '--input', str(ROOT / "Data" / "scraped_data.csv")), 1),
+              run_python, scaled=False),
+]
+
+
+### TIMING ###
+
+
+def measure(func: Callable, args: tuple, repeat: int, self_timed: bool = False) -> Dict[str, float]:
+    """
+    Best, median, mean and standard deviation of the time of one call, over `repeat` samples after a warm-up
+    call. A sample calls the function `number` times, enough for MIN_SAMPLE_TIME. A `self_timed` function
+    returns its own time and is called once per sample.
+    """
+    start = time.perf_counter()
+    func(*args)
+    warm_up = time.perf_counter() - start
+    number = 1 if self_timed else max(1, min(10_000, math.ceil(MIN_SAMPLE_TIME / max(warm_up, 1e-9))))
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            result = func(*args)
+        samples.append(result if self_timed else (time.perf_counter() - start) / number)
+    return {
+        'min': min(samples),
+        'max': max(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def machine_metadata() -> Dict[str, Any]:
+    """
+    What a run depends on besides the code: the machine, the platform, Python and the package versions, and the
+    git commit of the code.
+    """
+    def git(*args: str) -> str:
+        try:
+            return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
+
+    packages = {}
+    for package in PACKAGES:
+        try:
+            packages[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            packages[package] = None
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        memory = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': git('rev-parse', 'HEAD') or None,
+        'git_dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'hostname': platform.node(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'memory_bytes': memory,
+        'python': platform.python_version(),
+        'packages': packages,
+    }
+
+
+def run_suite(benchmarks: List[Benchmark], scales: List[int], repeat: int, fixtures: Fixtures) -> List[Dict[str, Any]]:
+    """
+    Times every benchmark at every scale (the unscaled ones at scale 1 only), in order of scale so the fixtures
+    of a scale are released before the next one is built. The pandas PerformanceWarnings raised by a benchmark
+    (e.g. a frame fragmented by inserting columns one at a time) are counted in its result.
+    """
+    results = []
+    for scale in scales:
+        for benchmark in benchmarks:
+            if not benchmark.scaled and scale != scales[0]:
+                continue
+            result = {'name': benchmark.name, 'scale': scale if benchmark.scaled else 1}
+            args, items = benchmark.setup(fixtures, scale)
+            if not items:
+                results.append({**result, 'skipped': 'no input, e.g. no saved team pages'})
+                print(f"{benchmark.name:<55} x{result['scale']:<5} skipped")
+                continue
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                timing = measure(benchmark.func, args, repeat, benchmark.self_timed)
+            # the other warnings are expected (e.g. the unpaired games of the stacked data), a fragmented frame is not
+            fragmented = sum(issubclass(warning.category, pd.errors.PerformanceWarning) for warning in caught)
+            results.append({**result, 'items': items, **timing, 'performance_warnings': fragmented})
+            print(f"{benchmark.name:<55} x{result['scale']:<5} {timing['min'] * 1e3:10.3f} ms"
+                  f"{f'  {fragmented} PerformanceWarning(s)' if fragmented else ''}")
+        fixtures.release(scale)
+    return results
+
+
+### COMPARISON ###
+
+
+def compare_runs(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.2) -> pd.DataFrame:
+    """
+    Best time of every benchmark in both runs. `status` is 'regression' when the current time is more than
+    `threshold` (relative) and MIN_DIFFERENCE (absolute) slower and every current sample is slower than every
+    baseline sample (noisy machines give overlapping samples), 'improvement' for the opposite.
+    """
+    def timings(run):
+        return {(result['name'], result['scale']): result for result in run['results'] if 'min' in result}
+
+    before, after = timings(baseline), timings(current)
+    rows = []
+    for key, new in after.items():
+        old = before.get(key)
+        if old is None:
+            continue
+        ratio = new['min'] / old['min']
+        difference = new['min'] - old['min']
+        status = ''
+        if ratio > 1 + threshold and difference > MIN_DIFFERENCE and new['min'] > old['max']:
+            status = 'regression'
+        elif ratio < 1 / (1 + threshold) and -difference > MIN_DIFFERENCE and new['max'] < old['min']:
+            status = 'improvement'
+        rows.append({'name': key[0], 'scale': key[1], 'baseline (ms)': old['min'] * 1e3,
+                     'current (ms)': new['min'] * 1e3, 'ratio': ratio, 'status': status})
+    return pd.DataFrame(rows, columns=['name', 'scale', 'baseline (ms)', 'current (ms)', 'ratio', 'status'])
+
+
+def metadata_differences(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    # what makes the times of two runs not comparable, besides the code
+    keys = ['hostname', 'processor', 'cpu_count', 'python', 'packages']
+    return [key for key in keys if baseline['metadata'].get(key) != current['metadata'].get(key)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", type=str, default=None, help="only the benchmarks whose name matches this regex")
+    parser.add_argument("--fixtures", type=str, default=None, help="folder of saved team pages")
+    parser.add_argument("--output", type=str, default=None, help="JSON file of the run. Default is in DATA_DIR/benchmarks")
+    parser.add_argument("--compare", type=str, default=None, help="JSON file of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown flagged as a regression")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args()
+
+    benchmarks = [benchmark for benchmark in BENCHMARKS if not args.filter or re.search(args.filter, benchmark.name)]
+    if args.list:
+        print("\n".join(f"{benchmark.name}{'' if benchmark.scaled else '  (scale 1 only)'}" for benchmark in benchmarks))
+        return
+
+    metadata = machine_metadata()
+    run = {
+        'metadata': metadata,
+        'settings': {'scales': args.scales, 'repeat': args.repeat, 'filter': args.filter},
+        'results': run_suite(benchmarks, args.scales, args.repeat, Fixtures(args.fixtures)),
+    }
+    if any(benchmark.name.startswith('startup/import') for benchmark in benchmarks):
+        # what every entry point imports, to see which import got slower
+        run['imports'] = {module: import_times(module) for module in STARTUP_MODULES}
+
+    if args.output:
+        output = Path(args.output)
+    else:
+        stamp = metadata['timestamp'].replace(':', '').replace('-', '')[:15]
+        output = RESULTS_DIR / f"{stamp}-{(metadata['git_commit'] or 'nogit')[:8]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(run, indent=2))
+    print(f"\nwritten to {output}")
+
+    failed = False
+    warned = [result['name'] for result in run['results'] if result.get('performance_warnings')]
+    if warned:
+        print(f"\nPerformanceWarning raised by: {', '.join(sorted(set(warned)))}")
+        failed = True
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        differences = metadata_differences(baseline, run)
+        if differences:
+            print(f"warning: the runs differ in {', '.join(differences)}, the times may not be comparable")
+        comparison = compare_runs(baseline, run, args.threshold)
+        pd.set_option('display.width', 200)
+        print(comparison.round(3).to_string(index=False))
+        regressions = comparison[comparison['status'] == 'regression']
+        if len(regressions):
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+            failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+########## backtest.py ##########
+"""
+Walk-forward backtest of the model of 04_model.ipynb: every week of every season is predicted by a model trained
+only on the games played before that week, like the model would have been used live.
+
+The seasons are independent folds and run in a process pool. Inside a season the model is refit every
+`refit_every` weeks on everything played so far (1 = every week, the most faithful; larger values trade a
+slightly staler model for fewer fits).
+
+Usage:
+    python -m src.backtest [--data transformed.csv] [--first-season 1995] [--refit-every 1] [--n-jobs -1]
+"""
+
+
+# common imports
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src import parallel
+from src.predictor import MODEL_PARAMS, PREDICTORS, game_feature_matrix
+
+# probabilities are clipped before the log-loss, like sklearn does
+EPSILON = 1e-15
+CALIBRATION_BINS = 10
+
+
+### FOLDS ###
+
+
+def _backtest_season(
+    X: np.ndarray,
+    y: np.ndarray,
+    seasons: np.ndarray,
+    kickoffs: np.ndarray,
+    season: int,
+    refit_every: int,
+    min_train_games: int,
+    params: Dict[str, Any],
+    ) -> Tuple[np.ndarray, np.ndarray, int]:
+    # runs in a worker process: walks through the weeks of one season, returns the rows predicted,
+    # their probabilities and the number of fits
+    from sklearn.ensemble import HistGradientBoostingClassifier
+
+    in_season = np.flatnonzero(seasons == season)
+    # a "week" is the set of games of one week number, taken in kickoff order
+    weeks = pd.unique(X[in_season[np.argsort(kickoffs[in_season], kind='stable')], PREDICTORS.index('week')])
+    played = ~np.isnan(y)
+
+    rows, probabilities, n_fits, model = [], [], 0, None
+    for i, week in enumerate(weeks):
+        week_rows = in_season[X[in_season, PREDICTORS.index('week')] == week]
+        week_rows = week_rows[played[week_rows]]
+        if not len(week_rows):
+            continue
+        if model is None or i % refit_every == 0:
+            train = played & (kickoffs < kickoffs[week_rows].min())
+            if train.sum() < min_train_games:
+                continue
+            model = HistGradientBoostingClassifier(**params).fit(X[train], y[train].astype(np.int64))
+            n_fits += 1
+        rows.append(week_rows)
+        probabilities.append(model.predict_proba(X[week_rows])[:, 1])
+
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0), n_fits
+    return np.concatenate(rows), np.concatenate(probabilities), n_fits
+
+
+def walk_forward(
+    game_level_data: pd.DataFrame,
+    first_season: Optional[int] = None,
+    last_season: Optional[int] = None,
+    refit_every: int = 1,
+    min_train_games: int = 256,
+    n_jobs: Optional[int] = -1,
+    predictors: Sequence[str] = PREDICTORS,
+    **params,
+    ) -> pd.DataFrame:
+    """
+    Predicts every played game of the seasons from `first_season` to `last_season` with a model trained on the
+    games that kicked off before its week.
+
+    Args:
+        game_level_data (pd.DataFrame): one row per game with the predictors and `home_team_win`
+        first_season (int, optional): first season predicted. Default is the second season of the data.
+        last_season (int, optional): last season predicted. Default is the last season of the data.
+        refit_every (int, optional): weeks between refits inside a season, 1 refits every week. Default is 1.
+        min_train_games (int, optional): weeks with fewer games before them are not predicted. Default is 256.
+        n_jobs (int, optional): processes, one season at a time each, see `parallel.resolve_n_jobs`. Default is -1.
+        predictors (Sequence[str], optional): columns the model uses. Default is PREDICTORS.
+        **params: hyperparameters overriding MODEL_PARAMS
+
+    Returns:
+        pd.DataFrame: season, week, home_team, away_team, date_time, home_team_win and the predicted
+        home_win_probability of every game predicted, in kickoff order
+    """
+    if 'week' not in predictors:
+        raise ValueError("The weeks are read from the 'week' predictor")
+    if refit_every < 1:
+        raise ValueError("refit_every must be at least 1")
+    games = game_level_data.reset_index(drop=True)
+    X = game_feature_matrix(games, predictors)
+    y = games['home_team_win'].to_numpy(dtype=np.float64)
+    seasons = games['season'].to_numpy(dtype=np.int64)
+    kickoffs = pd.to_datetime(games['date_time']).to_numpy(dtype='datetime64[ns]')
+
+    all_seasons = np.unique(seasons)
+    first_season = all_seasons[1] if first_season is None else first_season
+    last_season = all_seasons[-1] if last_season is None else last_season
+    fold_seasons = [int(season) for season in all_seasons if first_season <= season <= last_season]
+    args = (X, y, seasons, kickoffs)
+    kwargs = {'refit_every': refit_every, 'min_train_games': min_train_games, 'params': {**MODEL_PARAMS, **params}}
+
+    n_processes = min(parallel.resolve_n_jobs(n_jobs), len(fold_seasons))
+    if n_processes > 1:
+        with ProcessPoolExecutor(max_workers=n_processes, initializer=parallel.limit_threads) as executor:
+            # the longest folds (the latest seasons, with the most training data) are submitted first
+            futures = {season: executor.submit(_backtest_season, *args, season, **kwargs)
+                       for season in sorted(fold_seasons, reverse=True)}
+            results = [futures[season].result() for season in fold_seasons]
+    else:
+        results = [_backtest_season(*args, season, **kwargs) for season in fold_seasons]
+
+    rows = np.concatenate([rows for rows, _, _ in results])
+    predictions = games.loc[rows, ['season', 'week', 'home_team', 'away_team', 'date_time', 'home_team_win']]
+    predictions['home_win_probability'] = np.concatenate([probabilities for _, probabilities, _ in results])
+    predictions.attrs['n_fits'] = sum(n_fits for _, _, n_fits in results)
+    return predictions.sort_values('date_time', kind='stable', ignore_index=True)
+
+
+### METRICS ###
+
+
+def _metrics(y: np.ndarray, p: np.ndarray) -> Dict[str, float]:
+    clipped = np.clip(p, EPSILON, 1 - EPSILON)
+    bins = np.minimum((p * CALIBRATION_BINS).astype(np.int64), CALIBRATION_BINS - 1)
+    counts = np.bincount(bins, minlength=CALIBRATION_BINS)
+    gaps = np.abs(np.bincount(bins, weights=p - y, minlength=CALIBRATION_BINS))
+    return {
+        'games': len(y),
+        'accuracy': float(np.mean((p >= 0.5) == y)),
+        'log_loss': float(-np.mean(y * np.log(clipped) + (1 - y) * np.log(1 - clipped))),
+        'brier': float(np.mean((p - y) ** 2)),
+        # expected calibration error: |mean predicted - observed| of every probability bin, weighted by its games
+        'calibration_error': float(gaps.sum() / max(counts.sum(), 1)),
+        'home_win_rate': float(np.mean(y)),
+    }
+
+
+def season_report(predictions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Accuracy, log-loss, Brier score and expected calibration error of the backtest predictions, per season and
+    over all of them (the 'all' row).
+    """
+    y = predictions['home_team_win'].to_numpy(dtype=np.float64)
+    p = predictions['home_win_probability'].to_numpy(dtype=np.float64)
+    seasons = predictions['season'].to_numpy()
+    report = {int(season): _metrics(y[seasons == season], p[seasons == season]) for season in np.unique(seasons)}
+    report['all'] = _metrics(y, p)
+    return pd.DataFrame.from_dict(report, orient='index').rename_axis('season')
+
+
+def calibration_table(predictions: pd.DataFrame, bins: int = CALIBRATION_BINS) -> pd.DataFrame:
+    """
+    Reliability table of the backtest predictions: for every bin of predicted home win probability, the number
+    of games, the mean predicted probability and the observed home win rate.
+    """
+    p = predictions['home_win_probability'].to_numpy(dtype=np.float64)
+    y = predictions['home_team_win'].to_numpy(dtype=np.float64)
+    edges = np.linspace(0, 1, bins + 1)
+    bin_ids = np.minimum((p * bins).astype(np.int64), bins - 1)
+    counts = np.bincount(bin_ids, minlength=bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({
+            'bin': [f'{low:.1f}-{high:.1f}' for low, high in zip(edges[:-1], edges[1:])],
+            'games': counts,
+            'mean_predicted': np.bincount(bin_ids, weights=p, minlength=bins) / counts,
+            'observed': np.bincount(bin_ids, weights=y, minlength=bins) / counts,
+        })
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", type=str, default="transformed.csv", help="game level data file in DATA_DIR")
+    parser.add_argument("--first-season", type=int, default=None)
+    parser.add_argument("--last-season", type=int, default=None)
+    parser.add_argument("--refit-every", type=int, default=1, help="weeks between refits inside a season")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="processes, -1 for one per CPU")
+    parser.add_argument("--output", type=str, default=None, help="write the predictions to this csv file")
+    args = parser.parse_args(argv)
+
+    from src.data_preparation import load_data_from_disk
+
+    start = time.perf_counter()
+    predictions = walk_forward(load_data_from_disk(args.data), args.first_season, args.last_season,
+                               refit_every=args.refit_every, n_jobs=args.n_jobs)
+    elapsed = time.perf_counter() - start
+    pd.set_option('display.width', 200)
+    print(season_report(predictions).round(4).to_string())
+    print()
+    print(calibration_table(predictions).round(3).to_string(index=False))
+    print(f"\n{len(predictions)} games, {predictions.attrs['n_fits']} fits in {elapsed:.1f} s")
+    if args.output:
+        predictions.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
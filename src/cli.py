@@ -0,0 +1,163 @@
+########## cli.py ##########
+"""
+The `nfl-predict` command line. Only the code of the command that runs is imported, so the quick commands
+(latest, predict from the matchup matrix, --help) start without loading pandas, scikit-learn or the scraping
+libraries.
+
+    - scrape: fetch the game data into DATA_DIR/scraped_data.csv, see src/scraping.py
+    - prep: run the data preparation pipeline, see src/pipeline.py
+    - predict: home win probability of one game. Without --season/--week it is read from the matchup matrix
+      (`python -m src.predictor matchups`, or `serve --matchups`) as long as the matrix was computed from the
+      current model and scraped data, otherwise (or with --exact) the Predictor is loaded, and a stale matrix
+      is rebuilt
+    - serve: the HTTP front end of src/predictor.py
+    - latest: latest season and week of the scraped data
+
+Usage:
+    nfl-predict scrape [--incremental] [--offline] ...
+    nfl-predict prep [--output transformed.parquet] ...
+    nfl-predict predict "Kansas City Chiefs" "Buffalo Bills" [--season 2022 --week 3] [--exact]
+    nfl-predict serve [--port 8000] [--matchups]
+    nfl-predict latest
+    nfl-predict <command> --help
+
+Without installing the package, `python -m src.cli <command>` does the same.
+"""
+
+
+# common imports
+import argparse
+import csv
+import json
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from src.paths import MATCHUPS_DIR, MODEL_PATH, SCRAPED_DATA_PATH, file_digest
+
+PROG = "nfl-predict"
+COMMANDS = ('scrape', 'prep', 'predict', 'serve', 'latest')
+# the playoff rounds of the `week` column of the scraped data, in the order they are played
+PLAYOFF_ROUNDS = ('Wild Card', 'Division', 'Conf. Champ.', 'SuperBowl')
+
+
+### PREDICT ###
+
+
+def current_matchups(directory: Path = MATCHUPS_DIR) -> Tuple[Optional[Path], bool]:
+    """
+    The matchup matrix saved by `Predictor.load_matchups` for the current model and scraped data, and whether a
+    matrix is saved at all. The digests of the model and data files saved with the matrix are compared with the
+    files: a new model or new games make it stale, a copy or a new checkout of the same files doesn't.
+    """
+    matrices = list(Path(directory).glob("matchups-*.npy"))
+    if not MODEL_PATH.exists() or not SCRAPED_DATA_PATH.exists():
+        return None, bool(matrices)
+    sources = {'model': file_digest(MODEL_PATH), 'data': file_digest(SCRAPED_DATA_PATH)}
+    for path in matrices:
+        try:
+            inputs = json.loads(path.with_suffix('.json').read_text())
+        except (OSError, ValueError):
+            continue
+        if inputs.get('sources') == sources:
+            return path, True
+    return None, bool(matrices)
+
+
+def predict(argv: List[str], prog: str) -> float:
+    parser = argparse.ArgumentParser(prog=prog, description="home win probability of one game")
+    parser.add_argument("home")
+    parser.add_argument("away")
+    parser.add_argument("--season", type=int, default=None)
+    parser.add_argument("--week", type=int, default=None)
+    parser.add_argument("--exact", action="store_true", help="always load the model, never the matchup matrix")
+    args = parser.parse_args(argv)
+
+    context = {key: value for key, value in (('season', args.season), ('week', args.week)) if value is not None}
+    path, saved = (None, False) if args.exact or context else current_matchups()
+    try:
+        if path is not None:
+            import numpy as np
+            from src import teams
+            home, away = teams.team_id(args.home), teams.team_id(args.away)
+            if home == away:
+                raise ValueError("A team can't play itself")
+            probability = float(np.load(path, mmap_mode='r')[home, away])
+        else:
+            from src.predictor import Predictor
+            predictor = Predictor()
+            if saved:
+                # the saved matrix is stale (new model or new games): rebuilt for the next predictions
+                predictor.load_matchups()
+            probability = predictor.predict(args.home, args.away, **context)
+    except ValueError as error:
+        # unknown teams or a team playing itself
+        parser.error(str(error))
+    print(f"{args.away} @ {args.home}: {args.home} win probability {probability:.1%}")
+    return probability
+
+
+### LATEST ###
+
+
+def latest_week(path: Path = SCRAPED_DATA_PATH) -> Tuple[int, str, int]:
+    """
+    Latest season and week of a scraped_data.csv and its number of team-game rows, read with the csv module.
+
+    Raises:
+        ValueError: if the file has no rows
+    """
+    def week_order(week: str) -> int:
+        if week.isdigit():
+            return int(week)
+        return 100 + (PLAYOFF_ROUNDS.index(week) if week in PLAYOFF_ROUNDS else len(PLAYOFF_ROUNDS))
+
+    counts = {}
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        season, week = header.index('season'), header.index('week')
+        for row in reader:
+            key = (row[season], row[week])
+            counts[key] = counts.get(key, 0) + 1
+    if not counts:
+        raise ValueError(f"{path} has no rows")
+    latest = max(counts, key=lambda key: (int(key[0]), week_order(key[1])))
+    return int(latest[0]), latest[1], counts[latest]
+
+
+def latest(argv: List[str], prog: str) -> Tuple[int, str, int]:
+    parser = argparse.ArgumentParser(prog=prog, description="latest season and week of the scraped data")
+    parser.add_argument("--input", type=Path, default=SCRAPED_DATA_PATH, help="scraped data file")
+    args = parser.parse_args(argv)
+
+    if not args.input.exists():
+        parser.exit(1, f"no scraped data at {args.input}, run `{PROG} scrape` first\n")
+    season, week, rows = latest_week(args.input)
+    print(f"season {season}, week {week} ({rows} team-game rows)")
+    return season, week, rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog=PROG, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=f"arguments of the command, see {PROG} <command> --help")
+    args = parser.parse_args(argv)
+
+    prog = f"{PROG} {args.command}"
+    if args.command == "scrape":
+        from src import scraping
+        scraping.main(args.args, prog)
+    elif args.command == "prep":
+        from src import pipeline
+        pipeline.main(args.args, prog)
+    elif args.command == "serve":
+        from src import predictor
+        predictor.main(["serve", *args.args], PROG)
+    elif args.command == "predict":
+        predict(args.args, prog)
+    else:
+        latest(args.args, prog)
+
+
+if __name__ == "__main__":
+    main()
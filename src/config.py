@@ -1,9 +1,2 @@
-from pathlib import Path
-import os
-
-PARENT_DIR = Path(__file__).parent.resolve().parent
-
-DATA_DIR = PARENT_DIR / 'data'
-
-if not Path(DATA_DIR).exists():
-    os.mkdir(DATA_DIR)
\ No newline at end of file
+# kept for the notebooks importing it, the paths live in src/paths.py
+from src.paths import DATA_DIR, PARENT_DIR, ensure_data_dir
@@ -4,11 +4,17 @@
 ### LIBRARY/DATA IMPORT ###   ### LIBRARY/DATA IMPORT ###   ### LIBRARY/DATA IMPORT ###   
 
 
+import re
+import warnings
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
-from typing import List
+from typing import Any, Dict, List, Optional, Sequence, Union
 
 from src.paths import DATA_DIR
+from src import parallel, storage, teams
+from src.instrumentation import instrumented
 
 def load_csv_data_from_disk(file_name: str) -> pd.DataFrame:
     """
@@ -20,38 +26,77 @@ def load_csv_data_from_disk(file_name: str) -> pd.DataFrame:
     Returns:
         pd.DataFrame: 
     """
-    return pd.read_csv(DATA_DIR / file_name)
+    # kept untyped, the notebooks expect the dtypes pd.read_csv infers
+    return storage.read_table(DATA_DIR / file_name, typed=False)
+
+
+def load_data_from_disk(
+    file_name: str,
+    columns: Optional[List[str]] = None,
+    seasons: Optional[Sequence[int]] = None,
+) -> pd.DataFrame:
+    """
+    Loads a .parquet/.feather/.csv file from DATA_DIR with the dtypes of `storage.SCHEMA`
+    (`date_time` is already a datetime, teams are categoricals, rates are float32).
+
+    Args:
+        file_name (str): name of the file (not the path, just the name), e.g. 'transformed.parquet'
+        columns (List[str], optional): only read these columns. Default is all the columns.
+        seasons (Sequence[int], optional): only read the rows of these seasons. Default is every season.
+
+    Returns:
+        pd.DataFrame: the typed data
+    """
+    return storage.read_table(DATA_DIR / file_name, columns=columns, seasons=seasons)
 
 
 ### DATA CLEANSING ###   ### DATA CLEANSING ###   ### DATA CLEANSING ###   
 
 
+# the cleansing and feature engineering functions never modify the dataframe they are given: they return a new
+# dataframe (see `_with_columns`) sharing the columns they didn't change. the only exception is
+# `sort_data_by_team_and_datetime`, which returns its input as is (not a copy) when it is already sorted.
+
+# pandas warns (PerformanceWarning) when a column is inserted into a frame of more than 100 blocks
+MAX_SEPARATE_COLUMNS = 100
+
+
+def _with_columns(data: pd.DataFrame, columns: Union[Dict[str, Any], pd.DataFrame]) -> pd.DataFrame:
+    # new frame with `columns` (name -> values, or a frame with the index of `data`) added or replaced, `data` is
+    # not modified. the replaced columns keep their position, the added ones go at the end.
+    # the frame is built from the column arrays without copying them: inserting columns one at a time is slow
+    # and warns once the frame has more than 100 blocks, and a `concat` would copy every column of the dtypes it
+    # consolidates, at every step. the columns stay separate blocks until the game level data is built
+    new = columns if isinstance(columns, pd.DataFrame) else pd.DataFrame(columns, index=data.index, copy=False)
+    arrays = {name: data[name] for name in data.columns}
+    arrays.update((name, new[name]) for name in new.columns)
+    result = pd.DataFrame(arrays, index=data.index, copy=False)
+    if len(result.columns) > MAX_SEPARATE_COLUMNS:
+        # a column inserted later (e.g. by the caller) would warn: wide frames are consolidated, with one copy
+        result = result.copy()
+    return result
+
+
+@instrumented
 def fix_opponent_names(df: pd.DataFrame) -> pd.DataFrame:
     """
     Some teams have changed their name and/or location, which created another
-    opponent. Manually replacing team names.
+    opponent. Replacing every former name with the current name of the franchise
+    (see the registry in src/teams.py).
 
     Args:
         data (pd.DataFrame): original data
 
     Returns:
         pd.DataFrame: fixed data
+
+    Raises:
+        ValueError: for unknown teams, or former names used outside the seasons they were in use
     """
-    df.loc[df["opp"] == "Washington Redskins", "opp"] = "Washington Commanders"
-    df.loc[df["opp"] == "Washington Football Team", "opp"] = "Washington Commanders"
-    df.loc[df["opp"] == "Oakland Raiders", "opp"] = "Las Vegas Raiders"
-    df.loc[df["opp"] == "Los Angeles Raiders", "opp"] = "Las Vegas Raiders"
-    df.loc[df["opp"] == "Houston Oilers", "opp"] = "Tennessee Titans"
-    df.loc[df["opp"] == "Tennessee Oilers", "opp"] = "Tennessee Titans"
-    df.loc[df["opp"] == "San Diego Chargers", "opp"] = "Los Angeles Chargers"
-    df.loc[df["opp"] == "St. Louis Rams", "opp"] = "Los Angeles Rams"
-
-    # verifying that there are only 32 teams in the df.opp column now.
-    assert len(df.opp.unique()) == 32, "There should be 32 teams in the `opp` column"
-    
-    return df
+    return _with_columns(df, {'opp': teams.team_names(df['opp'], seasons=df['season'])})
 
 
+@instrumented
 def map_team_abbreviations_to_names(df: pd.DataFrame) -> pd.DataFrame:
     """
     Maps the `team` column abbreviaton to the full name of the team
@@ -63,49 +108,37 @@ def map_team_abbreviations_to_names(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: transformed dataframe with complete `team` names
     """
+    return _with_columns(df, {'team': teams.team_names(df['team'], seasons=df['season'])})
+
+
+@instrumented
+def add_team_id_columns(data: pd.DataFrame, columns: Sequence[str] = ('home_team', 'away_team')) -> pd.DataFrame:
+    """
+    Adds a `<column>_code` column with the stable team ID (src/teams.py) of every team column.
+    Unlike `astype("category").cat.codes`, a team always gets the same ID, whatever teams are in the data.
+
+    Args:
+        data (pd.DataFrame): data with team name columns
+        columns (Sequence[str], optional): team columns. Default is ('home_team', 'away_team').
+
+    Returns:
+        pd.DataFrame: data including the `<column>_code` columns
+    """
+    return _with_columns(data, {f'{column}_code': teams.team_ids(data[column]) for column in columns})
 
-    MAP_ABBREVIATIONS_TO_NAMES  = {
-        "ARZ": "Arizona Cardinals",
-        "ATL": "Atlanta Falcons",
-        "BAL": "Baltimore Ravens",
-        "BUF": "Buffalo Bills",
-        "CAR": "Carolina Panthers",
-        "CHI": "Chicago Bears",
-        "CIN": "Cincinnati Bengals",
-        "CLE": "Cleveland Browns",
-        "DAL": "Dallas Cowboys",
-        "DEN": "Denver Broncos",
-        "DET": "Detroit Lions",
-        "GB": "Green Bay Packers",
-        "HOU": "Houston Texans",
-        "IND": "Indianapolis Colts",
-        "JAX": "Jacksonville Jaguars",
-        "KC": "Kansas City Chiefs",
-        "LV": "Las Vegas Raiders",
-        "LAC": "Los Angeles Chargers",
-        "LAR": "Los Angeles Rams",
-        "MIA": "Miami Dolphins",
-        "MIN": "Minnesota Vikings",
-        "NE": "New England Patriots",
-        "NO": "New Orleans Saints",
-        "NYG": "New York Giants",
-        "NYJ": "New York Jets",
-        "PHI": "Philadelphia Eagles",
-        "PIT": "Pittsburgh Steelers",
-        "SF": "San Francisco 49ers",
-        "SEA": "Seattle Seahawks",
-        "TB": "Tampa Bay Buccaneers",
-        "TEN": "Tennessee Titans",
-        "WAS": "Washington Commanders"
-    }
-    df.replace({"team": MAP_ABBREVIATIONS_TO_NAMES}, inplace=True)
-    
-    # verifying that there are only 32 teams in the df.opp column now.
-    assert len(df.team.unique()) == 32, "There should be 32 teams in the `opp` column"
-    
-    return df
 
+def _is_home_game(data: pd.DataFrame, team_ids: Optional[np.ndarray] = None) -> np.ndarray:
+    # the column left of "Opp" is '@' for away games, blank for home games and 'N' for neutral sites (Super Bowls).
+    # at the Super Bowl, the NFC team is the home team in odd seasons and the AFC team in even seasons.
+    if team_ids is None:
+        team_ids = teams.team_ids(data['team'])
+    location = data['@'].to_numpy(dtype=object)
+    is_nfc = teams.CONFERENCE_IDS[team_ids] == teams.NFC
+    neutral_home = is_nfc == (data['season'].to_numpy() % 2 == 1)
+    return np.where(location == '@', False, np.where(location == 'N', neutral_home, True))
 
+
+@instrumented
 def add_home_or_away_column(data: pd.DataFrame) -> pd.DataFrame:
     """Adds a new column `home_or_away` to the dataframe with values 'HOME' or
     'AWAY'.
@@ -117,30 +150,63 @@ def add_home_or_away_column(data: pd.DataFrame) -> pd.DataFrame:
         pd.DataFrame: transformed dataframe including new column `home_or_away`
     """
     
-    # organizing teams by conference since the Super Bowl home/away teams are selected this way
-    afc = ['Baltimore Ravens', 'Buffalo Bills', 'Cincinnati Bengals', 'Cleveland Browns', 'Denver Broncos', 'Houston Texans', 
-           'Indianapolis Colts', 'Jacksonville Jaguars', 'Kansas City Chiefs', 'Las Vegas Raiders','Los Angeles Chargers', 
-           'Miami Dolphins', 'New England Patriots', 'New York Jets', 'Pittsburgh Steelers', 'Tennessee Titans']
-
-    nfc = ['Arizona Cardinals', 'Atlanta Falcons', 'Carolina Panthers', 'Chicago Bears', 'Dallas Cowboys', 'Detroit Lions',
-           'Green Bay Packers', 'Los Angeles Rams', 'Minnesota Vikings', 'New Orleans Saints', 'New York Giants',
-           'Philadelphia Eagles', 'San Francisco 49ers', 'Seattle Seahawks', 'Tampa Bay Buccaneers', 'Washington Commanders']
-    
     #data['home_or_away'] = ['AWAY' if x == '@' else 'HOME' for x in data['@']] # original code
     
-    data['home_or_away'] = np.where(data['@'] == '@', 'AWAY', 
-                                np.where((data['@'] == 'N') & (data['season'] % 2 == 1) & (data['team'].isin(nfc)), 'HOME', 
-                                         np.where((data['@'] == 'N') & (data['season'] % 2 == 0) & (data['team'].isin(afc)), 'HOME', 
-                                                  np.where((data['@'] == 'N') & (data['season'] % 2 == 1) & (data['team'].isin(afc)), 'AWAY',
-                                                           np.where((data['@'] == 'N') & (data['season'] % 2 == 0) & (data['team'].isin(nfc)), 'AWAY',
-                                                                    'HOME')))))
-    
-    return data
-
-
+    # organizing teams by conference (teams.CONFERENCE_IDS) since the Super Bowl home/away teams are selected this way
+    return _with_columns(data, {'home_or_away': np.where(_is_home_game(data), 'HOME', 'AWAY')})
+
+
+MONTH_MAP = {
+    "January":1, "February":2, "March":3, "April":4, "May":5, "June":6,
+    "July":7, "August":8, "September":9, "October":10, "November":11,
+    "December":12}
+
+# kickoff times are listed in US eastern time ("1:00PM ET"), the other US time zones are shifted to it
+TIMEZONE_HOURS_TO_ET = {"ET": 0, "EST": 0, "EDT": 0, "CT": 1, "CST": 1, "CDT": 1,
+                        "MT": 2, "MST": 2, "MDT": 2, "PT": 3, "PST": 3, "PDT": 3}
+
+# "September 8"
+_DATE_PATTERN = re.compile(r"^\s*(?P<month>[A-Za-z]+)\s+(?P<day>\d{1,2})\s*$")
+# "1:00PM ET", "12:30 pm", "10AM EST"
+_TIME_PATTERN = re.compile(
+    r"^\s*(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<meridiem>[AaPp][Mm])\s*(?P<tz>[A-Za-z]{2,3})?\s*$"
+)
+
+
+def _parse_dates(dates: np.ndarray) -> np.ndarray:
+    # (month, day) of every distinct date string
+    parsed = np.empty((len(dates), 2), dtype=np.int64)
+    for i, value in enumerate(dates):
+        match = _DATE_PATTERN.match(value) if isinstance(value, str) else None
+        if match is None or match["month"].capitalize() not in MONTH_MAP:
+            raise ValueError(f"Unexpected date {value!r}, expected '<Month> <day>' like 'September 8'")
+        parsed[i] = MONTH_MAP[match["month"].capitalize()], int(match["day"])
+    return parsed
+
+
+def _parse_times(times: np.ndarray) -> np.ndarray:
+    # (hour, minute) in eastern time of every distinct kickoff time string
+    parsed = np.empty((len(times), 2), dtype=np.int64)
+    for i, value in enumerate(times):
+        match = _TIME_PATTERN.match(value) if isinstance(value, str) else None
+        tz = (match["tz"] or "ET").upper() if match is not None else None
+        if match is None or not 1 <= int(match["hour"]) <= 12 or tz not in TIMEZONE_HOURS_TO_ET:
+            raise ValueError(f"Unexpected kickoff time {value!r}, expected '<h>:<mm><AM|PM> ET' like '1:00PM ET'")
+        # 12:xxAM is just after midnight and 12:xxPM just after noon
+        hour = int(match["hour"]) % 12 + (12 if match["meridiem"].upper() == "PM" else 0)
+        parsed[i] = hour + TIMEZONE_HOURS_TO_ET[tz], int(match["minute"] or 0)
+    return parsed
+
+
+@instrumented
 def add_datetime_column(df: pd.DataFrame) -> pd.DataFrame:
     """Adds a new column `date_time` to the dataframe with values in the format: 
-    1994-09-04 16:00:00
+    1994-09-04 16:05:00
+
+    The `date` ("September 4") and `time` ("4:05PM ET") columns only have a few hundred distinct values,
+    so every distinct string is parsed once and the results are spread to the rows by their codes.
+    Minutes, 12AM/12PM and the time zone suffix are taken into account (times are kept in eastern time).
+    The `month`, `day`, `year` and `hour` helper columns are added as well.
 
     Args:
         data (pd.DataFrame): original dataframe
@@ -148,69 +214,377 @@ def add_datetime_column(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: transformed dataframe including new column `date_time`
     """
+    date_codes, dates = pd.factorize(df['date'], use_na_sentinel=False)
+    time_codes, times = pd.factorize(df['time'], use_na_sentinel=False)
+    month, day = _parse_dates(np.asarray(dates, dtype=object))[date_codes].T
+    hour, minute = _parse_times(np.asarray(times, dtype=object))[time_codes].T
 
-    # month and day
-    df[['month', 'day']] = df['date'].str.split(' ', expand=True)
-    # Convert the 'day' column to integer type
-    df['day'] = df['day'].astype(int)
-
-    # Convert the `month` from string to integer
-    MONTH_MAP = {
-        "January":1, "February":2, "March":3, "April":4, "May":5, "June":6,
-        "July":7, "August":8, "September":9, "October":10, "November":11,
-        "December":12}
-    df = df.replace({"month": MONTH_MAP})
-    
-    # Year
-    df['year'] = df['season']
-    df.loc[(df['month'] == 1) | (df['month'] == 2), 'year'] = df['year'] + 1
-
-    # Extract the hour from the 'time' column
-    df['hour'] = df['time'].str[0].astype(int)
-    # Add 12 to the 'hour' column for times in the PM
-    df['hour'] += df['time'].str.contains('PM').astype(int) * 12
-
-    # combine year, month, day and hour to build the complete date_time
-    df['date_time'] = pd.to_datetime(df[['year', 'month', 'day', 'hour']])
+    # January and February games belong to the season that started the previous September
+    year = df['season'].to_numpy(dtype=np.int64) + (month <= 2)
 
-    # df.drop(columns=['year', 'month', 'hour', 'day'], inplace=True)
+    # datetime64 arithmetic: year -> month -> day -> minutes, without building any string
+    date = ((year - 1970).astype('datetime64[Y]') + (month - 1).astype('timedelta64[M]')).astype('datetime64[D]')
+    date_time = date + (day - 1).astype('timedelta64[D]') + (hour * 60 + minute).astype('timedelta64[m]')
 
-    return df
+    return _with_columns(df, {
+        'month': month, 'day': day, 'year': year, 'hour': hour, 'date_time': date_time.astype('datetime64[ns]'),
+    })
 
 
+def is_sorted_by_team_and_datetime(data: pd.DataFrame) -> bool:
+    """
+    Checks in one pass, without sorting, whether the data is sorted by team and datetime with a 0..n-1 index,
+    i.e. whether it is already what `sort_data_by_team_and_datetime` returns.
+    """
+    index = data.index
+    if not (isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1):
+        return False
+    team = data['team']
+    # categoricals sort by their codes
+    team = team.cat.codes.to_numpy() if isinstance(team.dtype, pd.CategoricalDtype) else team.to_numpy()
+    date_time = data['date_time'].to_numpy()
+    same_team = team[1:] == team[:-1]
+    return bool(np.all((team[1:] > team[:-1]) | (same_team & (date_time[1:] >= date_time[:-1]))))
+
+
+@instrumented
 def sort_data_by_team_and_datetime(data: pd.DataFrame) -> pd.DataFrame:
     """
-    Sorts the data by team and datetime
+    Sorts the data by team and datetime. Data that is already sorted (see `is_sorted_by_team_and_datetime`)
+    is returned as is, without a copy, so the steps that need sorted data can all call it for free.
     """
+    if is_sorted_by_team_and_datetime(data):
+        return data
     return data.sort_values(by=['team', 'date_time'], ascending=[True, True], ignore_index=True)#.reset_index(drop=True)
 
 
 
+@instrumented
 def convert_week_objects(data: pd.DataFrame) -> pd.DataFrame:
     """
     converts playoff weeks to follow week numbers (wildcard = 19, divisional = 20, and so on... for seasons 2021+).
     but remember - before 2021, teams only played 17 week regular seasons, so wildcard would be = to 18 for these years. 
     For the seasons of 2021 and beyond, teams play an 18 week season.
     """
-    data.loc[(data['season'] >= 2021) & (data['week'] == 'Wild Card'), 'week'] = 19
-    data.loc[(data['season'] >= 2021) & (data['week'] == 'Division'), 'week'] = 20
-    data.loc[(data['season'] >= 2021) & (data['week'] == 'Conf. Champ.'), 'week'] = 21
-    data.loc[(data['season'] >= 2021) & (data['week'] == 'SuperBowl'), 'week'] = 23
-    data.loc[(data['season'] < 2021) & (data['week'] == 'Wild Card'), 'week'] = 18
-    data.loc[(data['season'] < 2021) & (data['week'] == 'Division'), 'week'] = 19
-    data.loc[(data['season'] < 2021) & (data['week'] == 'Conf. Champ.'), 'week'] = 20
-    data.loc[(data['season'] < 2021) & (data['week'] == 'SuperBowl'), 'week'] = 22
-    
+    # playoff week numbers before 2021, one week later since then
+    PLAYOFF_WEEKS = {'Wild Card': 18, 'Division': 19, 'Conf. Champ.': 20, 'SuperBowl': 22}
+
+    playoff_week = data['week'].map(PLAYOFF_WEEKS)
+    is_playoff = playoff_week.notna().to_numpy()
     # convert week column to numeric data type
-    data['week'] = pd.to_numeric(data['week'])
-    
-    return data
+    regular_week = pd.to_numeric(data['week'].where(~is_playoff, 0)).to_numpy()
+    playoff_week = playoff_week.fillna(0).to_numpy(dtype=regular_week.dtype) + (data['season'].to_numpy() >= 2021)
+
+    return _with_columns(data, {'week': np.where(is_playoff, playoff_week, regular_week)})
 
 
 
 ### FEATURE ENGINEERING ###   ### FEATURE ENGINEERING ###   ### FEATURE ENGINEERING ###
 
 
+def group_offsets(*keys: np.ndarray) -> np.ndarray:
+    """
+    Start offsets of the contiguous groups of rows that share the same keys, plus the total number of rows
+    at the end, so group g is rows offsets[g] to offsets[g + 1] - 1. The rows must already be sorted so
+    every group is contiguous (e.g. by team and datetime for (team, season) groups).
+
+    Args:
+        *keys (np.ndarray): one array per key column, all of the same length
+
+    Returns:
+        np.ndarray: int64 array of length n_groups + 1
+    """
+    n_rows = len(keys[0])
+    new_group = np.zeros(max(n_rows - 1, 0), dtype=bool)
+    for key in keys:
+        key = np.asarray(key)
+        new_group |= key[1:] != key[:-1]
+    return np.concatenate([[0], np.flatnonzero(new_group) + 1, [n_rows]]).astype(np.int64)
+
+
+def grouped_lagged_rolling(
+    values: np.ndarray,
+    offsets: np.ndarray,
+    window: Union[int, Sequence[int]],
+    how: str = 'mean',
+    lag: int = 1,
+    min_periods: Optional[int] = None,
+    alpha: Optional[float] = None,
+    ) -> Union[np.ndarray, List[np.ndarray]]:
+    """Rolling statistic of the `window` rows that end `lag` rows before each row, computed inside each group only.
+    It is the vectorized version of `df.groupby(keys)[col].shift(lag).rolling(window).agg()` where the rolling
+    window is also grouped, so the last rows of a group never leak into the first rows of the next one.
+
+    Everything runs in O(rows) from the group offsets, without a Python loop over the groups:
+        - mean/sum/std use prefix sums over the whole array, with the window start clipped at the group start
+        - ewm follows the pandas `ewm(alpha, adjust=True).mean()` recurrence, vectorized across the groups
+          (one step per position inside a group) and ignores `window` unless `alpha` is not given
+
+    Missing values (NaN) are skipped like pandas does: they don't count towards `min_periods`.
+
+    Args:
+        values (np.ndarray): (rows,) or (rows, columns) array, sorted so the groups are contiguous
+        offsets (np.ndarray): group offsets returned by `group_offsets`
+        window (Union[int, Sequence[int]]): number of rows in the window, or a list of them
+        how (str, optional): 'mean', 'sum', 'std' (sample std) or 'ewm'. Default is 'mean'.
+        lag (int, optional): rows between the end of the window and the current row. 1 only uses past rows to
+        avoid data leakage, 0 includes the current row. Default is 1.
+        min_periods (int, optional): minimum number of non-missing values in the window. Default is `window`
+        (for ewm: 1).
+        alpha (float, optional): smoothing factor of ewm. Default is 2 / (window + 1), i.e. span = window.
+
+    Returns:
+        Union[np.ndarray, List[np.ndarray]]: float64 array(s) with the shape of `values`, one per window
+        when `window` is a list
+    """
+    if how not in ('mean', 'sum', 'std', 'ewm'):
+        raise ValueError(f"`how` must be 'mean', 'sum', 'std' or 'ewm', got {how!r}")
+    if lag < 0:
+        raise ValueError("`lag` can't be negative")
+
+    values = np.asarray(values, dtype=np.float64)
+    one_dimensional = values.ndim == 1
+    # one row per column, so every cumulative operation runs over contiguous memory
+    columns = np.ascontiguousarray(values.reshape(len(values), -1).T)
+    n_rows = columns.shape[1]
+
+    sizes = np.diff(offsets)
+    group_start = np.repeat(offsets[:-1], sizes)
+    row = np.arange(n_rows)
+
+    windows = [window] if isinstance(window, (int, np.integer)) else list(window)
+    if how == 'ewm':
+        results = [_grouped_lagged_ewm(columns, offsets, group_start, lag, alpha or 2 / (w + 1), min_periods or 1)
+                   for w in windows]
+    else:
+        missing = np.isnan(columns)
+        filled = np.where(missing, 0, columns)
+        if how == 'std':
+            # centering the values keeps the sum of squares away from catastrophic cancellation
+            filled = np.where(missing, 0, filled - np.nanmean(columns, axis=1, keepdims=True))
+
+        # prefix sums: prefix[:, pad + i] = sum of the rows before row i, with `pad` leading zeros so that
+        # the prefix sum at (row + shift) is the slice prefix[:, pad + shift:pad + shift + n_rows] for every row
+        pad = max(windows) + lag
+        sums = _prefix_sums(filled, pad)
+        squares = _prefix_sums(filled ** 2, pad) if how == 'std' else None
+        counts = _prefix_sums(~missing, pad)
+        del filled, missing
+
+        def window_total(prefix: np.ndarray, w: int) -> np.ndarray:
+            # sum of rows (i - lag - w + 1) to (i - lag) for every row i, ignoring the groups
+            return prefix[:, pad + 1 - lag:pad + 1 - lag + n_rows] - prefix[:, pad + 1 - lag - w:pad + 1 - lag - w + n_rows]
+
+        results = []
+        for w in windows:
+            required = max(w if min_periods is None else min_periods, 2 if how == 'std' else 1)
+            total = window_total(sums, w)
+            count = window_total(counts, w)
+            total_squares = window_total(squares, w) if how == 'std' else None
+
+            # rows whose window starts before their group: the window is clipped at the group start.
+            # clipped windows hold at most (row - lag + 1 - group start) rows, so they only need to be
+            # recomputed when that can still reach `required` - with min_periods = window they are all NaN
+            available = row - lag + 1 - group_start
+            crossing = available < w
+            count[:, crossing] = 0
+            refill = np.flatnonzero(crossing & (available >= required))
+            if len(refill):
+                hi = pad + row[refill] - lag + 1
+                lo = pad + group_start[refill]
+                total[:, refill] = sums[:, hi] - sums[:, lo]
+                count[:, refill] = counts[:, hi] - counts[:, lo]
+                if how == 'std':
+                    total_squares[:, refill] = squares[:, hi] - squares[:, lo]
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                if how == 'sum':
+                    result = total
+                elif how == 'mean':
+                    result = total / count
+                else:
+                    variance = (total_squares - total ** 2 / count) / (count - 1)
+                    result = np.sqrt(np.maximum(variance, 0))
+            results.append(np.where(count >= required, result, np.nan))
+
+    results = [result.T.reshape(values.shape) if one_dimensional else result.T for result in results]
+    return results[0] if isinstance(window, (int, np.integer)) else results
+
+
+def _prefix_sums(columns: np.ndarray, pad: int) -> np.ndarray:
+    # prefix sums after `pad` leading zeros: sums[:, pad + i] = sum of the rows before row i
+    sums = np.zeros((columns.shape[0], pad + columns.shape[1] + 1))
+    np.cumsum(columns, axis=1, out=sums[:, pad + 1:])
+    return sums
+
+
+def _grouped_lagged_ewm(
+    columns: np.ndarray,
+    offsets: np.ndarray,
+    group_start: np.ndarray,
+    lag: int,
+    alpha: float,
+    min_periods: int,
+    ) -> np.ndarray:
+    # ewm of each row over its group so far, with the pandas adjust=True recurrence on (average, weight):
+    #   present value:  weight = (1 - alpha) * weight + 1,  average moves towards x by 1 / weight
+    #   missing value:  weight = (1 - alpha) * weight,      average unchanged (ignore_na=False)
+    # all the rows at the same position of their group are updated together, so the loop runs over the
+    # positions (the longest group), never over the groups.
+    decay = 1 - alpha
+    present = ~np.isnan(columns)
+
+    average = np.where(present, columns, np.nan)
+    weight = present.astype(np.float64)
+    count = present.astype(np.int64)
+    sizes = np.diff(offsets)
+    starts = offsets[:-1]
+    for position in range(1, int(sizes.max(initial=0))):
+        rows = starts[sizes > position] + position
+        previous_average = average[:, rows - 1]
+        previous_weight = weight[:, rows - 1]
+        previous_count = count[:, rows - 1]
+        x = columns[:, rows]
+        is_present = present[:, rows]
+
+        old_weight = previous_weight * decay
+        with np.errstate(invalid='ignore'):
+            updated = np.where(previous_count > 0, (old_weight * previous_average + x) / (old_weight + 1), x)
+        average[:, rows] = np.where(is_present, updated, previous_average)
+        weight[:, rows] = old_weight + is_present
+        count[:, rows] = previous_count + is_present
+
+    ewm = np.where(count >= max(min_periods, 1), average, np.nan)
+
+    # shifting by `lag` inside each group
+    result = np.full_like(ewm, np.nan)
+    row = np.arange(columns.shape[1])
+    source = row - lag
+    shifted = source >= group_start
+    result[:, shifted] = ewm[:, source[shifted]]
+    return result
+
+
+# source column -> prefix of its rolling features, e.g. 'passyd' -> 'pass_rate_last_{n}_games'
+ROLLING_FEATURES = {
+    'win': 'win',
+    'passyd': 'pass',
+    'rushyd': 'rush',
+    'passyd_allowed': 'pass_allowed',
+    'rushyd_allowed': 'rush_allowed',
+    'ot': 'ot',
+    'to': 'to',
+    'to_forced': 'to_forced',
+    'points_scored': 'points_scored',
+    'points_allowed': 'points_allowed',
+    '1st_downs': '1st_downs',
+    '1st_downs_allowed': '1st_downs_allowed',
+}
+
+
+def rolling_feature_name(source: str, n: int) -> str:
+    """
+    Name of the rolling feature of `source` over the last `n` games, e.g. ('passyd', 4) -> 'pass_rate_last_4_games'
+    """
+    return f'{ROLLING_FEATURES[source]}_rate_last_{n}_games'
+
+
+def add_rolling_source_columns(data: pd.DataFrame, sources: List[str]) -> pd.DataFrame:
+    """
+    Builds the numeric columns some rolling features are computed from:
+        - `win`: the win/loss result as an integer: win = 1, loss = 0
+        - `ot`: overtime games as binary integers
+        - `to` and `to_forced`: NaN turnovers (the website leaves 0 blank) converted into a 0 integer
+
+    Args:
+        data (pd.DataFrame): original dataframe, not modified
+        sources (List[str]): source columns that are going to be used
+
+    Returns:
+        pd.DataFrame: a new dataframe with the source columns added or replaced
+    """
+    return _with_columns(data, _rolling_source_values(data, sources))
+
+
+def _rolling_source_values(data: pd.DataFrame, sources: List[str]) -> Dict[str, pd.Series]:
+    # the columns of `add_rolling_source_columns` by name, leaving out the ones that are already converted
+    # (e.g. by a previous call), so they are not replaced for nothing
+    columns = {}
+    if 'win' in sources:
+        columns['win'] = (data['result'] == 'W').astype(int)
+    if 'ot' in sources:
+        # values may already be converted if the frame went through this function before
+        columns['ot'] = data['ot'].isin(['OT', 1]).astype(int)
+    for column in ['to', 'to_forced']:
+        if column in sources:
+            columns[column] = data[column].fillna(0)
+    return {
+        name: values for name, values in columns.items()
+        if name not in data or not values.equals(data[name])
+    }
+
+
+@instrumented
+def add_rolling_features(
+    data: pd.DataFrame,
+    spec: Optional[Dict[str, List[int]]] = None,
+    n_games: List[int] = [1, 3, 5],
+    n_jobs: Optional[int] = None,
+    ) -> pd.DataFrame:
+    """Adds the rolling average of every source column over the previous N games of each team in the same season,
+    for every N requested, in a single vectorized pass:
+        1. the data is sorted by team and datetime once, and the (team, season) group offsets are computed once
+        2. every source column is stacked in one matrix that `grouped_lagged_rolling` averages for all the
+           windows at once, from one cumulative sum per column
+        3. rows with fewer than N previous games in their (team, season) group are NaN, like
+           `.shift(1).rolling(n, min_periods=n).mean()` did
+
+    Args:
+        data (pd.DataFrame): a DataFrame with columns 'team', 'season', 'date_time' and the source columns
+        spec (Dict[str, List[int]], optional): source column -> list of N. The source columns are the keys of
+        ROLLING_FEATURES. Default is every source column with `n_games`.
+        n_games (List[int], optional): N used for every source column when `spec` is not given. Default is [1, 3, 5].
+        n_jobs (int, optional): processes computing the features, partitioned by team (-1: one per CPU).
+        Only worth it for large (e.g. simulated) data. Default is None, i.e. in this process.
+
+    Returns:
+        pd.DataFrame: a new DataFrame sorted by team and datetime (`data` is not modified), with the source
+        columns of `add_rolling_source_columns` and a `{prefix}_rate_last_{n}_games` column for every (source, N) pair
+    """
+    if spec is None:
+        spec = {source: n_games for source in ROLLING_FEATURES}
+
+    # make sure the data is sorted by team and datetime - free when it already is, e.g. from a previous call
+    data = sort_data_by_team_and_datetime(data)
+
+    sources = list(spec)
+    source_columns = _rolling_source_values(data, sources)
+    offsets = group_offsets(data['team'].to_numpy(), data['season'].to_numpy())
+    windows = sorted({n for source_windows in spec.values() for n in source_windows})
+    values = np.column_stack([
+        (source_columns[source] if source in source_columns else data[source]).to_numpy(dtype=np.float64)
+        for source in sources
+    ])
+    # only past games are used (lag=1) to avoid data leakage
+    if parallel.resolve_n_jobs(n_jobs) > 1:
+        partitions = parallel.partition_bounds(group_offsets(data['team'].to_numpy()))
+        means = parallel.parallel_grouped_lagged_rolling(values, offsets, windows, partitions, n_jobs, how='mean')
+    else:
+        means = grouped_lagged_rolling(values, offsets, windows, how='mean')
+    del values
+
+    # one column per feature, in the order of the spec: source by source, window by window
+    names = [rolling_feature_name(source, n) for source in sources for n in spec[source]]
+    # built as (features, rows), so every feature is a contiguous row the dataframe wraps without a copy
+    features = np.empty((len(names), len(data)))
+    for j, (source, n) in enumerate((source, n) for source in sources for n in spec[source]):
+        features[j] = means[windows.index(n)].T[sources.index(source)]
+    del means
+
+    return _with_columns(data, {**source_columns, **dict(zip(names, features))})
+
+
+@instrumented
 def add_win_rates_last_n_games(
     data: pd.DataFrame,
     n_games: List[int] = [1, 3, 5]
@@ -228,24 +602,10 @@ def add_win_rates_last_n_games(
         pd.DataFrame: a DataFrame with added columns for win rate in the last N matches played by each team, 
         where N is specified in the n_matches parameter. The DataFrame is sorted by team and datetime.
     """
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-
-    # add a column with the win/loss result as an integer: win = 1, loss = 0
-    data['win'] = data['result'].apply(lambda x: 1 if x == 'W' else 0) 
-    
-    for n in n_games:
-        data[f'win_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['win']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-
-    return data
+    return add_rolling_features(data, {'win': n_games})
 
 
+@instrumented
 def add_passing_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -265,22 +625,10 @@ def add_passing_rates_last_n_games(
         the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
     """
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'pass_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['passyd']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-    
-    return data
+    return add_rolling_features(data, {'passyd': n_games})
 
 
+@instrumented
 def add_rushing_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -300,22 +648,10 @@ def add_rushing_rates_last_n_games(
         the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
     """
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'rush_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['rushyd']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-
-    return data
+    return add_rolling_features(data, {'rushyd': n_games})
 
 
+@instrumented
 def add_passing_allowed_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -335,22 +671,10 @@ def add_passing_allowed_rates_last_n_games(
         the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
     """
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'pass_allowed_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['passyd_allowed']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-
-    return data
+    return add_rolling_features(data, {'passyd_allowed': n_games})
 
 
+@instrumented
 def add_rushing_allowed_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -370,22 +694,10 @@ def add_rushing_allowed_rates_last_n_games(
         the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
     """
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'rush_allowed_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['rushyd_allowed']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-
-    return data
+    return add_rolling_features(data, {'rushyd_allowed': n_games})
 
 
+@instrumented
 def add_ot_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -406,26 +718,10 @@ def add_ot_rates_last_n_games(
         the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
     """
-
-    # converts values for column "ot" (overtime) to binary integers
-    data.loc[data["ot"] == "OT", "ot"] = 1
-    data['ot'] = data['ot'].fillna(0) # for the remaining NaN values
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'ot_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['ot']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-
-    return data
+    return add_rolling_features(data, {'ot': n_games})
 
 
+@instrumented
 def add_to_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -445,26 +741,11 @@ def add_to_rates_last_n_games(
         as well as additional columns representing the turnover rates for 
         the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
-    """   
-    
-    # convert NaN values for column "to" (turnovers) into a 0 integer
-    data['to'] = data['to'].fillna(0)
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'to_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['to']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-
-    return data
+    """
+    return add_rolling_features(data, {'to': n_games})
 
 
+@instrumented
 def add_to_forced_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -484,26 +765,11 @@ def add_to_forced_rates_last_n_games(
         as well as additional columns representing the turnovers forced rates 
         for the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
-    """   
-
-    # convert NaN values for column "to_forced" (turnovers_forced) into a 0 integer
-    data['to_forced'] = data['to_forced'].fillna(0)
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'to_forced_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['to_forced']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-
-    return data
+    """
+    return add_rolling_features(data, {'to_forced': n_games})
 
 
+@instrumented
 def add_points_scored_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -523,22 +789,10 @@ def add_points_scored_rates_last_n_games(
         the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
     """
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'points_scored_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['points_scored']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-
-    return data
+    return add_rolling_features(data, {'points_scored': n_games})
 
 
+@instrumented
 def add_points_allowed_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -558,22 +812,10 @@ def add_points_allowed_rates_last_n_games(
         the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
     """
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'points_allowed_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['points_allowed']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-
-    return data
+    return add_rolling_features(data, {'points_allowed': n_games})
 
 
+@instrumented
 def add_1st_down_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -593,22 +835,10 @@ def add_1st_down_rates_last_n_games(
         the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
     """
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'1st_downs_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['1st_downs']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
-        )
-
-    return data
+    return add_rolling_features(data, {'1st_downs': n_games})
 
 
+@instrumented
 def add_1st_down_allowed_rates_last_n_games(
     data: pd.DataFrame, 
     n_games: List[int] = [1, 3, 5] 
@@ -628,19 +858,186 @@ def add_1st_down_allowed_rates_last_n_games(
         the specified number of previous games for each team. 
         The DataFrame is sorted by team and datetime.
     """
-    
-    # make sure the data is sorted by team and datetime
-    data = sort_data_by_team_and_datetime(data)
-    
-    for n in n_games:
-        data[f'1st_downs_allowed_rate_last_{n}_games'] = (
-            data
-            .groupby(['team', 'season'])['1st_downs_allowed']
-            .shift(1) # so we only use past games to avoid data leakage
-            .rolling(n, min_periods=n).mean()
-            .reset_index(drop=True)
+    return add_rolling_features(data, {'1st_downs_allowed': n_games})
+
+
+### GAME LEVEL DATA ###   ### GAME LEVEL DATA ###   ### GAME LEVEL DATA ###
+
+
+def game_keys(season: np.ndarray, week: np.ndarray, team_ids: np.ndarray, opp_ids: np.ndarray) -> np.ndarray:
+    """
+    Integer key of the game of every team-game row: (season, week, lowest team ID, highest team ID) packed
+    into an int64. Both rows of a game get the same key.
+
+    Args:
+        season (np.ndarray): seasons
+        week (np.ndarray): numeric weeks (see `convert_week_objects`)
+        team_ids (np.ndarray): team IDs of the teams
+        opp_ids (np.ndarray): team IDs of the opponents
+
+    Returns:
+        np.ndarray: int64 game keys
+    """
+    n_teams = len(teams.TEAMS)
+    low = np.minimum(team_ids, opp_ids).astype(np.int64)
+    high = np.maximum(team_ids, opp_ids).astype(np.int64)
+    # weeks fit in 6 bits, the team IDs in 5 bits each
+    return ((np.asarray(season, dtype=np.int64) * 64 + np.asarray(week, dtype=np.int64)) * n_teams + low) * n_teams + high
+
+
+@instrumented
+def pair_home_away_games(
+    data: pd.DataFrame,
+    columns: Optional[List[str]] = None,
+    target: Optional[str] = 'win',
+    unpaired: str = 'warn',
+) -> pd.DataFrame:
+    """
+    Builds the game level data: one row per game with the columns of the home team prefixed with `home_team_`
+    and the columns of the away team prefixed with `away_team_` (the layout of transformed.csv).
+
+    Every team-game row gets an integer game key (`game_keys`), the keys are hashed once with `pd.factorize`
+    and the two rows of every game are found from the first and last position of their key, so the cost is
+    linear in the number of rows (no merge, no sort apart from the final chronological order).
+
+    Games that don't have exactly two rows, or whose two rows don't have one home team and one away team,
+    are left out and reported.
+
+    Args:
+        data (pd.DataFrame): team-game data with `season`, numeric `week`, `team`, `opp`, `date_time` and
+        either `home_or_away` or the raw `@` column
+        columns (List[str], optional): columns of each team to keep. Default is every rolling feature.
+        target (str, optional): column only kept for the home team, the away team's is its complement and
+        would leak the target. Default is 'win'.
+        unpaired (str, optional): 'warn' to issue a warning about the games left out, 'raise' to raise a
+        ValueError instead. Default is 'warn'.
+
+    Returns:
+        pd.DataFrame: the game level data, in chronological order
+    """
+    if unpaired not in ('warn', 'raise'):
+        raise ValueError("`unpaired` must be 'warn' or 'raise'")
+    if columns is None:
+        columns = [column for column in data.columns if '_rate_last_' in column]
+
+    team_ids = teams.team_ids(data['team'])
+    opp_ids = teams.team_ids(data['opp'])
+    if 'home_or_away' in data.columns:
+        is_home = data['home_or_away'].to_numpy() == 'HOME'
+    else:
+        is_home = _is_home_game(data, team_ids)
+
+    keys = game_keys(data['season'].to_numpy(), data['week'].to_numpy(), team_ids, opp_ids)
+    codes, _ = pd.factorize(keys)
+    n_games = codes.max() + 1 if len(codes) else 0
+    rows_per_game = np.bincount(codes, minlength=n_games)
+
+    # first and last row of every game, the writes of the repeated codes overwrite each other
+    positions = np.arange(len(codes))
+    first = np.empty(n_games, dtype=np.int64)
+    first[codes[::-1]] = positions[::-1]
+    last = np.empty(n_games, dtype=np.int64)
+    last[codes] = positions
+
+    paired = (rows_per_game == 2) & (is_home[first] != is_home[last])
+    bad_games = np.flatnonzero(~paired)
+    if len(bad_games):
+        bad_rows = data.iloc[np.flatnonzero(np.isin(codes, bad_games))]
+        examples = bad_rows[['season', 'week', 'team', 'opp']].head(10).to_dict('records')
+        message = (
+            f"{len(bad_games)} games left out of the game level data: "
+            f"{int((rows_per_game[bad_games] == 1).sum())} unpaired, "
+            f"{int((rows_per_game[bad_games] > 2).sum())} duplicated, "
+            f"{int(((rows_per_game[bad_games] == 2)).sum())} without one home and one away team. "
+            f"First rows: {examples}"
         )
+        if unpaired == 'raise':
+            raise ValueError(message)
+        warnings.warn(message, stacklevel=2)
+
+    first, last = first[paired], last[paired]
+    home = np.where(is_home[first], first, last)
+    away = np.where(is_home[first], last, first)
+
+    # chronological order, ties in the order of the away team rows (what merging on the away rows gave)
+    order = np.argsort(away, kind='stable')
+    order = order[np.argsort(data['date_time'].to_numpy()[away[order]], kind='stable')]
+    home, away = home[order], away[order]
+
+    game_level_data = {
+        'season': data['season'].to_numpy()[home],
+        'week': data['week'].to_numpy()[home],
+        'home_team': data['team'].to_numpy()[home],
+        'date_time': data['date_time'].to_numpy()[home],
+    }
+    for column in columns + ([target] if target else []):
+        game_level_data[f'home_team_{column}'] = data[column].to_numpy()[home]
+    game_level_data['away_team'] = data['team'].to_numpy()[away]
+    for column in columns:
+        game_level_data[f'away_team_{column}'] = data[column].to_numpy()[away]
 
+    return pd.DataFrame(game_level_data)
+
+
+### MEMORY OPTIMIZATION ###   ### MEMORY OPTIMIZATION ###   ### MEMORY OPTIMIZATION ###
+
+
+# text columns with a handful of distinct values
+CATEGORICAL_COLUMNS = ['team', 'opp', 'home_or_away', 'result', 'home_team', 'away_team']
+
+# helper columns of add_datetime_column, everything they hold is in `date_time`
+DATETIME_HELPER_COLUMNS = ['month', 'day', 'year', 'hour']
+
+
+@instrumented
+def optimize_memory(
+    data: pd.DataFrame,
+    drop_columns: List[str] = DATETIME_HELPER_COLUMNS,
+    rtol: float = 1e-6,
+    verbose: bool = True,
+) -> pd.DataFrame:
+    """
+    Shrinks the prepared data before modeling: team names and other text columns with few distinct
+    values become categoricals, integer columns are downcast to the smallest integer type that holds
+    them and float columns are stored as float32. The intermediate `drop_columns` are dropped.
+
+    A float column is only downcast if every value survives the round trip to float32 within `rtol`
+    (the rolling rates always do), otherwise it stays float64, so the models see the same features.
+
+    Args:
+        data (pd.DataFrame): prepared data (not modified)
+        drop_columns (List[str], optional): columns to drop. Default is the helper columns of add_datetime_column.
+        rtol (float, optional): max relative error allowed by the float32 downcast. Default is 1e-6.
+        verbose (bool, optional): print the memory usage before and after. Default is True.
+
+    Returns:
+        pd.DataFrame: the compact data
+    """
+    bytes_before = int(data.memory_usage(index=True, deep=True).sum())
+    data = data.drop(columns=[column for column in drop_columns if column in data.columns])
+
+    columns = {}
+    for column in data.columns:
+        values = data[column]
+        if values.dtype == object:
+            # other text columns (`record`, `time`, ...) only when their values repeat enough to pay off
+            if column in CATEGORICAL_COLUMNS or values.nunique() < len(values) // 2:
+                columns[column] = values.astype('category')
+        elif pd.api.types.is_bool_dtype(values) or not pd.api.types.is_numeric_dtype(values):
+            continue
+        elif pd.api.types.is_integer_dtype(values) and not pd.api.types.is_extension_array_dtype(values):
+            columns[column] = pd.to_numeric(values, downcast='integer')
+        elif values.dtype == np.float64:
+            original = values.to_numpy()
+            downcast = original.astype(np.float32)
+            if np.allclose(downcast, original, rtol=rtol, atol=0, equal_nan=True):
+                columns[column] = downcast
+    data = data.assign(**columns)
+
+    if verbose:
+        bytes_after = int(data.memory_usage(index=True, deep=True).sum())
+        print(f"memory usage: {bytes_before / 1024 ** 2:.2f} MB -> {bytes_after / 1024 ** 2:.2f} MB "
+              f"({1 - bytes_after / bytes_before:.0%} less)")
     return data
 
 
@@ -660,5 +1057,20 @@ def export_transformed_data_to_csv(game_level_data: pd.DataFrame):
     """
     
     # using pandas to convert the dataframe into a csv file.
-    return game_level_data.to_csv("Data/transformed.csv", index=False)
+    storage.write_table(game_level_data, Path("Data/transformed.csv"), typed=False)
+
+
+def export_transformed_data(game_level_data: pd.DataFrame, file_name: str = "transformed.parquet") -> Path:
+    """
+    Exports the data transformed in 03_data_prep.ipynb to DATA_DIR with the dtypes of `storage.SCHEMA`,
+    so 04_model.ipynb can load it back with `load_data_from_disk` without re-parsing anything.
+
+    Args:
+        game_level_data (pd.DataFrame): name of the df
+        file_name (str, optional): .parquet, .feather or .csv file name. Default is 'transformed.parquet'.
+
+    Returns:
+        Path: the written file
+    """
+    return storage.write_table(game_level_data, DATA_DIR / file_name)
 
@@ -0,0 +1,266 @@
+########## feature_store.py ##########
+
+
+# common imports
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.paths import DATA_DIR
+from src.data_preparation import (
+    ROLLING_FEATURES, add_rolling_features, add_rolling_source_columns, group_offsets, rolling_feature_name,
+    sort_data_by_team_and_datetime,
+)
+
+FEATURE_STORE_DIR = DATA_DIR / "feature_store"
+
+# identifiers and target kept next to the features, i.e. what 03_data_prep.ipynb needs to build the game level data
+ID_COLUMNS = ['season', 'week', 'team', 'opp', 'date_time', 'home_or_away', 'win']
+
+
+class FeatureStore:
+    """
+    Persistent store of the `*_rate_last_{n}_games` features of every team game.
+
+    Next to the feature table (`team_game_features.csv`), the store keeps the rolling state of every
+    (team, season): the last max(N) values of each source column, in a ring buffer. New games are then
+    featurized from that state alone, in O(new rows), and only the new rows are appended to the table.
+
+    Usage:
+        store = FeatureStore(n_games=[1, 4, 8])
+        store.rebuild(data)              # full rebuild from the prepared team-game data
+        store.update(new_rows)           # weekly: only the games played since the last update
+        store.check_consistency(data)    # incremental output == full rebuild
+    """
+
+    def __init__(
+        self,
+        path: Path = FEATURE_STORE_DIR,
+        spec: Optional[Dict[str, List[int]]] = None,
+        n_games: List[int] = [1, 4, 8],
+    ):
+        self.path = Path(path)
+        self.spec = spec or {source: list(n_games) for source in ROLLING_FEATURES}
+        self.sources = list(self.spec)
+        self.feature_names = [rolling_feature_name(source, n) for source in self.sources for n in self.spec[source]]
+        self.window = max(n for windows in self.spec.values() for n in windows)
+
+        # rolling state, one row per (team, season) - the arrays can have spare rows, see `_state_indices`
+        self._keys: Dict[tuple, int] = {}
+        self._buffers = np.empty((0, len(self.sources), self.window))
+        self._counts = np.empty(0, dtype=np.int64)
+        self._last_played = np.empty(0, dtype='datetime64[ns]')
+
+    @property
+    def table_path(self) -> Path:
+        return self.path / "team_game_features.csv"
+
+    @property
+    def state_path(self) -> Path:
+        return self.path / "state.npz"
+
+    @property
+    def meta_path(self) -> Path:
+        return self.path / "meta.json"
+
+    ### FULL REBUILD ###
+
+    def rebuild(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Recomputes every feature from scratch with `add_rolling_features`, rewrites the feature table and
+        rebuilds the rolling state.
+
+        Args:
+            data (pd.DataFrame): prepared team-game data (names fixed, `home_or_away`, `date_time` and numeric `week`)
+
+        Returns:
+            pd.DataFrame: the feature table
+        """
+        table = add_rolling_features(data, self.spec)[ID_COLUMNS + self.feature_names]
+
+        # the last `window` values of every (team, season) are the state an incremental update starts from
+        offsets = group_offsets(table['team'].to_numpy(), table['season'].to_numpy())
+        ends = offsets[1:]
+        sizes = np.diff(offsets)
+        values = add_rolling_source_columns(data, self.sources)
+        values = sort_data_by_team_and_datetime(values)[self.sources].to_numpy(dtype=np.float64)
+
+        # rows (group end - window) to (group end - 1), the positions before the start of the group stay NaN
+        positions = ends[:, None] - self.window + np.arange(self.window)[None, :]
+        in_group = positions >= offsets[:-1, None]
+        buffers = np.where(in_group[:, None, :], values[np.maximum(positions, 0)].transpose(0, 2, 1), np.nan)
+
+        self._keys = {
+            (team, int(season)): i
+            for i, (team, season) in enumerate(zip(table['team'].to_numpy()[offsets[:-1]],
+                                                   table['season'].to_numpy()[offsets[:-1]]))
+        }
+        self._buffers = buffers
+        self._counts = sizes.astype(np.int64)
+        self._last_played = table['date_time'].to_numpy()[ends - 1].astype('datetime64[ns]')
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        table.to_csv(self.table_path, index=False)
+        self._save_state()
+        return table
+
+    ### INCREMENTAL UPDATE ###
+
+    def update(self, new_rows: pd.DataFrame) -> pd.DataFrame:
+        """
+        Featurizes games played after the last update from the rolling state, appends them to the feature
+        table and advances the state. Costs O(new rows), whatever the size of the history.
+
+        Args:
+            new_rows (pd.DataFrame): prepared team-game rows of the new games only
+
+        Returns:
+            pd.DataFrame: the rows appended to the feature table
+
+        Raises:
+            ValueError: if a game is not more recent than the last game stored for its team and season;
+            corrections of past games need a `rebuild`
+        """
+        if not self._keys:
+            self.load_state()
+
+        rows = add_rolling_source_columns(new_rows, self.sources)
+        rows = sort_data_by_team_and_datetime(rows)
+        values = rows[self.sources].to_numpy(dtype=np.float64)
+        team_names, seasons = rows['team'].to_numpy(), rows['season'].to_numpy(dtype=np.int64)
+        played = rows['date_time'].to_numpy().astype('datetime64[ns]')
+
+        # the (team, season) groups of the batch, each advancing one state
+        offsets = group_offsets(team_names, seasons) if len(rows) else np.zeros(1, dtype=np.int64)
+        starts, sizes = offsets[:-1], np.diff(offsets)
+        states = self._state_indices([(team, int(season)) for team, season in zip(team_names[starts], seasons[starts])])
+        row_states, row_starts = np.repeat(states, sizes), np.repeat(starts, sizes)
+        positions = np.arange(len(rows)) - row_starts
+
+        # every game comes after the previous one of its team and season, in the batch or stored (NaT: none)
+        previous = np.where(positions > 0, np.roll(played, 1), self._last_played[row_states])
+        stale = previous >= played
+        if stale.any():
+            i = int(np.argmax(stale))
+            raise ValueError(f"{team_names[i]} already has a game stored on or after {rows['date_time'].iloc[i]} "
+                             f"in {seasons[i]}, use rebuild() for corrections")
+
+        # features only use the games before each row: the stored state followed by the earlier rows of the batch
+        history = self._history(row_states, row_starts, positions, values)
+        counts = self._counts[row_states] + positions
+        features = np.full((len(rows), len(self.feature_names)), np.nan)
+        for j, (source, n) in enumerate((s, n) for s in self.sources for n in self.spec[s]):
+            # a missing value in the window makes the feature NaN, like the full rebuild
+            means = history[:, -n:, self.sources.index(source)].sum(axis=1) / n
+            features[:, j] = np.where(counts >= n, means, np.nan)
+
+        # the state after the last game of every group
+        self._buffers[states] = self._history(states, starts, sizes, values).transpose(0, 2, 1)
+        self._counts[states] += sizes
+        self._last_played[states] = played[offsets[1:] - 1]
+
+        appended = pd.concat(
+            [rows[ID_COLUMNS].reset_index(drop=True), pd.DataFrame(features, columns=self.feature_names)],
+            axis=1,
+        )
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        appended.to_csv(self.table_path, mode='a', header=not self.table_path.exists(), index=False)
+        self._save_state()
+        return appended
+
+    def _history(self, states: np.ndarray, starts: np.ndarray, positions: np.ndarray, values: np.ndarray) -> np.ndarray:
+        # (rows, window, sources): the last `window` values before position `positions` of the batch groups starting
+        # at `starts`, i.e. the buffer of their state followed by the values of the group's earlier rows
+        index = positions[:, None] + np.arange(self.window)[None, :]
+        stored = self._buffers[states[:, None], :, np.minimum(index, self.window - 1)]
+        new = values[np.maximum(starts[:, None] + index - self.window, 0)] if len(values) else stored
+        return np.where((index < self.window)[:, :, None], stored, new)
+
+    def _state_indices(self, keys: List[tuple]) -> np.ndarray:
+        # state rows of (team, season) keys. the new keys (first games of a team in a season - the rolling features
+        # reset every season) are added at once, and the arrays grow by doubling their capacity, so the state is
+        # not copied for every new key
+        new = [key for key in dict.fromkeys(keys) if key not in self._keys]
+        size, needed = len(self._keys), len(self._keys) + len(new)
+        if needed > len(self._counts):
+            capacity = max(needed, 2 * len(self._counts))
+            buffers = np.full((capacity, len(self.sources), self.window), np.nan)
+            counts = np.zeros(capacity, dtype=np.int64)
+            last_played = np.full(capacity, np.datetime64('NaT', 'ns'))
+            buffers[:size], counts[:size], last_played[:size] = (
+                self._buffers[:size], self._counts[:size], self._last_played[:size])
+            self._buffers, self._counts, self._last_played = buffers, counts, last_played
+        self._keys.update((key, size + i) for i, key in enumerate(new))
+        return np.array([self._keys[key] for key in keys], dtype=np.intp)
+
+    ### READ / CHECK ###
+
+    def load(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Reads the feature table.
+        """
+        return pd.read_csv(self.table_path, usecols=columns, parse_dates=['date_time'])
+
+    def check_consistency(self, data: pd.DataFrame, atol: float = 1e-9) -> pd.DataFrame:
+        """
+        Compares the stored feature table (built incrementally) with a full rebuild of `data`, without
+        touching the store.
+
+        Args:
+            data (pd.DataFrame): prepared team-game data covering every game in the store
+            atol (float, optional): absolute tolerance of the comparison. Default is 1e-9.
+
+        Returns:
+            pd.DataFrame: the mismatching rows (empty if the store is consistent)
+        """
+        expected = add_rolling_features(data, self.spec)[ID_COLUMNS + self.feature_names]
+        stored = sort_data_by_team_and_datetime(self.load())
+
+        keys = ['team', 'date_time']
+        merged = expected.merge(stored, on=keys, how='outer', suffixes=('', '_stored'), indicator=True)
+        mismatch = merged['_merge'] != 'both'
+        for name in self.feature_names:
+            a = merged[name].to_numpy(dtype=np.float64)
+            b = merged[f'{name}_stored'].to_numpy(dtype=np.float64)
+            same = np.isclose(a, b, rtol=0, atol=atol) | (np.isnan(a) & np.isnan(b))
+            mismatch |= ~same
+        return merged.loc[mismatch.to_numpy()]
+
+    ### PERSISTENCE ###
+
+    def _save_state(self) -> None:
+        teams = np.array([team for team, _ in self._keys], dtype=object)
+        seasons = np.array([season for _, season in self._keys], dtype=np.int64)
+        # the arrays may have room for more keys than there are
+        size = len(self._keys)
+        np.savez(
+            self.state_path,
+            teams=teams.astype(str),
+            seasons=seasons,
+            buffers=self._buffers[:size],
+            counts=self._counts[:size],
+            last_played=self._last_played[:size].astype(np.int64),
+        )
+        self.meta_path.write_text(json.dumps({'spec': self.spec}, indent=2))
+
+    def load_state(self) -> None:
+        """
+        Loads the rolling state saved by the last `rebuild`/`update`.
+
+        Raises:
+            FileNotFoundError: if the store was never built
+            ValueError: if the store was built with another spec
+        """
+        meta = json.loads(self.meta_path.read_text())
+        if meta['spec'] != self.spec:
+            raise ValueError("The feature store was built with another spec, rebuild() it first")
+
+        state = np.load(self.state_path)
+        self._keys = {(team, int(season)): i for i, (team, season) in enumerate(zip(state['teams'], state['seasons']))}
+        self._buffers = state['buffers']
+        self._counts = state['counts']
+        self._last_played = state['last_played'].astype('datetime64[ns]')
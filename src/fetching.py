@@ -0,0 +1,217 @@
+########## fetching.py ##########
+
+
+# common imports
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+from src.http_cache import CacheMissError, ResponseCache, conditional_headers
+
+# requests is imported by the engine when it needs it, so importing this module for its constants
+# (e.g. by the command line) stays fast
+
+# sports-reference sites (pro-football-reference included) ask bots to stay under 20 requests per minute.
+# going over that gets the client IP blocked for an hour, so the default rate keeps us right at the limit.
+DEFAULT_RATE = 20 / 60
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF = 2.0
+
+# status codes that are worth retrying - everything else is raised straight away
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Each request takes one token, tokens are refilled at `rate` per second
+    and at most `capacity` tokens can pile up while the bucket is idle.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError("`rate` must be a positive number of requests per second")
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Blocks until a token is available and takes it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            # sleeping outside the lock so other threads can keep refilling/checking the bucket
+            time.sleep(wait)
+
+
+class FetchEngine:
+    """
+    Fetches pages with a bounded thread pool that shares one connection-pooled `requests.Session`.
+    Every host gets its own token bucket, so the politeness limit holds no matter how many workers run,
+    and failed requests (timeouts, connection errors, 429/5xx) are retried with exponential backoff.
+
+    With a `ResponseCache`, pages fetched with `revalidate=False` are served from disk without any network
+    I/O, and the others are revalidated with conditional GETs. In `offline` mode the network is never used
+    and a page that is not cached raises `CacheMissError`.
+
+    Usage:
+        with FetchEngine(workers=4, rate=20/60) as engine:
+            for url, html in engine.fetch_many(urls):
+                ...
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        rate: float = DEFAULT_RATE,
+        burst: float = 1.0,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        timeout: float = DEFAULT_TIMEOUT,
+        session: Optional["requests.Session"] = None,
+        cache: Optional[ResponseCache] = None,
+        offline: bool = False,
+    ):
+        if workers < 1:
+            raise ValueError("`workers` must be at least 1")
+        self.workers = workers
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            # one pooled connection per worker, so keep-alive connections are reused between requests
+            adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch")
+
+    def __enter__(self) -> "FetchEngine":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Waits for the running requests, then shuts down the worker threads and the session.
+        """
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def _bucket_for(self, url: str) -> TokenBucket:
+        host = urlparse(url).netloc
+        with self._buckets_lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def _retry_delay(self, attempt: int, response: Optional["requests.Response"] = None) -> float:
+        # the server knows best - honour Retry-After (in seconds) when it is sent with a 429/503
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return float(response.headers["Retry-After"])
+        return self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> "requests.Response":
+        """
+        Rate-limited GET with retries. Returns the final response; HTTP errors that are not worth
+        retrying (404 and friends) are raised as `requests.HTTPError`.
+
+        Args:
+            url (str): page to fetch
+            headers (Dict[str, str], optional): extra request headers
+
+        Returns:
+            requests.Response: the response of the last attempt
+        """
+        import requests
+        bucket = self._bucket_for(url)
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                time.sleep(self._retry_delay(attempt, response))
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def fetch(self, url: str, revalidate: bool = True) -> str:
+        """
+        Fetches a page and returns its decoded text, going through the cache when there is one.
+
+        Args:
+            url (str): page to fetch
+            revalidate (bool, optional): if False, a cached copy is returned as is (use it for pages that
+            never change). If True, a cached copy is revalidated with a conditional GET. Default is True.
+
+        Returns:
+            str: the page text
+        """
+        cached = self.cache.get(url) if self.cache is not None else None
+        if cached is not None and (self.offline or not revalidate):
+            return cached.text
+        if self.offline:
+            raise CacheMissError(f"{url} is not in the cache and offline mode is on")
+
+        response = self.get(url, headers=conditional_headers(cached))
+        if self.cache is None:
+            return response.text
+        if response.status_code == 304 and cached is not None:
+            self.cache.refresh(url)
+            return cached.text
+
+        self.cache.put(
+            url,
+            response.text,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        return response.text
+
+    def submit(self, url: str, revalidate: bool = True) -> "Future[str]":
+        """
+        Schedules `fetch(url, revalidate)` on the worker pool and returns its future.
+        """
+        return self._executor.submit(self.fetch, url, revalidate)
+
+    def fetch_many(self, urls: Iterable[str], revalidate: bool = True) -> Iterator[Tuple[str, str]]:
+        """
+        Fetches all the urls concurrently and yields (url, text) pairs in completion order, so
+        callers can start parsing a page while the others are still downloading.
+        """
+        futures = {self.submit(url, revalidate): url for url in urls}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
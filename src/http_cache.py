@@ -0,0 +1,195 @@
+########## http_cache.py ##########
+
+
+# common imports
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+
+from src.paths import DATA_DIR
+
+HTTP_CACHE_DIR = DATA_DIR / "http_cache"
+
+# a full 1994-2022 crawl is ~1k pages and ~60 MB once compressed, so this leaves plenty of room
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+
+class CacheMissError(LookupError):
+    """
+    Raised in offline mode when a page was never downloaded before.
+    """
+
+
+class CachedResponse(NamedTuple):
+    url: str
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+class ResponseCache:
+    """
+    On-disk cache of response bodies, keyed by the sha256 of the url. Every entry is two files:
+    `<key>.html.gz` with the gzip-compressed (utf-8) body and `<key>.json` with the url and the
+    ETag/Last-Modified headers needed for conditional requests.
+
+    The total size of the bodies is capped at `max_bytes`; when a new entry goes over the cap, the least
+    recently used entries are evicted (every read bumps the mtime of the entry's metadata file).
+    """
+
+    def __init__(self, cache_dir: Path = HTTP_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _paths(self, url: str):
+        key = self.key(url)
+        folder = self.cache_dir / key[:2]
+        return folder / f"{key}.html.gz", folder / f"{key}.json"
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """
+        Returns the cached response for `url`, or None if it is not cached.
+        """
+        body_path, meta_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+            body = gzip.decompress(body_path.read_bytes())
+        except (FileNotFoundError, ValueError, OSError, EOFError):
+            return None
+
+        # marking the entry as recently used for the LRU eviction
+        self._touch(meta_path)
+        return CachedResponse(
+            url=meta["url"],
+            text=body.decode("utf-8"),
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+            fetched_at=meta["fetched_at"],
+        )
+
+    def put(
+        self,
+        url: str,
+        text: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """
+        Stores a response body and its validators, then evicts old entries if the cache went over the size cap.
+        """
+        body_path, meta_path = self._paths(url)
+        body_path.parent.mkdir(parents=True, exist_ok=True)
+
+        body = gzip.compress(text.encode("utf-8"), compresslevel=6)
+        meta = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+            "size": len(body),
+        }
+
+        with self._lock:
+            previous_size = self._entry_size(body_path)
+            # writing to temporary files first so a crash never leaves half an entry behind
+            _atomic_write(body_path, body)
+            _atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+            if self._total_bytes is not None:
+                self._total_bytes += len(body) - previous_size
+            self._evict()
+
+    def refresh(self, url: str) -> None:
+        """
+        Marks an entry as fresh after a 304 Not Modified, without rewriting the body.
+        """
+        _, meta_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return
+        meta["fetched_at"] = time.time()
+        _atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+
+    def size(self) -> int:
+        """
+        Total bytes of the compressed bodies in the cache.
+        """
+        with self._lock:
+            return self._current_size()
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in self.cache_dir.glob("*/*"):
+                path.unlink()
+            self._total_bytes = 0
+
+    @staticmethod
+    def _touch(path: Path) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _entry_size(body_path: Path) -> int:
+        try:
+            return body_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _current_size(self) -> int:
+        if self._total_bytes is None:
+            self._total_bytes = sum(p.stat().st_size for p in self.cache_dir.glob("*/*.html.gz"))
+        return self._total_bytes
+
+    def _evict(self) -> None:
+        # must be called with the lock held
+        if self._current_size() <= self.max_bytes:
+            return
+
+        entries = []
+        for meta_path in self.cache_dir.glob("*/*.json"):
+            body_path = meta_path.with_name(meta_path.name.replace(".json", ".html.gz"))
+            entries.append((meta_path.stat().st_mtime, meta_path, body_path))
+
+        # least recently used first
+        for _, meta_path, body_path in sorted(entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._total_bytes -= self._entry_size(body_path)
+            for path in (body_path, meta_path):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def conditional_headers(cached: Optional[CachedResponse]) -> Dict[str, str]:
+    """
+    Builds the If-None-Match/If-Modified-Since headers that revalidate a cached response.
+    """
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+    return headers
@@ -0,0 +1,278 @@
+########## instrumentation.py ##########
+"""
+Per-step instrumentation of the data preparation: wall time, CPU time, peak RSS growth, rows in and out and
+columns added by every step, to find which step of 03_data_prep.ipynb is slow or uses the memory.
+
+The steps of data_preparation.py are decorated with `instrumented` and the pipeline steps go through `call`.
+Both only check a module global when instrumentation is off, so the cost is a function call per step.
+
+It is turned on
+    - for a block: `with instrument() as run: ...`, then `print(run)` or `run.report()`
+    - for a whole process (e.g. the notebook kernel): NFL_INSTRUMENT=1, the report is written when it exits,
+      and `current_run()` gives it at any time
+
+NFL_INSTRUMENT=cprofile (or pyinstrument) / `instrument(profile='cprofile')` also dumps a profile of every
+top-level step next to the JSON report, under DATA_DIR/instrumentation.
+"""
+
+
+# common imports
+import atexit
+import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from src import parallel
+from src.paths import DATA_DIR
+
+INSTRUMENTATION_DIR = DATA_DIR / "instrumentation"
+ENV_VAR = "NFL_INSTRUMENT"
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+def _first_frame(args: tuple, kwargs: Dict[str, Any]) -> Optional[pd.DataFrame]:
+    for value in (*args, *kwargs.values()):
+        if isinstance(value, pd.DataFrame):
+            return value
+    return None
+
+
+class Run:
+    """
+    Records of the steps run while instrumentation is on, in the order they started. Steps called by another
+    step are recorded too, right after it and with a larger `depth`.
+
+    The peak RSS growth is the growth of the peak of the whole process during the step: steps running at the
+    same time in other threads (the pipeline) share it, and a step that stays under an earlier peak shows 0.
+    """
+
+    def __init__(self, profile: Optional[str] = None, output_dir: Path = INSTRUMENTATION_DIR):
+        if profile is not None and profile not in PROFILERS:
+            raise ValueError(f"profile must be one of {PROFILERS}")
+        self.profile = profile
+        self.output_dir = Path(output_dir)
+        self.started = datetime.datetime.now()
+        self.run_id = self.started.strftime('%Y%m%d-%H%M%S')
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def call(self, name: str, func: Callable, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        """
+        Runs `func(*args, **kwargs)` and records it as the step `name`.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        data = _first_frame(args, kwargs)
+        profiler = self._start_profiler() if depth == 0 and self.profile else None
+
+        with self._lock:
+            # the slot is taken now so the steps are listed in the order they started
+            index = len(self.records)
+            self.records.append({})
+        self._local.depth = depth + 1
+        error, result = None, None
+        rss_before = parallel.peak_rss_bytes()
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except BaseException as exception:
+            error = repr(exception)
+            raise
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.thread_time() - cpu_start
+            self._local.depth = depth
+            record = self.records[index] = {
+                'step': name,
+                'depth': depth,
+                'thread': threading.current_thread().name,
+                'wall_s': wall,
+                'cpu_s': cpu,
+                'peak_rss_delta_bytes': parallel.peak_rss_bytes() - rss_before,
+                'rows_in': None if data is None else len(data),
+                'rows_out': len(result) if isinstance(result, (pd.DataFrame, pd.Series)) else None,
+                'columns_in': None if data is None else data.shape[1],
+                'columns_out': result.shape[1] if isinstance(result, pd.DataFrame) else None,
+                'columns_added': [column for column in result.columns if column not in data.columns]
+                if isinstance(result, pd.DataFrame) and data is not None else [],
+                'error': error,
+                'profile': None,
+            }
+            if profiler is not None:
+                record['profile'] = str(self._dump_profile(profiler, index, name))
+
+    ### PROFILES ###
+
+    def _start_profiler(self):
+        if self.profile == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler is already running (a step of another thread on Python 3.12+)
+                return None
+            return profiler
+        try:
+            import pyinstrument
+        except ImportError as error:
+            raise ImportError(
+                "Profiling with pyinstrument requires pyinstrument. Install it with `pip install pyinstrument`, "
+                "or use the 'cprofile' profile."
+            ) from error
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        return profiler
+
+    def _dump_profile(self, profiler, index: int, name: str) -> Path:
+        directory = self.output_dir / self.run_id
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = f"{index:03d}-{''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)}"
+        if self.profile == 'cprofile':
+            profiler.disable()
+            path = directory / f"{stem}.prof"
+            profiler.dump_stats(path)
+        else:
+            profiler.stop()
+            path = directory / f"{stem}.html"
+            path.write_text(profiler.output_html())
+        return path
+
+    ### REPORT ###
+
+    def report(self) -> pd.DataFrame:
+        """
+        One row per step: wall and CPU time, peak RSS growth, rows in/out and number of columns added.
+        """
+        columns = ['step', 'depth', 'thread', 'wall_s', 'cpu_s', 'peak_rss_delta_bytes', 'rows_in', 'rows_out',
+                   'columns_in', 'columns_out', 'columns_added', 'error', 'profile']
+        # the steps still running have an empty record
+        return pd.DataFrame([record for record in self.records if record], columns=columns)
+
+    def __str__(self) -> str:
+        report = self.report()
+        if report.empty:
+            return "no instrumented steps ran"
+        table = pd.DataFrame({
+            'step': ['  ' * depth + step for step, depth in zip(report['step'], report['depth'])],
+            'wall (ms)': (report['wall_s'] * 1e3).round(1),
+            'cpu (ms)': (report['cpu_s'] * 1e3).round(1),
+            'peak RSS +MB': (report['peak_rss_delta_bytes'] / 2 ** 20).round(1),
+            'rows in': report['rows_in'].astype('Int64'),
+            'rows out': report['rows_out'].astype('Int64'),
+            'columns added': report['columns_added'].map(len),
+        })
+        top = report['depth'] == 0
+        footer = (f"\n{int(top.sum())} steps, {report.loc[top, 'wall_s'].sum():.3f} s wall, "
+                  f"{report.loc[top, 'cpu_s'].sum():.3f} s CPU")
+        width = table['step'].str.len().max()
+        # left aligned, so the steps called by another step are indented under it
+        return table.to_string(index=False, formatters={'step': f'{{:<{width}}}'.format}) + footer
+
+    def to_json(self, path: Optional[Path] = None) -> Path:
+        """
+        Writes the run (start time, profile, steps) as JSON. Default is DATA_DIR/instrumentation/<run id>.json.
+        """
+        path = Path(path) if path is not None else self.output_dir / f"{self.run_id}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({
+            'started': self.started.isoformat(timespec='seconds'),
+            'pid': os.getpid(),
+            'profile': self.profile,
+            'steps': [record for record in self.records if record],
+        }, indent=2))
+        return path
+
+
+### SWITCH ###
+
+
+# the run steps are recorded into, None when instrumentation is off
+_ACTIVE: Optional[Run] = None
+
+
+def current_run() -> Optional[Run]:
+    """
+    The run being recorded, None when instrumentation is off.
+    """
+    return _ACTIVE
+
+
+def call(name: str, func: Callable, *args, **kwargs) -> Any:
+    """
+    `func(*args, **kwargs)`, recorded as the step `name` when instrumentation is on.
+    """
+    if _ACTIVE is None:
+        return func(*args, **kwargs)
+    return _ACTIVE.call(name, func, args, kwargs)
+
+
+def instrumented(func: Callable) -> Callable:
+    """
+    Decorator recording every call of a step function when instrumentation is on.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _ACTIVE is None:
+            return func(*args, **kwargs)
+        return _ACTIVE.call(func.__name__, func, args, kwargs)
+    return wrapper
+
+
+@contextmanager
+def instrument(
+    profile: Optional[str] = None,
+    output_dir: Path = INSTRUMENTATION_DIR,
+    write: bool = False,
+    ) -> Iterator[Run]:
+    """
+    Records the instrumented steps run inside the block.
+
+    Args:
+        profile (str, optional): 'cprofile' or 'pyinstrument' to dump a profile of every top-level step.
+        Default is no profile.
+        output_dir (Path, optional): where the JSON report and the profiles go. Default is INSTRUMENTATION_DIR.
+        write (bool, optional): write the JSON report when the block exits. Default is False.
+
+    Yields:
+        Run: the records, complete once the block exits
+    """
+    global _ACTIVE
+    previous, run = _ACTIVE, Run(profile, output_dir)
+    _ACTIVE = run
+    try:
+        yield run
+    finally:
+        _ACTIVE = previous
+        if write:
+            run.to_json()
+
+
+def _finish_environment_run(run: Run) -> None:
+    if any(run.records):
+        print(run, file=sys.stderr)
+        print(f"instrumentation report written to {run.to_json()}", file=sys.stderr)
+
+
+def _enable_from_environment() -> None:
+    # NFL_INSTRUMENT=1/true/yes records every step of the process, =cprofile/pyinstrument profiles them too
+    global _ACTIVE
+    value = os.environ.get(ENV_VAR, '').strip().lower()
+    if value in ('', '0', 'false', 'no', 'off'):
+        return
+    _ACTIVE = Run(profile=value if value in PROFILERS else None)
+    atexit.register(_finish_environment_run, _ACTIVE)
+
+
+_enable_from_environment()
@@ -0,0 +1,291 @@
+########## model_zoo.py ##########
+"""
+Compares many classifiers on the game level data without taking the notebook down with them, which is what
+LazyClassifier did in 04_model.ipynb: every candidate is fitted in its own process, with a memory limit and a
+timeout, and reads the train/test matrices from read-only memory-mapped .npy files instead of receiving a copy.
+A candidate that crashes, runs out of memory or is too slow is reported and skipped, and the results come out
+one by one as the candidates finish.
+
+Usage:
+    python -m src.model_zoo [--data transformed.csv] [--test-season 2019] [--n-jobs 2] [--memory-mb 2048] [--timeout 120]
+"""
+
+
+# common imports
+import argparse
+import importlib
+import json
+import math
+import multiprocessing
+import tempfile
+import time
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src import parallel
+from src.predictor import PREDICTORS, game_feature_matrix
+
+# name -> (module, class, parameters, native missing values). The estimators that don't handle NaN (the first
+# games of a season have no rolling features) get a median imputer and a standard scaler in front, like
+# LazyClassifier did. xgboost and lightgbm are used when they are installed.
+CANDIDATES: Dict[str, Tuple[str, str, Dict[str, Any], bool]] = {
+    'HistGradientBoostingClassifier': ('sklearn.ensemble', 'HistGradientBoostingClassifier',
+                                       {'max_depth': 5, 'min_samples_leaf': 20, 'max_iter': 102,
+                                        'learning_rate': 0.2, 'random_state': 42}, True),
+    'LogisticRegression': ('sklearn.linear_model', 'LogisticRegression', {'max_iter': 1000}, False),
+    'RidgeClassifier': ('sklearn.linear_model', 'RidgeClassifier', {}, False),
+    'SGDClassifier': ('sklearn.linear_model', 'SGDClassifier', {'random_state': 42}, False),
+    'Perceptron': ('sklearn.linear_model', 'Perceptron', {'random_state': 42}, False),
+    'PassiveAggressiveClassifier': ('sklearn.linear_model', 'PassiveAggressiveClassifier', {'random_state': 42}, False),
+    'LinearDiscriminantAnalysis': ('sklearn.discriminant_analysis', 'LinearDiscriminantAnalysis', {}, False),
+    'QuadraticDiscriminantAnalysis': ('sklearn.discriminant_analysis', 'QuadraticDiscriminantAnalysis', {}, False),
+    'GaussianNB': ('sklearn.naive_bayes', 'GaussianNB', {}, False),
+    'BernoulliNB': ('sklearn.naive_bayes', 'BernoulliNB', {}, False),
+    'NearestCentroid': ('sklearn.neighbors', 'NearestCentroid', {}, False),
+    'KNeighborsClassifier': ('sklearn.neighbors', 'KNeighborsClassifier', {}, False),
+    'DecisionTreeClassifier': ('sklearn.tree', 'DecisionTreeClassifier', {'random_state': 42}, False),
+    'ExtraTreeClassifier': ('sklearn.tree', 'ExtraTreeClassifier', {'random_state': 42}, False),
+    'RandomForestClassifier': ('sklearn.ensemble', 'RandomForestClassifier', {'random_state': 42}, False),
+    'ExtraTreesClassifier': ('sklearn.ensemble', 'ExtraTreesClassifier', {'random_state': 42}, False),
+    'BaggingClassifier': ('sklearn.ensemble', 'BaggingClassifier', {'random_state': 42}, False),
+    'AdaBoostClassifier': ('sklearn.ensemble', 'AdaBoostClassifier', {'random_state': 42}, False),
+    'GradientBoostingClassifier': ('sklearn.ensemble', 'GradientBoostingClassifier', {'random_state': 42}, False),
+    'LinearSVC': ('sklearn.svm', 'LinearSVC', {'random_state': 42}, False),
+    'SVC': ('sklearn.svm', 'SVC', {'random_state': 42}, False),
+    'LabelPropagation': ('sklearn.semi_supervised', 'LabelPropagation', {}, False),
+    'LabelSpreading': ('sklearn.semi_supervised', 'LabelSpreading', {}, False),
+    'XGBClassifier': ('xgboost', 'XGBClassifier', {'random_state': 42}, True),
+    'LGBMClassifier': ('lightgbm', 'LGBMClassifier', {'random_state': 42, 'verbose': -1}, True),
+}
+
+
+def build_estimator(name: str, candidates: Dict[str, Tuple[str, str, Dict[str, Any], bool]] = CANDIDATES):
+    """
+    Estimator of a candidate, with an imputer and a scaler in front when it doesn't handle missing values.
+
+    Raises:
+        ImportError: if the module of the candidate is not installed
+    """
+    module, class_name, params, handles_missing = candidates[name]
+    estimator = getattr(importlib.import_module(module), class_name)(**params)
+    if handles_missing:
+        return estimator
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    return make_pipeline(SimpleImputer(strategy='median'), StandardScaler(), estimator)
+
+
+def season_split(
+    game_level_data: pd.DataFrame,
+    test_season: int = 2019,
+    predictors: Sequence[str] = PREDICTORS,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    X_train, y_train, X_test, y_test of 04_model.ipynb: trained on the seasons before `test_season`, tested on the
+    ones from it, played games only.
+    """
+    games = game_level_data.dropna(subset=['home_team_win'])
+    X = game_feature_matrix(games, predictors)
+    y = games['home_team_win'].to_numpy(dtype=np.int64)
+    test = games['season'].to_numpy() >= test_season
+    return X[~test], y[~test], X[test], y[test]
+
+
+### WORKERS ###
+
+
+def _fit_candidate(name: str, candidates: Dict, paths: Dict[str, str], memory_mb: Optional[int], connection) -> None:
+    # runs in its own process: everything it reports goes through `connection`, a crash just closes it
+    result: Dict[str, Any] = {}
+    try:
+        # loaded before the memory limit, which is meant for the fit, not for mapping the libraries
+        import sklearn.pipeline  # noqa: F401
+        try:
+            estimator = build_estimator(name, candidates)
+        except ImportError as error:
+            result = {'status': f'not installed ({error.name})'}
+            return
+        parallel.limit_memory(memory_mb)
+        # the candidates already run side by side
+        parallel.limit_threads()
+
+        X_train, y_train, X_test, y_test = (np.load(paths[key], mmap_mode='r')
+                                            for key in ('X_train', 'y_train', 'X_test', 'y_test'))
+        start = time.perf_counter()
+        estimator.fit(X_train, y_train)
+        fit_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        predictions = estimator.predict(X_test)
+        predict_time = time.perf_counter() - start
+        log_loss = np.nan
+        if hasattr(estimator, 'predict_proba'):
+            try:
+                p = np.clip(estimator.predict_proba(X_test)[:, 1], 1e-15, 1 - 1e-15)
+                log_loss = float(-np.mean(y_test * np.log(p) + (1 - y_test) * np.log(1 - p)))
+            except AttributeError:
+                # e.g. SVC without probability=True only has the attribute on paper
+                pass
+        result = {
+            'status': 'ok',
+            'accuracy': float(np.mean(predictions == y_test)),
+            'log_loss': log_loss,
+            'fit_time': fit_time,
+            'predict_time': predict_time,
+        }
+    except MemoryError:
+        result = {'status': 'out of memory'}
+    except Exception as error:
+        result = {'status': f'error: {error!r}'[:200]}
+    finally:
+        peak_rss = parallel.peak_rss_bytes()
+        result['peak_rss_mb'] = None if math.isnan(peak_rss) else peak_rss / 1024 ** 2
+        connection.send(result)
+        connection.close()
+
+
+def _context():
+    # forkserver: every candidate is forked from a small clean server process, not from the caller (which may
+    # hold a lot of memory); spawn where it's not available
+    methods = multiprocessing.get_all_start_methods()
+    if 'forkserver' not in methods:
+        return multiprocessing.get_context('spawn')
+    from multiprocessing import forkserver
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['numpy', 'sklearn.pipeline'])
+    # started now, so its start up isn't counted in the timeout of the first candidates
+    forkserver.ensure_running()
+    return context
+
+
+### RUNNER ###
+
+
+def run_zoo(
+    X_train: np.ndarray,
+    y_train: np.ndarray,
+    X_test: np.ndarray,
+    y_test: np.ndarray,
+    names: Optional[Sequence[str]] = None,
+    n_jobs: Optional[int] = 1,
+    memory_mb: Optional[int] = 2048,
+    timeout: float = 120.0,
+    candidates: Dict[str, Tuple[str, str, Dict[str, Any], bool]] = CANDIDATES,
+    ) -> Iterator[Dict[str, Any]]:
+    """
+    Fits and scores the candidates, each in its own process, and yields their results as they finish. Like
+    every multiprocessing code outside of a notebook, a script calling it needs an `if __name__ == "__main__":` guard.
+
+    Args:
+        X_train, y_train, X_test, y_test (np.ndarray): the data, see `season_split`. It is written once to
+        temporary .npy files that the workers memory-map read-only.
+        names (Sequence[str], optional): candidates to run. Default is every one of `candidates`.
+        n_jobs (int, optional): candidates fitted at the same time, see `parallel.resolve_n_jobs`. Default is 1.
+        memory_mb (int, optional): address space limit of every worker, None for no limit. Default is 2048.
+        timeout (float, optional): seconds after which a worker is killed. Default is 120.
+        candidates (Dict, optional): name -> (module, class, parameters, handles missing values).
+        Default is CANDIDATES.
+
+    Yields:
+        Dict[str, Any]: name, status ('ok', 'timeout', 'out of memory', 'crashed (exit code ...)', 'error: ...',
+        'not installed (...)'), accuracy, log_loss, fit_time, predict_time (s) and peak_rss_mb of the worker
+    """
+    names = list(candidates if names is None else names)
+    n_jobs = parallel.resolve_n_jobs(n_jobs)
+    context = _context()
+
+    with tempfile.TemporaryDirectory(prefix='model_zoo_') as directory:
+        paths = {}
+        for key, array in (('X_train', X_train), ('y_train', y_train), ('X_test', X_test), ('y_test', y_test)):
+            paths[key] = str(Path(directory) / f'{key}.npy')
+            np.save(paths[key], np.ascontiguousarray(array))
+
+        queue, running = list(names), {}
+        try:
+            while queue or running:
+                while queue and len(running) < n_jobs:
+                    name = queue.pop(0)
+                    receiver, sender = context.Pipe(duplex=False)
+                    process = context.Process(target=_fit_candidate, args=(name, candidates, paths, memory_mb, sender),
+                                              name=f'model_zoo-{name}', daemon=True)
+                    process.start()
+                    sender.close()
+                    running[receiver] = (name, process, time.monotonic())
+
+                next_deadline = min(started + timeout for _, _, started in running.values())
+                ready = wait(list(running), timeout=max(next_deadline - time.monotonic(), 0))
+                for receiver in ready:
+                    name, process, started = running.pop(receiver)
+                    try:
+                        result = receiver.recv()
+                    except EOFError:
+                        # the worker died before reporting, e.g. killed by the OS
+                        process.join()
+                        result = {'status': f'crashed (exit code {process.exitcode})'}
+                    receiver.close()
+                    process.join()
+                    yield {'name': name, **result, 'wall_time': time.monotonic() - started}
+
+                now = time.monotonic()
+                for receiver, (name, process, started) in list(running.items()):
+                    if now - started >= timeout:
+                        process.kill()
+                        process.join()
+                        receiver.close()
+                        del running[receiver]
+                        yield {'name': name, 'status': 'timeout', 'wall_time': now - started}
+        finally:
+            # a caller that stops iterating early doesn't leave workers behind
+            for receiver, (_, process, _) in running.items():
+                process.kill()
+                process.join()
+                receiver.close()
+
+
+def results_table(results: Sequence[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    The results of `run_zoo`, successful candidates first by accuracy, then the skipped ones.
+    """
+    columns = ['name', 'status', 'accuracy', 'log_loss', 'fit_time', 'predict_time', 'peak_rss_mb', 'wall_time']
+    table = pd.DataFrame(list(results)).reindex(columns=columns)
+    table['ok'] = table['status'] == 'ok'
+    return table.sort_values(['ok', 'accuracy'], ascending=[False, False]).drop(columns='ok').reset_index(drop=True)
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", type=str, default="transformed.csv", help="game level data file in DATA_DIR")
+    parser.add_argument("--test-season", type=int, default=2019, help="first test season")
+    parser.add_argument("--models", type=str, nargs="+", default=None, choices=list(CANDIDATES), metavar="MODEL",
+                        help="candidates to run, default is all of them")
+    parser.add_argument("--n-jobs", type=int, default=1, help="candidates fitted at the same time, -1 for one per CPU")
+    parser.add_argument("--memory-mb", type=int, default=2048, help="memory limit of every candidate, 0 for none")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before a candidate is killed")
+    parser.add_argument("--output", type=str, default=None, help="append every result to this JSONL file")
+    args = parser.parse_args(argv)
+
+    from src.data_preparation import load_data_from_disk
+
+    results = []
+    for result in run_zoo(*season_split(load_data_from_disk(args.data), args.test_season), names=args.models,
+                          n_jobs=args.n_jobs, memory_mb=args.memory_mb or None, timeout=args.timeout):
+        results.append(result)
+        score = f"accuracy {result['accuracy']:.3f}, fit {result['fit_time']:.2f} s" if result['status'] == 'ok' \
+            else result['status']
+        print(f"{result['name']:<32} {score}", flush=True)
+        if args.output:
+            with open(args.output, 'a') as file:
+                file.write(json.dumps(result) + '\n')
+
+    pd.set_option('display.width', 200)
+    print()
+    print(results_table(results).round(4).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+########## page_parser.py ##########
+
+
+# common imports
+import re
+from typing import Dict, List, Optional
+
+from lxml import etree, html
+import numpy as np
+import pandas as pd
+
+# pro-football-reference tags every cell with a `data-stat` attribute, so the columns are looked up by name
+# instead of by position. the values are the column names used in scraped_data.csv.
+GAMES_TABLE_COLUMNS = {
+    "week_num": "week",
+    "game_day_of_week": "day",
+    "game_date": "date",
+    "gametime": "time",
+    "game_outcome": "result",
+    "overtime": "ot",
+    "team_record": "record",
+    "game_location": "@",
+    "opp": "opp",
+    "pts_off": "points_scored",
+    "pts_def": "points_allowed",
+    "first_down_off": "1st_downs",
+    "yards_off": "totyd",
+    "pass_yds_off": "passyd",
+    "rush_yds_off": "rushyd",
+    "to_off": "to",
+    "first_down_def": "1st_downs_allowed",
+    "yards_def": "totyd_allowed",
+    "pass_yds_def": "passyd_allowed",
+    "rush_yds_def": "rushyd_allowed",
+    "to_def": "to_forced",
+    "exp_pts_off": "off_exp_pts",
+    "exp_pts_def": "def_exp_pts",
+    "exp_pts_st": "sts_exp_pts",
+}
+
+# counting stats are whole numbers (blank turnovers stay missing), expected points have decimals
+INT_COLUMNS = [
+    "points_scored", "points_allowed", "1st_downs", "totyd", "passyd", "rushyd", "to",
+    "1st_downs_allowed", "totyd_allowed", "passyd_allowed", "rushyd_allowed", "to_forced",
+]
+FLOAT_COLUMNS = ["off_exp_pts", "def_exp_pts", "sts_exp_pts"]
+
+# some tables are shipped inside html comments and only un-commented by javascript, so the table is
+# located in the raw text first. this also means lxml only has to parse a few kB instead of the whole page.
+_GAMES_TABLE_START = re.compile(r'<table\b[^>]*\bid="games"')
+_TABLE_END = "</table>"
+
+
+def _games_table_fragment(page_html: str) -> Optional[str]:
+    match = _GAMES_TABLE_START.search(page_html)
+    if match is None:
+        return None
+    end = page_html.find(_TABLE_END, match.start())
+    if end == -1:
+        return None
+    return page_html[match.start():end + len(_TABLE_END)]
+
+
+def _find_games_table(page_html: str) -> etree._Element:
+    fragment = _games_table_fragment(page_html)
+    if fragment is not None:
+        return html.fragment_fromstring(fragment)
+
+    # slow path - the table markup is not what we expect, so we look for it in the whole document,
+    # including the tables hidden in comments
+    document = html.document_fromstring(page_html)
+    tables = document.xpath('//table[@id="games"]')
+    if tables:
+        return tables[0]
+    for comment in document.xpath('//comment()[contains(., "id=\\"games\\"")]'):
+        fragment = _games_table_fragment(comment.text)
+        if fragment is not None:
+            return html.fragment_fromstring(fragment)
+    raise ValueError('No "Schedule & Game Results" table (id="games") found in the page')
+
+
+def parse_games_table(page_html: str) -> pd.DataFrame:
+    """
+    Parses the "Schedule & Game Results" table of a team page into a typed dataframe.
+
+    Only the games table is parsed (even when it sits in an html comment), the columns are named after
+    scraped_data.csv, the counting stats are nullable integers and the expected points are floats.
+    Bye weeks, the "Playoffs" separator and games that were not played yet are kept (with an empty
+    `result`), like `pd.read_html` would; games whose stats read "Canceled" are dropped.
+
+    Args:
+        page_html (str): html of the team page
+
+    Returns:
+        pd.DataFrame: one row per schedule row, columns in the order of GAMES_TABLE_COLUMNS
+    """
+    table = _find_games_table(page_html)
+
+    values: Dict[str, List[Optional[str]]] = {column: [] for column in GAMES_TABLE_COLUMNS.values()}
+    for row in table.iterfind(".//tbody/tr"):
+        # header rows repeated in the middle of the table
+        if "thead" in (row.get("class") or ""):
+            continue
+        cells = {cell.get("data-stat"): cell.text_content().strip() for cell in row}
+        # the stats of canceled games are shown as "Canceled" and they never count in the standings
+        if "week_num" not in cells or cells.get("pass_yds_off") == "Canceled":
+            continue
+        for stat, column in GAMES_TABLE_COLUMNS.items():
+            values[column].append(cells.get(stat) or None)
+
+    # building every column with its final dtype up front, so the dataframe is only assembled once
+    columns = {}
+    for column, column_values in values.items():
+        if column in INT_COLUMNS or column in FLOAT_COLUMNS:
+            numbers = np.array([np.nan if v is None else float(v) for v in column_values], dtype=np.float64)
+            if column in INT_COLUMNS:
+                missing = np.isnan(numbers)
+                numbers = pd.arrays.IntegerArray(np.where(missing, 0, numbers).astype(np.int64), missing)
+            columns[column] = numbers
+        else:
+            columns[column] = np.array(column_values, dtype=object)
+
+    return pd.DataFrame(columns)
@@ -0,0 +1,183 @@
+########## parallel.py ##########
+
+
+# common imports
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# partitions are made of whole teams and hold at least this many rows, so the work sent to a process is
+# worth the round trip. the partitions only depend on the data, never on n_jobs, so the output doesn't either.
+DEFAULT_PARTITION_ROWS = 1 << 16
+
+
+def resolve_n_jobs(n_jobs: Optional[int]) -> int:
+    """
+    Number of processes for `n_jobs`: None/1 is serial, -1 is one per CPU, -2 all CPUs but one, and so on.
+    """
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    cpus = os.cpu_count() or 1
+    return max(1, n_jobs if n_jobs > 0 else cpus + 1 + n_jobs)
+
+
+def limit_threads() -> None:
+    """
+    One native thread (OpenMP, BLAS) per worker process: the processes already use every CPU side by side,
+    the threads of each of them would oversubscribe the CPUs. Meant as a pool `initializer`.
+    """
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+
+
+def limit_memory(memory_mb: Optional[int]) -> None:
+    """
+    Address space limit of the current (worker) process, a larger allocation raises MemoryError. Skipped when
+    `memory_mb` is None/0 and without the `resource` module (Windows).
+    """
+    if not memory_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = memory_mb * 1024 ** 2
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def peak_rss_bytes() -> float:
+    """
+    Peak resident set size of the current process, NaN without the `resource` module (Windows). Linux reports
+    ru_maxrss in kB, macOS in bytes.
+    """
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return float(peak if sys.platform == "darwin" else peak * 1024)
+
+
+def partition_bounds(boundaries: np.ndarray, min_rows: int = DEFAULT_PARTITION_ROWS) -> np.ndarray:
+    """
+    Cuts the rows into consecutive partitions of at least `min_rows` rows, only at the given boundaries.
+
+    Args:
+        boundaries (np.ndarray): offsets the partitions may start at (e.g. `group_offsets(team)`), the last one
+        being the number of rows
+        min_rows (int, optional): minimum rows per partition. Default is DEFAULT_PARTITION_ROWS.
+
+    Returns:
+        np.ndarray: partition offsets, partition p is rows bounds[p] to bounds[p + 1] - 1
+    """
+    n_rows = int(boundaries[-1])
+    targets = np.arange(min_rows, n_rows, min_rows)
+    cuts = boundaries[np.minimum(np.searchsorted(boundaries, targets), len(boundaries) - 1)]
+    return np.unique(np.concatenate([[0], cuts, [n_rows]])).astype(np.int64)
+
+
+class SharedArray:
+    """
+    A numpy array in a `multiprocessing.shared_memory` block. Only its `spec` (block name, shape, dtype) is sent
+    to the worker processes, which map the same memory instead of receiving a pickled copy.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype=np.float64):
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+        self.spec = (self._shm.name, shape, dtype.str)
+
+    def close(self) -> None:
+        del self.array
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self) -> "SharedArray":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _attach(spec: Tuple[str, Tuple[int, ...], str]) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _rolling_partition(
+    values_spec: Tuple,
+    output_spec: Tuple,
+    start: int,
+    end: int,
+    offsets: np.ndarray,
+    windows: List[int],
+    kwargs: Dict[str, Any],
+) -> None:
+    # runs in a worker process: reads rows start:end of the shared values and writes the same rows of the output
+    from src.data_preparation import grouped_lagged_rolling
+
+    values_shm, values = _attach(values_spec)
+    output_shm, output = _attach(output_spec)
+    try:
+        results = grouped_lagged_rolling(values[start:end], offsets - start, windows, **kwargs)
+        for w, result in enumerate(results):
+            output[w, start:end] = result
+    finally:
+        del values, output
+        values_shm.close()
+        output_shm.close()
+
+
+def parallel_grouped_lagged_rolling(
+    values: np.ndarray,
+    offsets: np.ndarray,
+    window: Sequence[int],
+    partitions: np.ndarray,
+    n_jobs: int = -1,
+    **kwargs,
+) -> List[np.ndarray]:
+    """
+    `grouped_lagged_rolling` over a process pool. The values are copied once into shared memory, every
+    process computes whole partitions (see `partition_bounds`) and writes its rows of a shared output
+    block, so no DataFrame or array is pickled and the results come back in row order.
+
+    Args:
+        values (np.ndarray): (rows, columns) array, sorted so the groups are contiguous
+        offsets (np.ndarray): group offsets returned by `group_offsets`
+        window (Sequence[int]): windows to compute
+        partitions (np.ndarray): partition offsets, every one of them must also be a group offset
+        n_jobs (int, optional): number of processes, see `resolve_n_jobs`. Default is -1.
+        **kwargs: `how`, `lag`, `min_periods`, `alpha` of `grouped_lagged_rolling`
+
+    Returns:
+        List[np.ndarray]: one (rows, columns) float64 array per window
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+    windows = list(window)
+    if not np.isin(partitions, offsets).all():
+        raise ValueError("Partitions must start at group offsets, a group can't be split between processes")
+
+    with SharedArray(values.shape) as shared_values, SharedArray((len(windows), *values.shape)) as shared_output:
+        shared_values.array[:] = values
+        group_bounds = np.searchsorted(offsets, partitions)
+        with ProcessPoolExecutor(max_workers=resolve_n_jobs(n_jobs)) as executor:
+            futures = [
+                executor.submit(
+                    _rolling_partition, shared_values.spec, shared_output.spec, int(start), int(end),
+                    offsets[first_group:last_group + 1], windows, kwargs,
+                )
+                for start, end, first_group, last_group in zip(
+                    partitions[:-1], partitions[1:], group_bounds[:-1], group_bounds[1:]
+                )
+            ]
+            for future in futures:
+                # re-raises the errors of the workers
+                future.result()
+        return [shared_output.array[w].copy() for w in range(len(windows))]
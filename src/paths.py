@@ -1,9 +1,35 @@
 from pathlib import Path
-import os
 
 PARENT_DIR = Path(__file__).parent.resolve().parent
 
 DATA_DIR = PARENT_DIR / 'data'
 
-if not Path(DATA_DIR).exists():
-    os.mkdir(DATA_DIR)
\ No newline at end of file
+# files of src/predictor.py, here so the command line can find them without importing the model code
+MODEL_PATH = DATA_DIR / "model.pkl"
+MATCHUPS_DIR = DATA_DIR / "matchups"
+# the data the Predictor computes the team features of by default, see `pipeline.default_steps`
+SCRAPED_DATA_PATH = DATA_DIR / "scraped_data.csv"
+
+
+def ensure_data_dir() -> Path:
+    """
+    Creates DATA_DIR if it doesn't exist yet. Importing a module doesn't touch the filesystem, so the code
+    writing straight into DATA_DIR calls this first (the code writing into its subfolders creates them).
+    """
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    return DATA_DIR
+
+
+def file_digest(path: Path) -> str:
+    """
+    SHA-256 of the content of a file: unlike its modification time, it doesn't change when the file is copied or
+    checked out again.
+    """
+    # hashlib loads OpenSSL, which takes longer than the rest of the import of src.paths
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
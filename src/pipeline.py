@@ -0,0 +1,352 @@
+########## pipeline.py ##########
+"""
+The data preparation of 03_data_prep.ipynb as a DAG of cached steps.
+
+Every step is fingerprinted from its parameters, the code of its function (and of the functions it calls in
+src/), the module-level data of their modules (e.g. the team registry, ROLLING_FEATURES) and the fingerprints
+of its inputs; the source step also hashes the scraped data file. Artifacts are
+pickled under DATA_DIR/pipeline_cache, keyed by fingerprint, so a run only executes the steps whose inputs
+changed - e.g. changing the windows of one rolling feature only recomputes that feature and the steps after it.
+Steps whose inputs are ready run concurrently in a thread pool (the rolling feature branches are independent).
+
+Usage:
+    python -m src.pipeline [--n-games 1 4 8] [--window passyd=1,3,5] [--workers 4] [--output transformed.parquet]
+"""
+
+
+# common imports
+import argparse
+import hashlib
+import inspect
+import json
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.paths import DATA_DIR
+from src import data_preparation as dp
+from src import instrumentation
+
+PIPELINE_CACHE_DIR = DATA_DIR / "pipeline_cache"
+
+
+class Step(NamedTuple):
+    name: str
+    func: Callable[..., pd.DataFrame]
+    inputs: Tuple[str, ...] = ()
+    params: Dict[str, Any] = {}
+    files: Tuple[Path, ...] = ()
+
+
+### STEP FUNCTIONS ###
+
+
+def load_scraped_data(path: str) -> pd.DataFrame:
+    return pd.read_csv(path)
+
+
+def clean_scraped_data(data: pd.DataFrame) -> pd.DataFrame:
+    data = dp.fix_opponent_names(data)
+    data = dp.map_team_abbreviations_to_names(data)
+    data = dp.add_home_or_away_column(data)
+    data = dp.add_datetime_column(data)
+    data = dp.convert_week_objects(data)
+    return dp.sort_data_by_team_and_datetime(data)
+
+
+def rolling_feature_branch(data: pd.DataFrame, source: str, n_games: List[int]) -> pd.DataFrame:
+    # only the feature columns, in the (team, date_time) order of the cleaned data
+    features = dp.add_rolling_features(data, {source: n_games})
+    return features[[dp.rolling_feature_name(source, n) for n in n_games]]
+
+
+def combine_features(data: pd.DataFrame, *features: pd.DataFrame) -> pd.DataFrame:
+    data = dp.add_rolling_source_columns(data, ['win'])
+    return pd.concat([data, *features], axis=1)
+
+
+def build_game_level_data(data: pd.DataFrame) -> pd.DataFrame:
+    game_level_data = dp.pair_home_away_games(data)
+    return dp.add_team_id_columns(game_level_data, ['home_team', 'away_team'])
+
+
+def default_steps(
+    scraped_data_path: Path = DATA_DIR / "scraped_data.csv",
+    n_games: List[int] = [1, 4, 8],
+    windows: Optional[Dict[str, List[int]]] = None,
+) -> List[Step]:
+    """
+    The steps of 03_data_prep.ipynb: load -> clean -> one branch per rolling feature -> combine -> game level data.
+
+    Args:
+        scraped_data_path (Path, optional): scraped data to prepare. Default is DATA_DIR/scraped_data.csv.
+        n_games (List[int], optional): windows of every rolling feature. Default is [1, 4, 8].
+        windows (Dict[str, List[int]], optional): windows of some of the rolling features (by source column),
+        overriding `n_games`.
+
+    Returns:
+        List[Step]: the steps
+    """
+    windows = {source: list(windows.get(source, n_games)) for source in dp.ROLLING_FEATURES} if windows \
+        else {source: list(n_games) for source in dp.ROLLING_FEATURES}
+
+    steps = [
+        Step('scraped_data', load_scraped_data, params={'path': str(scraped_data_path)}, files=(Path(scraped_data_path),)),
+        Step('cleaned', clean_scraped_data, inputs=('scraped_data',)),
+    ]
+    branches = []
+    for source, source_windows in windows.items():
+        name = f'rolling_{dp.ROLLING_FEATURES[source]}'
+        steps.append(Step(name, rolling_feature_branch, inputs=('cleaned',),
+                          params={'source': source, 'n_games': source_windows}))
+        branches.append(name)
+    steps += [
+        Step('team_games', combine_features, inputs=('cleaned', *branches)),
+        Step('game_level', build_game_level_data, inputs=('team_games',)),
+    ]
+    return steps
+
+
+### FINGERPRINTS ###
+
+
+def _code_fingerprint(func: Callable, seen: Optional[Set[Any]] = None) -> str:
+    # source of the function and of every function/module attribute of src/ it refers to, recursively, and the
+    # module-level data of their modules: a step reads tables like teams.ALIASES (through teams._LOOKUP) or
+    # ROLLING_FEATURES, whose changes are not in the source of any function
+    seen = set() if seen is None else seen
+    # the code of the decorated function, not of the decorator's wrapper
+    func = inspect.unwrap(func)
+    if func in seen:
+        return ''
+    seen.add(func)
+
+    parts = [inspect.getsource(func)]
+    module = sys.modules.get(func.__module__)
+    if module is not None and module not in seen:
+        seen.add(module)
+        parts.append(_module_data_fingerprint(module))
+    namespaces = [func.__globals__]
+    for name in func.__code__.co_names:
+        for namespace in namespaces:
+            target = namespace.get(name)
+            if inspect.ismodule(target) and target.__name__.startswith('src.'):
+                # `dp.add_rolling_features` - the attribute names are in co_names too
+                namespaces.append(vars(target))
+            elif inspect.isfunction(target) and target.__module__.startswith('src.'):
+                parts.append(_code_fingerprint(target, seen))
+    return hashlib.sha256(''.join(parts).encode()).hexdigest()
+
+
+def _module_data_fingerprint(module) -> str:
+    # every global of the module that is data, not code (functions, classes and modules are left out)
+    data = {
+        name: value for name, value in vars(module).items()
+        if not name.startswith('__') and not (inspect.ismodule(value) or inspect.isroutine(value) or inspect.isclass(value))
+    }
+    return _data_repr(data)
+
+
+def _data_repr(value: Any) -> str:
+    # text of a value that is the same in every process: no memory addresses, sets in sorted order. paths and
+    # other objects only give their type - the files a step reads are fingerprinted on their own
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return repr(value)
+    if isinstance(value, np.ndarray):
+        return f'array({value.dtype}, {value.shape}, {_data_repr(value.tolist())})'
+    if isinstance(value, dict):
+        return '{' + ', '.join(f'{_data_repr(key)}: {_data_repr(item)}' for key, item in value.items()) + '}'
+    if isinstance(value, (set, frozenset)):
+        return '{' + ', '.join(sorted(_data_repr(item) for item in value)) + '}'
+    if isinstance(value, (list, tuple)):
+        return f'{type(value).__name__}(' + ', '.join(_data_repr(item) for item in value) + ')'
+    if isinstance(value, re.Pattern):
+        return f're({value.pattern!r}, {value.flags})'
+    return type(value).__name__
+
+
+def _file_fingerprint(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 ** 2), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Pipeline:
+    """
+    Runs a list of `Step`s in dependency order, reusing the cached artifacts of the steps whose fingerprint
+    didn't change.
+
+    Usage:
+        pipeline = Pipeline(default_steps(n_games=[1, 4, 8]))
+        game_level_data = pipeline.run()['game_level']
+    """
+
+    def __init__(self, steps: Sequence[Step], cache_dir: Path = PIPELINE_CACHE_DIR, workers: int = 4):
+        self.steps = {step.name: step for step in steps}
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers
+        for step in steps:
+            missing = [name for name in step.inputs if name not in self.steps]
+            if missing:
+                raise ValueError(f"Step {step.name!r} depends on unknown steps {missing}")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"The pipeline has a cycle through {name!r}")
+            visiting.add(name)
+            for upstream in self.steps[name].inputs:
+                visit(upstream)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.steps:
+            visit(name)
+        return order
+
+    def fingerprints(self) -> Dict[str, str]:
+        """
+        Fingerprint of every step: hash of its name, parameters, code, data files and input fingerprints.
+        """
+        fingerprints = {}
+        for name in self.order:
+            step = self.steps[name]
+            payload = {
+                'name': step.name,
+                'params': step.params,
+                'code': _code_fingerprint(step.func),
+                'files': [_file_fingerprint(path) for path in step.files],
+                'inputs': [fingerprints[upstream] for upstream in step.inputs],
+            }
+            fingerprints[name] = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+        return fingerprints
+
+    def _artifact_path(self, name: str, fingerprint: str) -> Path:
+        return self.cache_dir / f"{name}-{fingerprint[:20]}.pkl"
+
+    def plan(self, targets: Optional[Sequence[str]] = None, force: bool = False) -> Dict[str, str]:
+        """
+        What a run would do with every step needed for `targets`: 'run' or 'cached'.
+        """
+        fingerprints = self.fingerprints()
+        needed = self._ancestors(targets or [self.order[-1]])
+        return {
+            name: 'cached' if not force and self._artifact_path(name, fingerprints[name]).exists() else 'run'
+            for name in self.order if name in needed
+        }
+
+    def _ancestors(self, targets: Sequence[str]) -> Set[str]:
+        needed, stack = set(), list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.add(name)
+                stack.extend(self.steps[name].inputs)
+        return needed
+
+    def run(
+        self,
+        targets: Optional[Sequence[str]] = None,
+        force: bool = False,
+        verbose: bool = True,
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        Runs the steps needed for `targets` that are not cached, in parallel when they don't depend on each other.
+
+        Args:
+            targets (Sequence[str], optional): steps whose output is wanted. Default is the last step.
+            force (bool, optional): re-run every step, ignoring the cache. Default is False.
+            verbose (bool, optional): print what every step did. Default is True.
+
+        Returns:
+            Dict[str, pd.DataFrame]: the output of every target
+        """
+        targets = list(targets or [self.order[-1]])
+        fingerprints = self.fingerprints()
+        plan = self.plan(targets, force)
+
+        # cached steps are only loaded if a step that runs, or a target, needs their output
+        to_run = [name for name, action in plan.items() if action == 'run']
+        required = set(targets) | {upstream for name in to_run for upstream in self.steps[name].inputs}
+        outputs: Dict[str, pd.DataFrame] = {}
+        for name, action in plan.items():
+            if action == 'cached' and name in required:
+                outputs[name] = pd.read_pickle(self._artifact_path(name, fingerprints[name]))
+                if verbose:
+                    print(f"{name:<32} cached")
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        pending = set(to_run)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pipeline") as executor:
+            while pending or running:
+                for name in [name for name in self.order if name in pending]:
+                    if all(upstream in outputs for upstream in self.steps[name].inputs):
+                        pending.discard(name)
+                        running[executor.submit(self._run_step, name, outputs)] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    outputs[name], elapsed = future.result()
+                    pd.to_pickle(outputs[name], self._artifact_path(name, fingerprints[name]))
+                    if verbose:
+                        print(f"{name:<32} ran in {elapsed:.2f} s")
+
+        return {name: outputs[name] for name in targets}
+
+    def _run_step(self, name: str, outputs: Dict[str, pd.DataFrame]) -> Tuple[pd.DataFrame, float]:
+        step = self.steps[name]
+        # the data preparation functions don't modify their input, the steps share the upstream outputs
+        inputs = [outputs[upstream] for upstream in step.inputs]
+        start = time.perf_counter()
+        result = instrumentation.call(f'pipeline.{name}', step.func, *inputs, **step.params)
+        return result, time.perf_counter() - start
+
+
+def _parse_window(value: str) -> Tuple[str, List[int]]:
+    source, _, windows = value.partition('=')
+    if source not in dp.ROLLING_FEATURES or not windows:
+        raise argparse.ArgumentTypeError(f"expected <source>=<n>,<n>,... with a source in {list(dp.ROLLING_FEATURES)}")
+    return source, [int(n) for n in windows.split(',')]
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", type=Path, default=DATA_DIR / "scraped_data.csv", help="scraped data to prepare")
+    parser.add_argument("--n-games", type=int, nargs="+", default=[1, 4, 8], help="windows of the rolling features")
+    parser.add_argument("--window", type=_parse_window, action="append", default=[],
+                        help="windows of one rolling feature, e.g. passyd=1,3,5 (repeatable)")
+    parser.add_argument("--workers", type=int, default=4, help="steps run concurrently")
+    parser.add_argument("--force", action="store_true", help="ignore the cache and re-run every step")
+    parser.add_argument("--dry-run", action="store_true", help="only print which steps would run")
+    parser.add_argument("--output", type=str, default=None,
+                        help="write the game level data to this file in DATA_DIR (.parquet/.feather/.csv)")
+    args = parser.parse_args(argv)
+
+    pipeline = Pipeline(default_steps(args.input, args.n_games, dict(args.window)), workers=args.workers)
+    if args.dry_run:
+        for name, action in pipeline.plan(force=args.force).items():
+            print(f"{name:<32} {action}")
+    else:
+        game_level_data = pipeline.run(force=args.force)['game_level']
+        if args.output:
+            print(f"written to {dp.export_transformed_data(game_level_data, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
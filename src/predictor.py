@@ -0,0 +1,532 @@
+########## predictor.py ##########
+"""
+Home/away matchup predictions from a long-lived `Predictor`: the model of 04_model.ipynb is loaded once and the
+latest rolling features of every team are kept in a (teams, features) array indexed by team ID, so a prediction
+is one fancy-indexing gather into a batched feature matrix and one `predict_proba` call, for one game or a slate.
+
+Usage:
+    python -m src.predictor train [--last-season 2022]
+    python -m src.predictor predict "Kansas City Chiefs" "Buffalo Bills"
+    python -m src.predictor slate "KC@BUF" "DAL@PHI" ...
+    python -m src.predictor matchups
+    python -m src.predictor serve [--port 8000] [--matchups]
+"""
+
+
+# common imports
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from src.paths import MATCHUPS_DIR, MODEL_PATH, SCRAPED_DATA_PATH, file_digest
+from src import teams
+from src.data_preparation import (
+    ROLLING_FEATURES, add_rolling_source_columns, group_offsets, grouped_lagged_rolling, rolling_feature_name,
+    sort_data_by_team_and_datetime,
+)
+
+# the predictors and hyperparameters of the HistGradientBoostingClassifier of 04_model.ipynb
+PREDICTORS = [
+    'season', 'week', 'home_team_code', 'away_team_code', 'date_time',
+    'home_team_win_rate_last_1_games', 'home_team_win_rate_last_4_games', 'home_team_win_rate_last_8_games',
+    'home_team_pass_rate_last_8_games',
+    'home_team_rush_allowed_rate_last_4_games', 'home_team_rush_allowed_rate_last_8_games',
+    'home_team_points_scored_rate_last_1_games', 'home_team_points_scored_rate_last_4_games',
+    'home_team_points_scored_rate_last_8_games',
+    'home_team_points_allowed_rate_last_4_games', 'home_team_points_allowed_rate_last_8_games',
+    'home_team_1st_downs_rate_last_4_games', 'home_team_1st_downs_rate_last_8_games',
+    'away_team_win_rate_last_4_games', 'away_team_win_rate_last_8_games',
+    'away_team_pass_rate_last_4_games', 'away_team_pass_rate_last_8_games',
+    'away_team_rush_allowed_rate_last_8_games',
+    'away_team_points_scored_rate_last_4_games', 'away_team_points_scored_rate_last_8_games',
+    'away_team_points_allowed_rate_last_8_games',
+    'away_team_1st_downs_rate_last_4_games', 'away_team_1st_downs_rate_last_8_games',
+]
+MODEL_PARAMS = {'max_depth': 5, 'min_samples_leaf': 20, 'max_iter': 102, 'learning_rate': 0.2, 'random_state': 42}
+
+# the columns of a prediction that don't come from the rolling features of the teams
+CONTEXT_COLUMNS = ['season', 'week', 'home_team_code', 'away_team_code', 'date_time']
+_FEATURE_NAME = re.compile(r'^(home_team|away_team)_(.+)_rate_last_(\d+)_games$')
+
+
+### MODEL ###
+
+
+def super_bowl_week(season: int) -> int:
+    """
+    Week number of the Super Bowl, the last week of a season, see `convert_week_objects`: 22 before 2021, 23 since
+    the 17 game seasons.
+    """
+    return 23 if season >= 2021 else 22
+
+
+def feature_spec(predictors: Sequence[str]) -> Dict[str, List[int]]:
+    """
+    Rolling features (source column -> windows, see `add_rolling_features`) the game level predictors are made of.
+
+    Raises:
+        ValueError: for a predictor that is neither a context column nor a home/away rolling feature
+    """
+    sources = {prefix: source for source, prefix in ROLLING_FEATURES.items()}
+    spec: Dict[str, List[int]] = {}
+    for predictor in predictors:
+        if predictor in CONTEXT_COLUMNS:
+            continue
+        match = _FEATURE_NAME.match(predictor)
+        if match is None or match[2] not in sources:
+            raise ValueError(f"Unknown predictor {predictor!r}")
+        windows = spec.setdefault(sources[match[2]], [])
+        if int(match[3]) not in windows:
+            windows.append(int(match[3]))
+    return spec
+
+
+def game_feature_matrix(game_level_data: pd.DataFrame, predictors: Sequence[str] = PREDICTORS) -> np.ndarray:
+    """
+    float64 (games, predictors) matrix of the game level data, with `date_time` as float nanoseconds like
+    04_model.ipynb does.
+    """
+    columns = []
+    for predictor in predictors:
+        values = game_level_data[predictor]
+        if predictor == 'date_time':
+            values = pd.to_datetime(values).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        columns.append(np.asarray(values, dtype=np.float64))
+    return np.column_stack(columns)
+
+
+def train_model(
+    game_level_data: pd.DataFrame,
+    predictors: Sequence[str] = PREDICTORS,
+    last_season: Optional[int] = None,
+    **params,
+    ) -> Dict[str, Any]:
+    """
+    Fits the HistGradientBoostingClassifier of 04_model.ipynb on the game level data (see `pair_home_away_games`).
+
+    Args:
+        game_level_data (pd.DataFrame): one row per game with the predictors and `home_team_win`
+        predictors (Sequence[str], optional): columns the model uses. Default is PREDICTORS.
+        last_season (int, optional): last season to train on. Default is every season.
+        **params: hyperparameters overriding MODEL_PARAMS
+
+    Returns:
+        Dict[str, Any]: the model bundle `save_model` writes: the fitted model, its predictors and its version
+    """
+    from sklearn.ensemble import HistGradientBoostingClassifier
+
+    games = game_level_data.dropna(subset=['home_team_win'])
+    if last_season is not None:
+        games = games[games['season'] <= last_season]
+    # fitted on an array, not a dataframe, so predicting from arrays doesn't check feature names
+    model = HistGradientBoostingClassifier(**{**MODEL_PARAMS, **params})
+    model.fit(game_feature_matrix(games, predictors), games['home_team_win'].to_numpy(dtype=np.int64))
+    return {'model': model, 'predictors': list(predictors), 'version': model_version(model, predictors)}
+
+
+def model_version(model, predictors: Sequence[str]) -> str:
+    """
+    Hash of a fitted model and its predictors, the model part of the matchup matrix fingerprint.
+    """
+    return hashlib.sha256(pickle.dumps((model, list(predictors)), protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+
+def save_model(bundle: Dict[str, Any], path: Path = MODEL_PATH) -> Path:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as file:
+        pickle.dump(bundle, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def load_model(path: Path = MODEL_PATH) -> Dict[str, Any]:
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+### TEAM FEATURES ###
+
+
+def latest_team_features(data: pd.DataFrame, spec: Dict[str, List[int]]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Rolling features of every team for its next game, i.e. over its last N games including the most recent one
+    (`grouped_lagged_rolling` with lag=0), in the latest season it played.
+
+    Args:
+        data (pd.DataFrame): prepared team-game data, like the input of `add_rolling_features`
+        spec (Dict[str, List[int]]): source column -> windows
+
+    Returns:
+        Tuple[List[str], np.ndarray, np.ndarray]: the feature names, a (teams, features) float64 array indexed
+        by team ID (NaN for teams without data) and the latest season of every team (-1 without data)
+    """
+    data = sort_data_by_team_and_datetime(data)
+    sources = list(spec)
+    windows = sorted({n for source_windows in spec.values() for n in source_windows})
+    values = add_rolling_source_columns(data, sources)[sources].to_numpy(dtype=np.float64)
+
+    offsets = group_offsets(data['team'].to_numpy(), data['season'].to_numpy())
+    # the last row of the last (team, season) group of every team: the data is sorted by team and datetime
+    ends = offsets[1:] - 1
+    team_at_end = teams.team_ids(data['team'].to_numpy()[ends])
+    last_group = np.append(team_at_end[1:] != team_at_end[:-1], True)
+    rows, team_ids = ends[last_group], team_at_end[last_group]
+
+    names = [rolling_feature_name(source, n) for source in sources for n in spec[source]]
+    means = grouped_lagged_rolling(values, offsets, windows, how='mean', lag=0)
+    features = np.full((len(teams.TEAMS), len(names)), np.nan)
+    for j, (source, n) in enumerate((source, n) for source in sources for n in spec[source]):
+        features[team_ids, j] = means[windows.index(n)][rows, sources.index(source)]
+    seasons = np.full(len(teams.TEAMS), -1, dtype=np.int64)
+    seasons[team_ids] = data['season'].to_numpy()[rows]
+    return names, features, seasons
+
+
+### PREDICTOR ###
+
+
+class Predictor:
+    """
+    Predicts the probability that the home team wins, for one matchup or a whole slate.
+
+    The model and the latest features of every team are loaded once, then every request only maps the team
+    names to IDs (cached), gathers the rows of the feature array and evaluates the model once.
+
+    Usage:
+        predictor = Predictor()
+        predictor.predict("Kansas City Chiefs", "Buffalo Bills")
+        predictor.predict_slate([("KC", "BUF"), ("PHI", "DAL")], week=3)
+    """
+
+    def __init__(self, bundle: Optional[Dict[str, Any]] = None, data: Optional[pd.DataFrame] = None):
+        """
+        Args:
+            bundle (Dict[str, Any], optional): model bundle of `train_model`. Default is the one saved at MODEL_PATH.
+            data (pd.DataFrame, optional): prepared team-game data the team features are computed from. Default is
+            the cleaned data of the pipeline (DATA_DIR/scraped_data.csv).
+        """
+        # digests of the files the model and the data are loaded from, stored next to the matchup matrix so the
+        # command line can tell whether it is up to date without loading them (see `load_matchups`)
+        self.sources: Dict[str, str] = {}
+        if bundle is None:
+            self.sources['model'] = file_digest(MODEL_PATH)
+            bundle = load_model()
+        self.model = bundle['model']
+        self.predictors = list(bundle['predictors'])
+        self.model_version = bundle.get('version') or model_version(self.model, self.predictors)
+        if data is None:
+            from src.pipeline import Pipeline, default_steps
+            self.sources['data'] = file_digest(SCRAPED_DATA_PATH)
+            data = Pipeline(default_steps(SCRAPED_DATA_PATH)).run(['cleaned'], verbose=False)['cleaned']
+
+        names, self.team_features, self.team_seasons = latest_team_features(data, feature_spec(self.predictors))
+        # where every predictor comes from: a context column, or a column of the home/away team features
+        self._context = {name: i for i, name in enumerate(self.predictors) if name in CONTEXT_COLUMNS}
+        self._sides = []
+        for side in ('home_team_', 'away_team_'):
+            positions = [(i, names.index(name[len(side):])) for i, name in enumerate(self.predictors)
+                         if name.startswith(side) and name not in CONTEXT_COLUMNS]
+            columns, features = zip(*positions) if positions else ((), ())
+            self._sides.append((list(columns), list(features)))
+
+        # default context: the week after the latest game of the data, or the first week of the next season once
+        # the Super Bowl is played (the teams have no features of that season yet, they are NaN)
+        last_game = data.loc[data['date_time'].idxmax()]
+        self.season = int(last_game['season'])
+        self.week = int(last_game['week']) + 1
+        self.date_time = pd.Timestamp(last_game['date_time']) + pd.Timedelta(days=7)
+        if self.week > super_bowl_week(self.season):
+            # the opener is played on the same weekday, about a year after the previous one
+            opener = data.loc[data['season'] == self.season, 'date_time'].min()
+            self.season, self.week = self.season + 1, 1
+            self.date_time = pd.Timestamp(opener) + pd.Timedelta(weeks=52)
+        self._team_ids: Dict[str, int] = {}
+        self.matchups: Optional[np.ndarray] = None
+
+    def team_id(self, team: str) -> int:
+        """
+        ID of a team name, former name or abbreviation (see `teams.team_ids`), cached.
+        """
+        team_id = self._team_ids.get(team)
+        if team_id is None:
+            team_id = self._team_ids[team] = int(teams.team_ids([team])[0])
+        return team_id
+
+    def feature_matrix(
+        self,
+        games: Sequence[Tuple[str, str]],
+        season: Optional[int] = None,
+        week: Optional[int] = None,
+        date_time: Optional[pd.Timestamp] = None,
+        ) -> np.ndarray:
+        """
+        (games, predictors) matrix of (home, away) matchups, built in one gather from the team feature array.
+        Teams that haven't played in `season` yet have no rolling features (NaN), like the first game of a season.
+        """
+        home, away = self._game_team_ids(games)
+        return self._feature_matrix(home, away, season, week, date_time)
+
+    def _game_team_ids(self, games: Sequence[Tuple[str, str]]) -> Tuple[np.ndarray, np.ndarray]:
+        home = np.fromiter((self.team_id(home) for home, _ in games), dtype=np.int64, count=len(games))
+        away = np.fromiter((self.team_id(away) for _, away in games), dtype=np.int64, count=len(games))
+        if (home == away).any():
+            raise ValueError("A team can't play itself")
+        return home, away
+
+    def _feature_matrix(
+        self,
+        home: np.ndarray,
+        away: np.ndarray,
+        season: Optional[int] = None,
+        week: Optional[int] = None,
+        date_time: Optional[pd.Timestamp] = None,
+        ) -> np.ndarray:
+        season = self.season if season is None else season
+        X = np.empty((len(home), len(self.predictors)))
+        context = {
+            'season': season,
+            'week': self.week if week is None else week,
+            'home_team_code': home,
+            'away_team_code': away,
+            'date_time': (self.date_time if date_time is None else pd.Timestamp(date_time)).value,
+        }
+        for name, i in self._context.items():
+            X[:, i] = context[name]
+        for (columns, features), ids in zip(self._sides, (home, away)):
+            team_features = self.team_features[ids[:, None], features]
+            team_features[self.team_seasons[ids] != season] = np.nan
+            X[:, columns] = team_features
+        return X
+
+    def predict_slate(self, games: Sequence[Tuple[str, str]], **context) -> np.ndarray:
+        """
+        Probability that the home team wins every (home, away) game, in one model call. Without a context, the
+        probabilities are read from the matchup matrix once it is loaded (see `load_matchups`).
+
+        Args:
+            games (Sequence[Tuple[str, str]]): (home team, away team) pairs
+            **context: `season`, `week` and `date_time` of the games. Default is the next week of the data (see
+            `Predictor`).
+
+        Returns:
+            np.ndarray: home win probabilities
+
+        Raises:
+            ValueError: for unknown teams or a team playing itself
+        """
+        if not len(games):
+            return np.empty(0)
+        if self.matchups is not None and not context:
+            # the default context is the one the matchup matrix was computed for
+            home, away = self._game_team_ids(games)
+            return self.matchups[home, away].astype(np.float64)
+        return self._predict_proba(self.feature_matrix(games, **context))
+
+    def _predict_proba(self, X: np.ndarray) -> np.ndarray:
+        # sklearn predicts tree by tree, a fixed cost of about a millisecond per call whatever the number of rows:
+        # the games are always predicted in one call
+        return self.model.predict_proba(X)[:, 1]
+
+    def predict(self, home: str, away: str, **context) -> float:
+        """
+        Probability that `home` beats `away`, see `predict_slate`.
+        """
+        return float(self.predict_slate([(home, away)], **context)[0])
+
+    ### MATCHUP MATRIX ###
+
+    def matchup_fingerprint(self) -> str:
+        """
+        Hash of everything the matchup matrix depends on: the model version, the team features and the default
+        context (season, week, date_time). New data or a new model gives a new fingerprint.
+        """
+        digest = hashlib.sha256(self.model_version.encode())
+        for array in (self.team_features, self.team_seasons):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        digest.update(f'{self.season}/{self.week}/{self.date_time.value}'.encode())
+        return digest.hexdigest()
+
+    def compute_matchups(self) -> np.ndarray:
+        """
+        (home team ID, away team ID) float32 matrix of the home win probability of every matchup in the default
+        context, from one batched prediction of the 32 x 31 games. The diagonal is NaN.
+        """
+        n_teams = len(teams.TEAMS)
+        home, away = np.divmod(np.arange(n_teams * n_teams), n_teams)
+        games = home != away
+        matchups = np.full(n_teams * n_teams, np.nan, dtype=np.float32)
+        matchups[games] = self._predict_proba(self._feature_matrix(home[games], away[games]))
+        return matchups.reshape(n_teams, n_teams)
+
+    def load_matchups(self, directory: Path = MATCHUPS_DIR, rebuild: bool = False) -> np.ndarray:
+        """
+        Memory-maps the matchup matrix of the current fingerprint, computing and saving it first if it doesn't
+        exist (the matrices of older fingerprints are deleted). From then on `predict`/`predict_slate` without a
+        context are lookups in the matrix and never call the model.
+
+        The matrix is saved with a JSON file of what it was computed from: the fingerprint, the model version, the
+        default context and the `sources` digests of the model and data files, which the command line compares with
+        the files to tell whether the matrix is up to date.
+
+        Args:
+            directory (Path, optional): where the matrices are stored. Default is MATCHUPS_DIR.
+            rebuild (bool, optional): recompute the matrix even if it exists. Default is False.
+
+        Returns:
+            np.ndarray: the read-only memory-mapped matrix, see `compute_matchups`
+        """
+        directory = Path(directory)
+        fingerprint = self.matchup_fingerprint()
+        path = directory / f"matchups-{fingerprint[:20]}.npy"
+        inputs = {
+            'fingerprint': fingerprint, 'model_version': self.model_version, 'season': self.season, 'week': self.week,
+            'sources': self.sources,
+        }
+        if rebuild or not path.exists():
+            directory.mkdir(parents=True, exist_ok=True)
+            # written next to the final file and renamed, so a reader never maps a partial matrix
+            partial = directory / f"partial-{path.name}"
+            np.save(partial, self.compute_matchups())
+            os.replace(partial, path)
+            for stale in directory.glob("matchups-*"):
+                if stale.stem != path.stem:
+                    stale.unlink()
+        saved = path.with_suffix('.json')
+        if not saved.exists() or json.loads(saved.read_text()) != inputs:
+            # new files can give the same fingerprint (e.g. games that don't change the features yet)
+            partial = directory / f"partial-{saved.name}"
+            partial.write_text(json.dumps(inputs, indent=1))
+            os.replace(partial, saved)
+        self.matchups = np.load(path, mmap_mode='r')
+        return self.matchups
+
+
+### HTTP FRONT END ###
+
+
+def _context_arguments(values: Dict[str, Any]) -> Dict[str, Any]:
+    context = {key: int(values[key]) for key in ('season', 'week') if values.get(key) is not None}
+    if values.get('date_time') is not None:
+        context['date_time'] = pd.Timestamp(values['date_time'])
+    return context
+
+
+def make_server(predictor: Predictor, host: str = '127.0.0.1', port: int = 8000) -> ThreadingHTTPServer:
+    """
+    Local HTTP server of a predictor:
+        - GET /predict?home=KC&away=BUF[&season=2022&week=3]
+        - POST /slate with {"games": [["KC", "BUF"], ...], "week": 3}
+
+    Both answer {"games": [{"home": ..., "away": ..., "home_win_probability": ...}, ...]}, and 400 with
+    {"error": ...} for invalid requests.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _answer(self, games: List[Tuple[str, str]], context: Dict[str, Any]) -> None:
+            try:
+                probabilities = predictor.predict_slate(games, **_context_arguments(context))
+            except (ValueError, TypeError) as error:
+                return self._send(400, {'error': str(error)})
+            self._send(200, {'games': [
+                {'home': home, 'away': away, 'home_win_probability': float(probability)}
+                for (home, away), probability in zip(games, probabilities)
+            ]})
+
+        def _send(self, status: int, payload: Dict[str, Any]) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/predict':
+                return self._send(404, {'error': f'unknown path {url.path}'})
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if 'home' not in query or 'away' not in query:
+                return self._send(400, {'error': 'home and away are required'})
+            self._answer([(query['home'], query['away'])], query)
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/slate':
+                return self._send(404, {'error': f'unknown path {self.path}'})
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                games = [(str(home), str(away)) for home, away in request['games']]
+            except (ValueError, KeyError, TypeError):
+                return self._send(400, {'error': 'expected {"games": [[home, away], ...]}'})
+            self._answer(games, request)
+
+        def log_message(self, format, *args):
+            # no line per request
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def _parse_game(value: str) -> Tuple[str, str]:
+    away, separator, home = value.partition('@')
+    if not separator or not away or not home:
+        raise argparse.ArgumentTypeError("expected <away>@<home>, e.g. KC@BUF")
+    return home, away
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train", help="fit the model on the game level data and save it to MODEL_PATH")
+    train.add_argument("--data", type=str, default="transformed.csv", help="game level data file in DATA_DIR")
+    train.add_argument("--last-season", type=int, default=None, help="last season to train on")
+    predict = commands.add_parser("predict", help="home win probability of one game")
+    predict.add_argument("home")
+    predict.add_argument("away")
+    slate = commands.add_parser("slate", help="home win probabilities of a slate of games")
+    slate.add_argument("games", type=_parse_game, nargs="+", help="games as <away>@<home>")
+    for command in (predict, slate):
+        command.add_argument("--season", type=int, default=None)
+        command.add_argument("--week", type=int, default=None)
+    matchups = commands.add_parser("matchups", help="compute the matchup matrix of the current model and data")
+    matchups.add_argument("--rebuild", action="store_true", help="recompute it even if it is up to date")
+    serve = commands.add_parser("serve", help="answer predictions over HTTP")
+    serve.add_argument("--host", type=str, default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--matchups", action="store_true", help="answer the default context from the matchup matrix")
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        from src.data_preparation import load_data_from_disk
+        print(f"saved to {save_model(train_model(load_data_from_disk(args.data), last_season=args.last_season))}")
+    elif args.command == "matchups":
+        predictor = Predictor()
+        predictor.load_matchups(rebuild=args.rebuild)
+        print(f"matchups of season {predictor.season} week {predictor.week} in {predictor.matchups.filename}")
+    elif args.command == "serve":
+        predictor = Predictor()
+        if args.matchups:
+            predictor.load_matchups()
+        server = make_server(predictor, args.host, args.port)
+        print(f"serving on http://{args.host}:{server.server_address[1]}")
+        server.serve_forever()
+    else:
+        games = [(args.home, args.away)] if args.command == "predict" else args.games
+        context = {'season': args.season, 'week': args.week}
+        probabilities = Predictor().predict_slate(games, **{key: value for key, value in context.items() if value is not None})
+        for (home, away), probability in zip(games, probabilities):
+            print(f"{away} @ {home}: {home} win probability {probability:.1%}")
+
+
+if __name__ == "__main__":
+    main()
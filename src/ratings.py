@@ -0,0 +1,259 @@
+########## ratings.py ##########
+"""
+Elo ratings of the teams, as pre-game features that account for the strength of the opponents (the rolling
+`*_rate_last_{n}_games` features only look at a team's own games and reset every season).
+
+The ratings live in a 32-slot array indexed by team ID and are updated in one chronological pass over the
+games, a week at a time: a team plays at most once a week, so the games of a week are updated together with
+array operations. The update is the usual Elo update with a margin of victory multiplier (the larger the
+win, the larger the update, damped for favourites) and a home field advantage, and every rating regresses
+part of the way to the mean between seasons.
+
+Usage:
+    elo = EloRatings()
+    features = elo.update(data)      # pre-game ratings of every row of the prepared team-game data
+    elo.save()
+    ...
+    elo = EloRatings.load()
+    elo.update(new_rows)             # weekly: only the rows of the new games
+"""
+
+
+# common imports
+import json
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.paths import DATA_DIR
+from src import teams
+from src.data_preparation import _with_columns, game_keys
+
+RATINGS_PATH = DATA_DIR / "elo_ratings.npz"
+
+MEAN_RATING = 1500.0
+K_FACTOR = 20.0
+# rating points added to the home team, not at neutral sites (Super Bowls)
+HOME_ADVANTAGE = 48.0
+# share of the distance to the mean a rating loses between seasons
+SEASON_REGRESSION = 1 / 3
+
+ELO_COLUMNS = ['elo', 'opp_elo', 'elo_win_probability']
+
+
+class EloRatings:
+    """
+    Online Elo ratings of the 32 teams, indexed by team ID (see teams.TEAMS).
+
+    `update` takes team-game rows of games more recent than the ones already processed and returns the
+    pre-game ratings of every row, so replaying the whole history once or feeding it week by week gives the
+    same features.
+    """
+
+    def __init__(
+        self,
+        k: float = K_FACTOR,
+        home_advantage: float = HOME_ADVANTAGE,
+        season_regression: float = SEASON_REGRESSION,
+        mean: float = MEAN_RATING,
+    ):
+        self.k = k
+        self.home_advantage = home_advantage
+        self.season_regression = season_regression
+        self.mean = mean
+        self.ratings = np.full(len(teams.TEAMS), mean)
+        # season and kickoff of the latest game played, -1/NaT before the first one
+        self.season = -1
+        self.last_played = np.datetime64('NaT', 'ns')
+
+    def win_probability(self, rating_difference: np.ndarray) -> np.ndarray:
+        """
+        Expected score of a team rated `rating_difference` points above its opponent (home advantage included).
+        """
+        return 1 / (1 + 10 ** (-np.asarray(rating_difference) / 400))
+
+    def margin_multiplier(self, margin: np.ndarray, winner_difference: np.ndarray) -> np.ndarray:
+        """
+        Scale of the update for a win by `margin` points of a team rated `winner_difference` points above the
+        loser: grows with the log of the margin and shrinks when the favourite wins (autocorrelation).
+        """
+        return np.log(np.maximum(np.abs(margin), 1) + 1) * 2.2 / (winner_difference * 0.001 + 2.2)
+
+    ### UPDATE ###
+
+    def update(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Pre-game ratings of every team-game row, processing the games in chronological order. The played games
+        (with points) update the ratings, the others only get the current ratings of their teams.
+
+        Args:
+            data (pd.DataFrame): prepared team-game rows (numeric `week`, `home_or_away`, `date_time`, points)
+            of games more recent than the games already processed
+
+        Returns:
+            pd.DataFrame: `elo`, `opp_elo` and `elo_win_probability` (home advantage included) of every row,
+            with the index of `data`
+
+        Raises:
+            ValueError: if a played game is not more recent than the last game processed (corrections of
+            past games need a replay from a new EloRatings), or a team plays twice in a week
+        """
+        team_ids = teams.team_ids(data['team']).astype(np.int64)
+        opp_ids = teams.team_ids(data['opp']).astype(np.int64)
+        season = data['season'].to_numpy(dtype=np.int64)
+        week = data['week'].to_numpy(dtype=np.int64)
+        kickoff = data['date_time'].to_numpy(dtype='datetime64[ns]')
+        margin = data['points_scored'].to_numpy(dtype=np.float64) - data['points_allowed'].to_numpy(dtype=np.float64)
+        is_home = data['home_or_away'].to_numpy(dtype=object) == 'HOME'
+        neutral = data['@'].to_numpy(dtype=object) == 'N' if '@' in data.columns else np.zeros(len(data), dtype=bool)
+
+        # one row per game, the first one found, seen from the home team
+        codes, _ = pd.factorize(game_keys(season, week, team_ids, opp_ids))
+        n_games = codes.max() + 1 if len(codes) else 0
+        first = np.empty(n_games, dtype=np.int64)
+        first[codes[::-1]] = np.arange(len(codes))[::-1]
+        order = np.lexsort((first, kickoff[first]))
+        game_rows = first[order]
+        home_side = is_home[game_rows]
+        home = np.where(home_side, team_ids[game_rows], opp_ids[game_rows])
+        away = np.where(home_side, opp_ids[game_rows], team_ids[game_rows])
+        home_margin = np.where(home_side, margin[game_rows], -margin[game_rows])
+        played = ~np.isnan(home_margin)
+        if played.any() and kickoff[game_rows][played].min() <= self.last_played:
+            raise ValueError(f"Games on or before {self.last_played} are already rated, replay them from a new EloRatings")
+
+        home_rating, away_rating = self._run(
+            season[game_rows], week[game_rows], home, away, home_margin,
+            np.where(neutral[game_rows], 0.0, self.home_advantage), kickoff[game_rows])
+
+        # back to the rows, in the original order of the games
+        pre_game = np.empty((n_games, 2))
+        pre_game[order, 0], pre_game[order, 1] = home_rating, away_rating
+        home_of_game = np.empty(n_games, dtype=np.int64)
+        home_of_game[order] = home
+        advantage = np.empty(n_games)
+        advantage[order] = np.where(neutral[game_rows], 0.0, self.home_advantage)
+
+        row_is_home = team_ids == home_of_game[codes]
+        elo = np.where(row_is_home, pre_game[codes, 0], pre_game[codes, 1])
+        opp_elo = np.where(row_is_home, pre_game[codes, 1], pre_game[codes, 0])
+        difference = elo - opp_elo + np.where(row_is_home, advantage[codes], -advantage[codes])
+        return pd.DataFrame(
+            {'elo': elo, 'opp_elo': opp_elo, 'elo_win_probability': self.win_probability(difference)},
+            index=data.index,
+        )
+
+    def _run(
+        self,
+        season: np.ndarray,
+        week: np.ndarray,
+        home: np.ndarray,
+        away: np.ndarray,
+        home_margin: np.ndarray,
+        advantage: np.ndarray,
+        kickoff: np.ndarray,
+        ):
+        # games in chronological order. returns the pre-game ratings of the home and away teams
+        home_rating = np.empty(len(home))
+        away_rating = np.empty(len(home))
+        # boundaries of the (season, week) batches
+        starts = np.flatnonzero(np.r_[True, (season[1:] != season[:-1]) | (week[1:] != week[:-1])])
+        for start, end in zip(starts, np.r_[starts[1:], len(home)]):
+            h, a = home[start:end], away[start:end]
+            if np.bincount(np.concatenate([h, a]), minlength=len(self.ratings)).max() > 1:
+                raise ValueError(f"A team plays twice in week {week[start]} of {season[start]}")
+            if season[start] > self.season:
+                if self.season >= 0:
+                    self.ratings = self.mean + (self.ratings - self.mean) * (1 - self.season_regression)
+                self.season = int(season[start])
+            home_rating[start:end], away_rating[start:end] = self.ratings[h], self.ratings[a]
+
+            played = ~np.isnan(home_margin[start:end])
+            if not played.any():
+                continue
+            h, a, margin = h[played], a[played], home_margin[start:end][played]
+            difference = self.ratings[h] + advantage[start:end][played] - self.ratings[a]
+            score = np.sign(margin) / 2 + 0.5
+            # rating difference in favour of the winner, 0 for ties
+            winner_difference = np.sign(margin) * difference
+            shift = self.k * self.margin_multiplier(margin, winner_difference) * (score - self.win_probability(difference))
+            self.ratings[h] += shift
+            self.ratings[a] -= shift
+            self.last_played = kickoff[start:end][played].max()
+        return home_rating, away_rating
+
+    ### PERSISTENCE ###
+
+    def save(self, path: Path = RATINGS_PATH) -> Path:
+        """
+        Saves the ratings and parameters, to resume with `load` and `update` when new games arrive.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        params = {'k': self.k, 'home_advantage': self.home_advantage,
+                  'season_regression': self.season_regression, 'mean': self.mean}
+        np.savez(path, ratings=self.ratings, season=self.season, last_played=self.last_played.astype(np.int64),
+                 params=json.dumps(params))
+        return path
+
+    @classmethod
+    def load(cls, path: Path = RATINGS_PATH) -> "EloRatings":
+        """
+        Ratings saved by `save`.
+        """
+        state = np.load(path)
+        elo = cls(**json.loads(str(state['params'])))
+        elo.ratings = state['ratings']
+        elo.season = int(state['season'])
+        elo.last_played = state['last_played'].astype('datetime64[ns]')
+        return elo
+
+
+def add_elo_columns(data: pd.DataFrame, elo: Optional[EloRatings] = None) -> pd.DataFrame:
+    """
+    Adds the pre-game `elo`, `opp_elo` and `elo_win_probability` of every team-game row, replaying every game
+    of the data. `pair_home_away_games(data, columns=[..., 'elo'])` then gives `home_team_elo`/`away_team_elo`.
+
+    Args:
+        data (pd.DataFrame): prepared team-game data, see `EloRatings.update`
+        elo (EloRatings, optional): ratings to start from, updated in place. Default is a new EloRatings.
+
+    Returns:
+        pd.DataFrame: data including the Elo columns
+    """
+    elo = EloRatings() if elo is None else elo
+    ratings = elo.update(data)
+    return _with_columns(data, {column: ratings[column] for column in ELO_COLUMNS})
+
+
+def add_elo_features(game_level_data: pd.DataFrame, data: pd.DataFrame, elo: Optional[EloRatings] = None) -> pd.DataFrame:
+    """
+    Adds `home_team_elo`, `away_team_elo` and `home_team_elo_win_probability` to game level data (e.g. the
+    rows of transformed.csv), from the ratings of the team-game data the games come from.
+
+    Args:
+        game_level_data (pd.DataFrame): one row per game with `season`, numeric `week`, `home_team` and `away_team`
+        data (pd.DataFrame): prepared team-game data with every game of `game_level_data`
+        elo (EloRatings, optional): ratings to start from, updated in place. Default is a new EloRatings.
+
+    Returns:
+        pd.DataFrame: game_level_data including the Elo features, NaN for games missing from `data`
+    """
+    elo = EloRatings() if elo is None else elo
+    ratings = elo.update(data)
+    home_rows = data['home_or_away'].to_numpy(dtype=object) == 'HOME'
+    keys = game_keys(data['season'].to_numpy(), data['week'].to_numpy(),
+                     teams.team_ids(data['team']), teams.team_ids(data['opp']))[home_rows]
+    games = game_keys(game_level_data['season'].to_numpy(), game_level_data['week'].to_numpy(),
+                      teams.team_ids(game_level_data['home_team']), teams.team_ids(game_level_data['away_team']))
+    positions = pd.Index(keys).get_indexer(games)
+    found = positions >= 0
+    values = ratings.to_numpy()[home_rows][positions]
+    values[~found] = np.nan
+    return _with_columns(game_level_data, {
+        'home_team_elo': values[:, 0],
+        'away_team_elo': values[:, 1],
+        'home_team_elo_win_probability': values[:, 2],
+    })
@@ -2,114 +2,338 @@
 
 
 # common imports
-import requests
-import time
+import argparse
+import datetime
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import List, Optional
 #from tqdm import tqdm_gui
-from bs4 import BeautifulSoup
-import numpy as np
-import pandas as pd
 
-from src.paths import DATA_DIR
+from src.paths import ensure_data_dir
+from src.fetching import DEFAULT_RATE, DEFAULT_WORKERS, FetchEngine
+from src.http_cache import DEFAULT_MAX_BYTES, ResponseCache
+from src.teams import team_abbreviations
 
-# data scraping function 
-def scrape():
+# pandas, bs4 and the page parser (lxml) are imported by the functions using them, so importing this module
+# for its constants (e.g. by the command line) stays fast
+
+BASE_URL = "https://www.pro-football-reference.com"
+
+# oldest season with the complete set of stats we use
+FIRST_SEASON = 1994
+
+
+def current_season(today: Optional[datetime.date] = None) -> int:
     """
-    This function fetches game data from www.pro-football-reference.com for each team and each season from 1994-2022.
-    The function also manipulates the dataset's missing values to prepare the raw version of the dataset.
-    This function will create a .csv file into the working directory.
-    """
-
-    # creating a list of years in descending order and an empty list to add dataframes to.
-    years = list(range(2022, 1993, -1))
-    all_games = []
-
-    # stating the website we will fetch data from, starting with the current 2022 season.
-    url = "https://www.pro-football-reference.com/years/2022/"
-
-    # the outer/first for loop creates a list of links that the inner/second for loop will iterate through.
-    # we also change the year of the url at the end of the first for loop so new links can be generated from previous seasons.
-    # the second for loop reads in the data and appends it to the empty list all_games.
-    # the second loop also creates two new columns (Season and Team) to track which team and year each record belongs to.
-    # we also perform some initial data cleansing such as dropping a column level and capitalizing team name abbreviations.
-    for year in years:
-        data = requests.get(url)
-        soup = BeautifulSoup(data.text, features="lxml")
-        first = soup.select('div.content_grid')[0]
-        links = first.find_all('a')
-        links = [l.get("href") for l in links]
-        team_urls = [f"https://www.pro-football-reference.com/{l}" for l in links]
-        url = url.replace(str(year), str(int(year)-1))
-
-        for team_url in team_urls:
-            #my_list = ['aaa', 'bbb', 'ccc', 'ddd', 'eee']
-            #for i in tqdm_gui(my_list): # - Not working
-            #for j in [2, 3, 1, 2]: # - Causes the loop to hang
-                #time.sleep(j)
-            team_name = team_url.split("/")[-2]
-            firstdata = requests.get(team_url)
-            sched = pd.read_html(firstdata.text, header = None, match = "Schedule & Game Results")
-            df = sched[0]
-            df.columns = df.columns.droplevel()
-
-            df["Season"] = year
-            df["Team"] = team_name.upper()
-            all_games.append(df)
-            time.sleep(2) # added to not stress the website with requests
-
-    # combining all dataframes into one dataframe
-    gamesdf = pd.concat(all_games)
-
-    # transforming all column names to lowercase so exploratory analysis will be easier to perform.
-    gamesdf.columns = [c.lower() for c in gamesdf.columns]
-
-    # resetting the index without keeping the old one
-    gamesdf = gamesdf.reset_index(drop=True)
-
-    # dropping a column with no value. this column is just a link that provides more details for that particular game - aka boxscore. 
-    df = gamesdf.drop(gamesdf.columns[[4]], axis=1) 
-
-    # renaming most column names for more clarity
-    df.columns.values[3] = "time"
-    df.columns.values[4] = "result"
-    df.columns.values[6] = "record"
-    df.columns.values[7] = "@"
-    df.columns.values[9] = "points_scored"
-    df.columns.values[10] = "points_allowed"
-    df.columns.values[11] = "1st_downs"
-    df.columns.values[13] = "passyd"
-    df.columns.values[14] = "rushyd"
-    df.columns.values[16] = "1st_downs_allowed"
-    df.columns.values[17] = "totyd_allowed"
-    df.columns.values[18] = "passyd_allowed"
-    df.columns.values[19] = "rushyd_allowed"
-    df.columns.values[20] = "to_forced"
-    df.columns.values[21] = "off_exp_pts"
-    df.columns.values[22] = "def_exp_pts"
-    df.columns.values[23] = "sts_exp_pts"
-
-    # some team abbreviations are not listed as expected, creating a dictionary to rectify this.
-    team_abbr_dict = {"RAM":"LAR", "KAN":"KC", "SFO":"SF", "TAM":"TB", "CRD":"ARZ",
-              "NWE":"NE", "GNB":"GB", "HTX":"HOU", "OTI":"TEN", "RAI":"LV",
-              "NOR":"NO", "SDG":"LAC", "CLT":"IND", "RAV":"BAL"}
-
-    # using the manually created dictionary to replace team abbreviations.
-    df = df.replace({"team": team_abbr_dict}) 
-
-    # building a list to view all the column names in the dataframe.
-    cols = df.columns.tolist()
-
-    # reordering the column list by placing the season and team columns first.
-    cols = cols[-2:] + cols[:-2]
-
-    # applying the new column order to the dataframe and viewing it.
-    df = df[cols]
+    Season that is being played (or, between March and August, the next one to be played).
+    January and February games belong to the season that started the previous September.
+
+    Args:
+        today (datetime.date, optional): reference date. Default is today.
+
+    Returns:
+        int: the season
+    """
+    today = today or datetime.date.today()
+    return today.year if today.month >= 3 else today.year - 1
+
+
+def is_season_finished(season: int, today: Optional[datetime.date] = None) -> bool:
+    """
+    A season starts in September and ends with the Super Bowl in February of the following year,
+    so its pages stop changing once February of season + 1 is over.
+
+    Args:
+        season (int): season to check
+        today (datetime.date, optional): reference date. Default is today.
+
+    Returns:
+        bool: True if no more games will be played in that season
+    """
+    today = today or datetime.date.today()
+    return (today.year, today.month) > (season + 1, 2)
+
+
+def get_team_urls(season_html: str) -> List[str]:
+    """
+    Reads the links to every team page from a season page (www.pro-football-reference.com/years/<year>/).
+
+    Args:
+        season_html (str): html of the season page
+
+    Returns:
+        List[str]: team page urls, in the order they are listed on the season page
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(season_html, features="lxml")
+    first = soup.select('div.content_grid')[0]
+    links = first.find_all('a')
+    links = [l.get("href") for l in links]
+    return [f"{BASE_URL}/{l}" for l in links]
+
+
+def parse_team_page(team_html: str, year: int, team_url: str) -> "pd.DataFrame":
+    """
+    Reads the "Schedule & Game Results" table of a team page and tags it with the season and team.
+
+    Args:
+        team_html (str): html of the team page
+        year (int): season the page belongs to
+        team_url (str): url of the team page, used to get the team abbreviation
+
+    Returns:
+        pd.DataFrame: schedule table (see `parse_games_table`) with the season and team columns first
+    """
+    from src.page_parser import parse_games_table
+    team_name = team_url.split("/")[-2]
+    df = parse_games_table(team_html)
+
+    df.insert(0, "season", year)
+    df.insert(1, "team", team_name.upper())
+    return df
+
+
+def clean_scraped_games(all_games: List["pd.DataFrame"]) -> "pd.DataFrame":
+    """
+    Combines the schedule tables of every team/season and manipulates the dataset's missing values
+    to prepare the raw version of the dataset.
+
+    Args:
+        all_games (List[pd.DataFrame]): tables returned by `parse_team_page`
+
+    Returns:
+        pd.DataFrame: raw dataset, with the same columns as scraped_data.csv
+    """
+    df = _combine_tables(all_games)
 
     # dropping bye week rows, playoff rows, games not played yet, etc.
+    # (the canceled game between the Buffalo Bills @ Cincinnati Bengals on 2022-01-02 is already dropped by the parser)
     df = df[df['result'].notna()]
-    
-    # drop the canceled game that took place on 2022-01-02 20:00:00 between the Buffalo Bills @ Cincinnati Bengals
-    # all the stats for this game were canceled, the game didn't even finish the 1st half. 
-    df.drop(df[df['passyd'] == 'Canceled'].index, inplace = True)
+
+    return df
+
+
+def scheduled_games(all_games: List["pd.DataFrame"]) -> "pd.DataFrame":
+    """
+    The games of the schedule tables that are not played yet (no `result`), i.e. what `clean_scraped_games`
+    drops apart from the bye weeks and the "Playoffs" separator. The remaining schedule of a season in progress,
+    see `simulation.season_state`.
+
+    Args:
+        all_games (List[pd.DataFrame]): tables returned by `parse_team_page`
+
+    Returns:
+        pd.DataFrame: one row per team and unplayed game, with the same columns as scraped_data.csv (no results)
+    """
+    df = _combine_tables(all_games)
+    unplayed = df['result'].isna() & df['week'].notna() & df['opp'].notna() & (df['opp'] != 'Bye Week')
+    return df[unplayed]
+
+
+def _combine_tables(all_games: List["pd.DataFrame"]) -> "pd.DataFrame":
+    import pandas as pd
+    # combining all dataframes into one dataframe and resetting the index without keeping the old one
+    df = pd.concat(all_games, ignore_index=True)
+
+    # the team pages use the site codes of the franchises ("RAM", "KAN", ...), replacing them with our abbreviations.
+    df["team"] = team_abbreviations(df["team"])
+    return df
+
+
+def fetch_games(years: List[int], engine: FetchEngine) -> "pd.DataFrame":
+    """
+    Fetches and parses the game data of every team for the given seasons.
+
+    Args:
+        years (List[int]): seasons to fetch, the output keeps this order
+        engine (FetchEngine): engine used to download the pages
+
+    Returns:
+        pd.DataFrame: cleaned game data, see `clean_scraped_games`
+    """
+    return clean_scraped_games(fetch_schedule_tables(years, engine))
+
+
+def fetch_schedule_tables(years: List[int], engine: FetchEngine) -> List["pd.DataFrame"]:
+    """
+    Fetches and parses the schedule table of every team for the given seasons, played or not.
+
+    Args:
+        years (List[int]): seasons to fetch, the output keeps this order
+        engine (FetchEngine): engine used to download the pages
+
+    Returns:
+        List[pd.DataFrame]: tables returned by `parse_team_page`, in the order of the season/team pages
+    """
+    all_games = {}
+
+    # the season pages list the links to every team page of that season.
+    # as soon as a season page arrives, its team pages are queued, and each team page is parsed as soon as it arrives.
+    # the pages finish in any order, so every dataframe is keyed by (season position, team position) to keep
+    # the final dataset in the same order as the season/team pages list them.
+    pending = {}
+    for year_idx, year in enumerate(years):
+        revalidate = not is_season_finished(year)
+        pending[engine.submit(f"{BASE_URL}/years/{year}/", revalidate)] = (year_idx, None, None)
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            year_idx, team_idx, team_url = pending.pop(future)
+            html = future.result()
+            if team_url is None:
+                revalidate = not is_season_finished(years[year_idx])
+                for team_idx, team_url in enumerate(get_team_urls(html)):
+                    pending[engine.submit(team_url, revalidate)] = (year_idx, team_idx, team_url)
+            else:
+                all_games[(year_idx, team_idx)] = parse_team_page(html, years[year_idx], team_url)
+
+    return [all_games[key] for key in sorted(all_games)]
+
+
+def seasons_to_update(existing: "pd.DataFrame", last_season: int) -> List[int]:
+    """
+    Works out which seasons an incremental scrape has to fetch, from the stored rows alone: every season after
+    the latest one already stored, up to `last_season`, and the latest stored season itself unless it is
+    finished, i.e. both finalists have their SuperBowl row. Earlier seasons were finished when a later one
+    was stored, so their rows can't have changed.
+
+    Args:
+        existing (pd.DataFrame): the data currently stored in scraped_data.csv
+        last_season (int): most recent season to fetch
+
+    Returns:
+        List[int]: seasons to fetch, in descending order
+    """
+    latest_stored = int(existing['season'].max())
+    latest_rows = existing[existing['season'] == latest_stored]
+    finished = (latest_rows['week'].astype(str) == 'SuperBowl').sum() >= 2
+    return list(range(last_season, latest_stored if finished else latest_stored - 1, -1))
+
+
+def upsert_games(existing: "pd.DataFrame", fetched: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    Merges freshly fetched rows into the stored data. Rows are identified by (season, team, week):
+    fetched rows replace stored rows with the same key and new keys are added.
+    The result keeps the order of a full scrape (most recent season first).
+
+    Args:
+        existing (pd.DataFrame): the data currently stored in scraped_data.csv
+        fetched (pd.DataFrame): rows returned by `fetch_games`
+
+    Returns:
+        pd.DataFrame: the updated data
+    """
+    import pandas as pd
+
+    def game_keys(df: "pd.DataFrame") -> "pd.MultiIndex":
+        # `week` mixes numbers and playoff round names, so it is compared as a string
+        return pd.MultiIndex.from_arrays([df['season'].astype(int), df['team'], df['week'].astype(str)])
+
+    kept = existing[~game_keys(existing).isin(game_keys(fetched))]
+    df = pd.concat([fetched, kept], ignore_index=True)
+    return df.sort_values(by='season', ascending=False, kind='stable', ignore_index=True)
+
+
+# data scraping function
+def scrape(
+    years: Optional[List[int]] = None,
+    first_season: int = FIRST_SEASON,
+    last_season: Optional[int] = None,
+    incremental: bool = False,
+    workers: int = DEFAULT_WORKERS,
+    rate: float = DEFAULT_RATE,
+    cache: bool = True,
+    offline: bool = False,
+    max_cache_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> "pd.DataFrame":
+    """
+    This function fetches game data from www.pro-football-reference.com for each team and each season
+    from `first_season` (1994) to `last_season` (the current season).
+    The function also manipulates the dataset's missing values to prepare the raw version of the dataset.
+    This function will create a .csv file into the working directory, and a schedule.csv next to it with the
+    games of the fetched seasons that are not played yet (see `scheduled_games`).
+
+    Pages are downloaded concurrently by a `FetchEngine` (`workers` threads sharing a per-host rate limit
+    of `rate` requests per second), and every page is parsed as soon as it arrives.
+
+    Responses are kept in an on-disk cache (DATA_DIR/http_cache). Pages of finished seasons never change,
+    so they are served from the cache without touching the network; pages of the current season are
+    revalidated with conditional GETs.
+
+    With `incremental=True` (the weekly Tuesday refresh), the existing scraped_data.csv is read, only the
+    seasons it doesn't hold completely (see `seasons_to_update`) are fetched, and the new or changed game
+    rows are upserted into it. Without an existing dataset it falls back to a full scrape.
+
+    Args:
+        years (List[int], optional): seasons to fetch. Overrides `first_season`/`last_season` when given.
+        first_season (int, optional): oldest season to fetch. Default is FIRST_SEASON (1994).
+        last_season (int, optional): most recent season to fetch. Default is the current season.
+        incremental (bool, optional): only fetch the seasons in progress and upsert their rows. Default is False.
+        workers (int, optional): number of concurrent requests. Default is DEFAULT_WORKERS.
+        rate (float, optional): max requests per second sent to the website. Default is DEFAULT_RATE.
+        cache (bool, optional): use the on-disk response cache. Default is True.
+        offline (bool, optional): only use the cache, failing fast with `CacheMissError` on a cache miss. Default is False.
+        max_cache_bytes (int, optional): size cap of the cache, least recently used pages are evicted first.
+
+    Returns:
+        pd.DataFrame: the data written to scraped_data.csv
+    """
+    file_path = ensure_data_dir() / "scraped_data.csv"
+    if last_season is None:
+        last_season = current_season()
+
+    existing = None
+    if incremental and years is None and file_path.exists():
+        import pandas as pd
+        existing = pd.read_csv(file_path)
+        years = seasons_to_update(existing, last_season)
+
+    # creating a list of years in descending order
+    if years is None:
+        years = list(range(last_season, first_season - 1, -1))
+
+    response_cache = ResponseCache(max_bytes=max_cache_bytes) if cache or offline else None
+    with FetchEngine(workers=workers, rate=rate, cache=response_cache, offline=offline) as engine:
+        tables = fetch_schedule_tables(years, engine) if years else None
+
+    df = None
+    if tables:
+        df = clean_scraped_games(tables)
+        # only the fetched seasons can have unplayed games: the other ones are finished
+        scheduled_games(tables).to_csv(file_path.with_name("schedule.csv"), index=False)
+
+    if existing is not None:
+        if df is None:
+            # nothing was in progress, the stored data is already up to date
+            return existing
+        df = upsert_games(existing, df)
 
     # using pandas to convert the dataframe into a csv file.
-    df.to_csv(DATA_DIR / "scraped_data.csv", index=False)
+    df.to_csv(file_path, index=False)
+    return df
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None):
+    parser = argparse.ArgumentParser(prog=prog, description="Scrape NFL game data from www.pro-football-reference.com")
+    parser.add_argument("--first-season", type=int, default=FIRST_SEASON, help="oldest season to fetch")
+    parser.add_argument("--last-season", type=int, default=None, help="most recent season to fetch (default: current)")
+    parser.add_argument("--incremental", action="store_true", help="only fetch the seasons in progress and upsert new rows")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="number of concurrent requests")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="max requests per second to the website")
+    parser.add_argument("--no-cache", action="store_true", help="always download every page")
+    parser.add_argument("--offline", action="store_true", help="only use cached pages, fail on a cache miss")
+    args = parser.parse_args(argv)
+
+    scrape(
+        first_season=args.first_season,
+        last_season=args.last_season,
+        incremental=args.incremental,
+        workers=args.workers,
+        rate=args.rate,
+        cache=not args.no_cache,
+        offline=args.offline,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+########## simulation.py ##########
+"""
+Monte Carlo simulation of the rest of a season: playoff odds, seeds and win-total distributions of every team.
+
+The remaining regular season games are drawn at once as a (simulations, games) matrix of uniforms compared with
+the home win probabilities of the model, the standings are one matrix product with the team incidence matrix of
+the games, and the seeding and the playoff bracket are array operations over all the simulations - there is no
+Python loop over simulations. Simulations run in chunks of CHUNK_SIMS, each with its own RNG stream spawned from
+the seed, so the results only depend on the seed and never on the number of processes.
+
+Seeding is "tiebreak-lite": teams with the same record are ordered by their point differential so far, then at
+random - the NFL tiebreakers (head-to-head, division and common games records, ...) are not modelled.
+
+Usage:
+    python -m src.simulation --season 2022 --after-week 10 [--sims 100000] [--n-jobs 1] [--seed 0]
+"""
+
+
+# common imports
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src import parallel
+from src import teams
+from src.paths import DATA_DIR
+
+# simulations drawn together: a chunk of the season matrix of 272 games is about 20 MB of float32 uniforms
+CHUNK_SIMS = 20_000
+# the divisions of teams.py are the ones since the 2002 realignment
+FIRST_SEASON = 2002
+
+N_TEAMS = len(teams.TEAMS)
+# (divisions, 4) team IDs: the 4 AFC divisions, then the 4 NFC divisions
+DIVISION_TEAMS = np.array([np.flatnonzero(teams.DIVISIONS == division) for division in sorted(set(teams.DIVISIONS))])
+DIVISION_CONFERENCES = teams.CONFERENCE_IDS[DIVISION_TEAMS[:, 0]]
+CONFERENCE_TEAMS = [np.flatnonzero(teams.CONFERENCE_IDS == conference) for conference in (teams.AFC, teams.NFC)]
+
+
+def first_playoff_week(season: int) -> int:
+    """
+    Week number of the wild card round, see `convert_week_objects`: 18 before 2021, 19 since the 17 game seasons.
+    """
+    return 19 if season >= 2021 else 18
+
+
+def playoff_seeds(season: int) -> int:
+    """
+    Playoff teams per conference: 6 until 2019, 7 since 2020 (only the first seed has a bye).
+    """
+    return 7 if season >= 2020 else 6
+
+
+### SCHEDULE ###
+
+
+class SeasonState(NamedTuple):
+    """
+    Standings of a season after some weeks and the regular season games left to play.
+    The arrays of teams are indexed by team ID (see teams.TEAMS).
+    """
+    season: int
+    wins: np.ndarray        # (teams,) wins so far, a tie counts as half a win
+    point_diff: np.ndarray  # (teams,) points scored - points allowed so far
+    home: np.ndarray        # (games,) home team ID of every remaining game
+    away: np.ndarray        # (games,) away team ID of every remaining game
+    week: np.ndarray        # (games,) week of every remaining game
+
+
+def season_state(
+    data: pd.DataFrame,
+    season: int,
+    after_week: Optional[int] = None,
+    schedule: Optional[pd.DataFrame] = None,
+    ) -> SeasonState:
+    """
+    Standings after `after_week` and the remaining schedule of a season, from the prepared team-game data
+    (numeric `week` of `convert_week_objects`, `home_or_away` of `add_home_or_away_column`) and the games
+    scheduled but not played yet.
+
+    The remaining games are the rows of the data without a result or after `after_week`, and the rows of
+    `schedule`: the scraped data only holds the games already played, `scrape()` writes the unplayed games of
+    a season in progress to DATA_DIR/schedule.csv (see `scraping.scheduled_games`).
+
+    Args:
+        data (pd.DataFrame): prepared team-game data with the games of the season
+        season (int): season simulated
+        after_week (int, optional): the games after this week count as not played, to simulate the season as it
+        stood then. Default is every game with a result.
+        schedule (pd.DataFrame, optional): unplayed games as scraped (`season`, `team`, `week`, `opp` and `@`
+        columns of schedule.csv). The rows of a (team, week) that already has a row in `data` are left out, so
+        a schedule scraped before the data doesn't count a game twice.
+
+    Returns:
+        SeasonState: standings and remaining regular season games
+
+    Raises:
+        ValueError: for seasons before FIRST_SEASON, or if the games of the season, played or scheduled, stop
+        before its last regular season week (a season in progress without its schedule)
+    """
+    if season < FIRST_SEASON:
+        raise ValueError(f"Only the seasons since {FIRST_SEASON} have the divisions of teams.py")
+    last_week = first_playoff_week(season) - 1
+    rows = data[(data['season'] == season) & (data['week'] <= last_week)]
+    week = rows['week'].to_numpy(dtype=np.int64)
+    team_ids = teams.team_ids(rows['team'], rows['season']).astype(np.int64)
+    opp_ids = teams.team_ids(rows['opp'], rows['season']).astype(np.int64)
+    result = rows['result'].to_numpy(dtype=object)
+    played = np.isin(result, ['W', 'L', 'T'])
+    if after_week is not None:
+        played &= week <= after_week
+
+    points = (rows['points_scored'].to_numpy(dtype=np.float64) - rows['points_allowed'].to_numpy(dtype=np.float64))
+    wins = (result == 'W') + 0.5 * (result == 'T')
+    # every game has a row for both teams, the one of the lower team ID is kept
+    remaining = ~played & (team_ids < opp_ids)
+    is_home = rows['home_or_away'].to_numpy(dtype=object)[remaining] == 'HOME'
+    games = [(team_ids[remaining], opp_ids[remaining], week[remaining], is_home)]
+    if schedule is not None:
+        games.append(_scheduled_games(schedule, season, last_week, team_ids * 100 + week))
+    team, opp, game_week, is_home = (np.concatenate(parts) for parts in zip(*games))
+
+    if max(week.max(initial=0), game_week.max(initial=0)) < last_week:
+        # otherwise the games of the missing weeks would silently never be played
+        raise ValueError(f"The {season} games stop before week {last_week}: the games not played yet are needed, "
+                         "e.g. the schedule.csv written by scrape()")
+    return SeasonState(
+        season=season,
+        wins=np.bincount(team_ids[played], weights=wins[played], minlength=N_TEAMS),
+        point_diff=np.bincount(team_ids[played], weights=points[played], minlength=N_TEAMS),
+        home=np.where(is_home, team, opp),
+        away=np.where(is_home, opp, team),
+        week=game_week,
+    )
+
+
+def _scheduled_games(
+    schedule: pd.DataFrame,
+    season: int,
+    last_week: int,
+    stored: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (team, opponent, week, team is home) of the unplayed regular season games of the schedule, one row per
+    # game (the lower team ID), without the (team * 100 + week) keys `stored` in the data
+    rows = schedule[schedule['season'] == season]
+    # playoff rounds are named, and only scheduled once the regular season is over
+    week = pd.to_numeric(rows['week'], errors='coerce').to_numpy(dtype=np.float64)
+    regular = week <= last_week
+    rows, week = rows[regular], week[regular].astype(np.int64)
+    team_ids = teams.team_ids(rows['team'], rows['season']).astype(np.int64)
+    opp_ids = teams.team_ids(rows['opp'], rows['season']).astype(np.int64)
+    kept = (team_ids < opp_ids) & ~np.isin(team_ids * 100 + week, stored)
+    # '@' marks the away games. both rows of a game at a neutral site ('N') read 'N', the kept one is the home team
+    is_home = rows['@'].to_numpy(dtype=object) != '@'
+    return team_ids[kept], opp_ids[kept], week[kept], is_home[kept]
+
+
+def model_probabilities(predictor, state: SeasonState) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Home win probabilities of the remaining games (one batched prediction per week) and the (home, away) matrix
+    of the playoff games, from a `Predictor` built on the data up to the week the season is simulated from.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (games,) probabilities and (teams, teams) playoff matchup probabilities
+    """
+    names = teams.TEAM_NAMES
+    probabilities = np.empty(len(state.home))
+    for week in np.unique(state.week):
+        games = state.week == week
+        probabilities[games] = predictor.predict_slate(
+            list(zip(names[state.home[games]], names[state.away[games]])), season=state.season, week=int(week))
+
+    home, away = np.divmod(np.arange(N_TEAMS * N_TEAMS), N_TEAMS)
+    games = home != away
+    matchups = np.full(N_TEAMS * N_TEAMS, np.nan)
+    matchups[games] = predictor.predict_slate(
+        list(zip(names[home[games]], names[away[games]])), season=state.season, week=first_playoff_week(state.season))
+    return probabilities, matchups.reshape(N_TEAMS, N_TEAMS)
+
+
+### SIMULATION ###
+
+
+def _play(rng: np.random.Generator, matchups: np.ndarray, seeds: np.ndarray, home: np.ndarray, away: np.ndarray) -> np.ndarray:
+    # one playoff game per simulation between the seed positions `home` and `away`, returns the winner's position
+    sims = np.arange(len(seeds))
+    home_wins = rng.random(len(seeds)) < matchups[seeds[sims, home], seeds[sims, away]]
+    return np.where(home_wins, home, away)
+
+
+def _conference_champions(rng: np.random.Generator, matchups: np.ndarray, seeds: np.ndarray) -> np.ndarray:
+    # seeds: (simulations, seeds) team IDs in seed order. the better seed is always at home, and after the
+    # wild card round the best remaining seed plays the worst one
+    n_sims, n_seeds = seeds.shape
+    byes = 8 - n_seeds
+    remaining = [np.full(n_sims, seed) for seed in range(byes)]
+    for seed in range(byes, 4):
+        remaining.append(_play(rng, matchups, seeds, np.full(n_sims, seed), np.full(n_sims, n_seeds - 1 + byes - seed)))
+    remaining = np.sort(np.stack(remaining, axis=1), axis=1)
+    first = _play(rng, matchups, seeds, remaining[:, 0], remaining[:, 3])
+    second = _play(rng, matchups, seeds, remaining[:, 1], remaining[:, 2])
+    champion = _play(rng, matchups, seeds, np.minimum(first, second), np.maximum(first, second))
+    return seeds[np.arange(n_sims), champion]
+
+
+def _simulate_chunk(
+    state: SeasonState,
+    probabilities: np.ndarray,
+    matchups: np.ndarray,
+    n_sims: int,
+    seed: np.random.SeedSequence,
+    ) -> Dict[str, np.ndarray]:
+    # simulates `n_sims` seasons, returns the counts of every outcome per team
+    rng = np.random.default_rng(seed)
+    sims = np.arange(n_sims)[:, None]
+    n_games = len(state.home)
+
+    # regular season: wins = wins so far + every remaining game as the away team + home_wins @ (home - away)
+    home_wins = rng.random((n_sims, n_games), dtype=np.float32) < probabilities.astype(np.float32)
+    incidence = np.zeros((n_games, N_TEAMS), dtype=np.float32)
+    incidence[np.arange(n_games), state.home] = 1
+    incidence[np.arange(n_games), state.away] = -1
+    wins = home_wins.astype(np.float32) @ incidence + (state.wins + np.bincount(state.away, minlength=N_TEAMS))
+    del home_wins
+
+    # ordering key of the standings: wins, then the point differential rank (< 0.5 win), then a random draw
+    point_diff_rank = np.argsort(np.argsort(state.point_diff, kind='stable'), kind='stable')
+    key = wins + point_diff_rank / (2 * N_TEAMS) + rng.random((n_sims, N_TEAMS)) / (4 * N_TEAMS * N_TEAMS)
+
+    division_winners = DIVISION_TEAMS[np.arange(len(DIVISION_TEAMS)), np.argmax(key[:, DIVISION_TEAMS], axis=2)]
+    won_division = np.zeros((n_sims, N_TEAMS), dtype=bool)
+    won_division[sims, division_winners] = True
+
+    # seeds 1-4 are the division winners by record, then the wild cards
+    n_seeds = playoff_seeds(state.season)
+    conference_seeds = []
+    for conference, members in zip((teams.AFC, teams.NFC), CONFERENCE_TEAMS):
+        winners = division_winners[:, DIVISION_CONFERENCES == conference]
+        winners = np.take_along_axis(winners, np.argsort(-np.take_along_axis(key, winners, axis=1), axis=1), axis=1)
+        wild_card_key = np.where(won_division[:, members], -np.inf, key[:, members])
+        wild_cards = members[np.argsort(-wild_card_key, axis=1)[:, :n_seeds - len(winners[0])]]
+        conference_seeds.append(np.concatenate([winners, wild_cards], axis=1))
+
+    afc, nfc = (_conference_champions(rng, matchups, seeds) for seeds in conference_seeds)
+    # at the Super Bowl the NFC team is the home team in odd seasons (see `add_home_or_away_column`)
+    home, away = (nfc, afc) if state.season % 2 == 1 else (afc, nfc)
+    champion = np.where(rng.random(n_sims) < matchups[home, away], home, away)
+
+    seeds = np.concatenate(conference_seeds, axis=1)
+    positions = np.tile(np.arange(n_seeds), 2)
+    # a tie counts as half a win, win totals are counted in half wins
+    half_wins = np.rint(2 * wins).astype(np.int64)
+    n_bins = 2 * (n_games + int(np.ceil(state.wins.max(initial=0)))) + 1
+    return {
+        'wins': wins.sum(axis=0, dtype=np.float64),
+        'win_totals': np.bincount((np.arange(N_TEAMS) * n_bins + half_wins).ravel(),
+                                  minlength=N_TEAMS * n_bins).reshape(N_TEAMS, n_bins),
+        'seeds': np.bincount((seeds * n_seeds + positions).ravel(), minlength=N_TEAMS * n_seeds).reshape(N_TEAMS, n_seeds),
+        'division': won_division.sum(axis=0),
+        'conference': np.bincount(np.concatenate([afc, nfc]), minlength=N_TEAMS),
+        'champion': np.bincount(champion, minlength=N_TEAMS),
+    }
+
+
+class SeasonOdds(NamedTuple):
+    """
+    Results of `simulate_season`, every table indexed by team name.
+    """
+    odds: pd.DataFrame        # mean wins and the probability to make the playoffs, win the division, ...
+    win_totals: pd.DataFrame  # probability of every final number of wins
+    seeds: pd.DataFrame       # probability of every playoff seed
+
+
+def simulate_season(
+    state: SeasonState,
+    probabilities: np.ndarray,
+    matchups: np.ndarray,
+    n_sims: int = 100_000,
+    seed: int = 0,
+    n_jobs: Optional[int] = None,
+    ) -> SeasonOdds:
+    """
+    Simulates the rest of the season `n_sims` times: the remaining games, the standings, the seeding and the
+    playoff bracket.
+
+    Args:
+        state (SeasonState): standings and remaining games, see `season_state`
+        probabilities (np.ndarray): home win probability of every remaining game
+        matchups (np.ndarray): (home team ID, away team ID) home win probabilities of the playoff games
+        n_sims (int, optional): number of simulated seasons. Default is 100_000.
+        seed (int, optional): seed of the RNG streams. Default is 0.
+        n_jobs (int, optional): processes, one chunk of CHUNK_SIMS simulations at a time each,
+        see `parallel.resolve_n_jobs`. Default is serial.
+
+    Returns:
+        SeasonOdds: odds, win total and seed distributions of every team
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    if probabilities.shape != state.home.shape:
+        raise ValueError("One probability per remaining game is needed")
+    matchups = np.asarray(matchups, dtype=np.float64)
+    sizes = [min(CHUNK_SIMS, n_sims - start) for start in range(0, n_sims, CHUNK_SIMS)]
+    # independent streams, one per chunk: the same chunks get the same streams whatever the number of processes
+    streams = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = (repeat(state), repeat(probabilities), repeat(matchups), sizes, streams)
+
+    n_processes = min(parallel.resolve_n_jobs(n_jobs), len(sizes))
+    if n_processes > 1:
+        with ProcessPoolExecutor(max_workers=n_processes, initializer=parallel.limit_threads) as executor:
+            results = list(executor.map(_simulate_chunk, *args))
+    else:
+        results = list(map(_simulate_chunk, *args))
+    counts = {name: sum(result[name] for result in results) for name in results[0]}
+
+    names = pd.Index(teams.TEAM_NAMES, name='team')
+    seeds = counts['seeds'] / n_sims
+    byes = 8 - seeds.shape[1]
+    odds = pd.DataFrame({
+        'conference': np.where(teams.CONFERENCE_IDS == teams.NFC, 'NFC', 'AFC'),
+        'division': teams.DIVISIONS,
+        'wins_so_far': state.wins,
+        'mean_wins': counts['wins'] / n_sims,
+        'make_playoffs': seeds.sum(axis=1),
+        'win_division': counts['division'] / n_sims,
+        'first_round_bye': seeds[:, :byes].sum(axis=1),
+        'win_conference': counts['conference'] / n_sims,
+        'win_super_bowl': counts['champion'] / n_sims,
+    }, index=names)
+
+    win_totals = pd.DataFrame(counts['win_totals'] / n_sims, index=names,
+                              columns=np.arange(counts['win_totals'].shape[1]) / 2)
+    # only the totals reachable by some team, and whole numbers of wins when there are no ties
+    win_totals = win_totals.loc[:, win_totals.any(axis=0)]
+    if (win_totals.columns % 1 == 0).all():
+        win_totals.columns = win_totals.columns.astype(np.int64)
+    seeds = pd.DataFrame(seeds, index=names, columns=np.arange(1, seeds.shape[1] + 1))
+    return SeasonOdds(odds, win_totals, seeds)
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--season", type=int, required=True)
+    parser.add_argument("--after-week", type=int, default=None, help="simulate the season as it stood after this week")
+    parser.add_argument("--sims", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-jobs", type=int, default=None, help="processes, -1 for one per CPU")
+    args = parser.parse_args(argv)
+
+    from src.pipeline import Pipeline, default_steps
+    from src.predictor import Predictor
+
+    data = Pipeline(default_steps()).run(['cleaned'], verbose=False)['cleaned']
+    # the games not played yet, see `scraping.scheduled_games`
+    schedule_path = DATA_DIR / "schedule.csv"
+    schedule = pd.read_csv(schedule_path) if schedule_path.exists() else None
+    state = season_state(data, args.season, args.after_week, schedule)
+    if args.after_week is not None:
+        # the team features of the predictor are the ones the teams had after that week
+        data = data[(data['season'] < args.season) | ((data['season'] == args.season) & (data['week'] <= args.after_week))]
+    probabilities, matchups = model_probabilities(Predictor(data=data), state)
+
+    start = time.perf_counter()
+    result = simulate_season(state, probabilities, matchups, args.sims, seed=args.seed, n_jobs=args.n_jobs)
+    elapsed = time.perf_counter() - start
+    pd.set_option('display.width', 200)
+    print(result.odds.sort_values(['conference', 'make_playoffs'], ascending=[True, False]).round(3).to_string())
+    print(f"\n{len(state.home)} games left, {args.sims} seasons simulated in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+########## storage.py ##########
+
+
+# common imports
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import pandas as pd
+
+from src.paths import DATA_DIR
+
+# dtypes of the columns we store. teams are a handful of repeated strings, so they are categoricals,
+# weeks/seasons/counting stats fit in small integers and the rolling rates don't need float64 precision.
+# counting stats of the raw scrape can be missing (blank turnovers), so they use the nullable integer types.
+SCHEMA: Dict[str, str] = {
+    # identifiers
+    'season': 'int16',
+    'week': 'int8',
+    'team': 'category',
+    'opp': 'category',
+    'home_team': 'category',
+    'away_team': 'category',
+    'home_team_code': 'int8',
+    'away_team_code': 'int8',
+    'home_or_away': 'category',
+    'date_time': 'datetime64[ns]',
+    # targets
+    'win': 'int8',
+    'home_team_win': 'int8',
+    # scraped_data.csv
+    'day': 'category',
+    'date': 'category',
+    'time': 'category',
+    'result': 'category',
+    'ot': 'category',
+    'record': 'category',
+    '@': 'category',
+    'points_scored': 'Int16',
+    'points_allowed': 'Int16',
+    '1st_downs': 'Int16',
+    'totyd': 'Int16',
+    'passyd': 'Int16',
+    'rushyd': 'Int16',
+    'to': 'Int8',
+    '1st_downs_allowed': 'Int16',
+    'totyd_allowed': 'Int16',
+    'passyd_allowed': 'Int16',
+    'rushyd_allowed': 'Int16',
+    'to_forced': 'Int8',
+    'off_exp_pts': 'float32',
+    'def_exp_pts': 'float32',
+    'sts_exp_pts': 'float32',
+}
+
+# every `*_rate_last_{n}_games` column (with or without the home_team_/away_team_ prefix)
+RATE_COLUMN = re.compile(r'_rate_last_\d+_games$')
+RATE_DTYPE = 'float32'
+
+FORMATS = {'.parquet': 'parquet', '.feather': 'feather', '.csv': 'csv'}
+
+PathLike = Union[str, Path]
+
+
+def column_dtype(column: str) -> Optional[str]:
+    """
+    Dtype of `column` in the storage schema, None for the columns the schema doesn't know about.
+    """
+    if column in SCHEMA:
+        return SCHEMA[column]
+    if RATE_COLUMN.search(column):
+        return RATE_DTYPE
+    return None
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts the columns of `df` to their SCHEMA dtypes. Unknown columns are left as they are.
+
+    `week` is only numeric once the playoff round names were converted (`convert_week_objects`),
+    before that it is stored as a categorical like the other text columns.
+
+    Args:
+        df (pd.DataFrame): data to cast (not modified)
+
+    Returns:
+        pd.DataFrame: the typed data
+    """
+    dtypes = {}
+    for column in df.columns:
+        dtype = column_dtype(column)
+        if dtype is None or df[column].dtype == dtype:
+            continue
+        if dtype == 'datetime64[ns]':
+            dtypes[column] = pd.to_datetime(df[column])
+        elif dtype == 'category':
+            dtypes[column] = df[column].astype('category')
+        elif df[column].dtype == object:
+            numbers = pd.to_numeric(df[column], errors='coerce')
+            if numbers.isna().sum() > df[column].isna().sum():
+                # text values (playoff rounds in `week`) - kept as labels
+                dtypes[column] = df[column].astype('category')
+            else:
+                dtypes[column] = numbers.astype(dtype)
+        else:
+            dtypes[column] = df[column].astype(dtype)
+
+    if not dtypes:
+        return df.copy()
+    return df.assign(**dtypes)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError(
+            "Reading and writing Parquet/Feather files requires pyarrow. "
+            "Install it with `poetry install` or `pip install pyarrow`, or use the .csv files."
+        ) from error
+    return pyarrow
+
+
+def _resolve(path: PathLike) -> Path:
+    # bare names ("transformed.parquet") live in DATA_DIR, like load_csv_data_from_disk
+    path = Path(path)
+    return path if path.parent != Path('.') else DATA_DIR / path
+
+
+def _format(path: Path) -> str:
+    try:
+        return FORMATS[path.suffix]
+    except KeyError:
+        raise ValueError(f"Unsupported file type {path.suffix!r}, expected one of {sorted(FORMATS)}") from None
+
+
+def write_table(df: pd.DataFrame, path: PathLike, typed: bool = True) -> Path:
+    """
+    Writes a dataframe to a .parquet, .feather or .csv file (picked from the extension).
+
+    Parquet is written with one row group per ~season (the data is in chronological order), so reads
+    that filter on `season` can skip the other row groups entirely. Feather is written uncompressed so
+    it can be memory-mapped on read.
+
+    Args:
+        df (pd.DataFrame): data to write
+        path (PathLike): destination, bare file names are written to DATA_DIR
+        typed (bool, optional): cast the columns to the SCHEMA dtypes first. Default is True.
+
+    Returns:
+        Path: the written file
+    """
+    path = _resolve(path)
+    file_format = _format(path)
+    if typed:
+        df = apply_schema(df)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    if file_format == 'csv':
+        df.to_csv(path, index=False)
+        return path
+
+    pa = _pyarrow()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if file_format == 'parquet':
+        # a season is ~600 team games / ~300 games
+        pa.parquet.write_table(table, path, row_group_size=512, compression='snappy')
+    else:
+        pa.feather.write_feather(table, path, compression='uncompressed')
+    return path
+
+
+def read_table(
+    path: PathLike,
+    columns: Optional[List[str]] = None,
+    seasons: Optional[Iterable[int]] = None,
+    memory_map: bool = True,
+    typed: bool = True,
+) -> pd.DataFrame:
+    """
+    Reads a .parquet, .feather or .csv file written by `write_table`.
+
+    Only the requested `columns` are read from the columnar formats, and `seasons` is pushed down to the
+    reader: Parquet skips the row groups whose season statistics don't match, Feather filters the
+    memory-mapped Arrow table before anything is converted to pandas.
+
+    Args:
+        path (PathLike): file to read, bare file names are read from DATA_DIR
+        columns (List[str], optional): columns to read. Default is all the columns.
+        seasons (Iterable[int], optional): only read the rows of these seasons. Default is every season.
+        memory_map (bool, optional): memory-map the file instead of reading it into memory. Default is True.
+        typed (bool, optional): cast the columns of .csv files to the SCHEMA dtypes. Columnar files are
+        always returned with the dtypes they were written with. Default is True.
+
+    Returns:
+        pd.DataFrame: the data
+    """
+    path = _resolve(path)
+    file_format = _format(path)
+    seasons = None if seasons is None else sorted(int(season) for season in seasons)
+
+    # the season filter needs the season column even when it isn't requested
+    read_columns = columns
+    if seasons is not None and columns is not None and 'season' not in columns:
+        read_columns = columns + ['season']
+
+    if file_format == 'csv':
+        df = pd.read_csv(path, usecols=read_columns)
+        if seasons is not None:
+            df = df[df['season'].isin(seasons)].reset_index(drop=True)
+        if read_columns is not columns:
+            df = df.drop(columns='season')
+        return apply_schema(df) if typed else df
+
+    pa = _pyarrow()
+
+    if file_format == 'parquet':
+        filters = None if seasons is None else [('season', 'in', seasons)]
+        table = pa.parquet.read_table(path, columns=read_columns, filters=filters, memory_map=memory_map)
+    else:
+        table = pa.feather.read_table(path, columns=read_columns, memory_map=memory_map)
+        if seasons is not None:
+            mask = pa.compute.is_in(table['season'], value_set=pa.array(seasons, type=table.schema.field('season').type))
+            table = table.filter(mask)
+
+    if read_columns is not columns:
+        table = table.drop(['season'])
+    return table.to_pandas()
+
@@ -0,0 +1,186 @@
+########## teams.py ##########
+
+
+# common imports
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+class Franchise(NamedTuple):
+    team_id: int
+    name: str
+    abbr: str
+    site_code: str
+    conference: str
+    division: str
+
+
+class Alias(NamedTuple):
+    alias: str
+    abbr: str
+    first_season: Optional[int] = None
+    last_season: Optional[int] = None
+
+
+# the 32 franchises under their current name. the team ID is the position in this tuple, i.e. the alphabetical
+# order of the names, so the IDs are the codes `astype("category").cat.codes` used to give - but they don't
+# depend on which teams happen to be in a dataframe anymore.
+# `site_code` is the code of the franchise in the pro-football-reference urls (/teams/<site_code>/<year>.htm).
+# conferences and divisions are the current ones (since the 2002 realignment).
+TEAMS: Tuple[Franchise, ...] = tuple(Franchise(team_id, *franchise) for team_id, franchise in enumerate([
+    ("Arizona Cardinals", "ARZ", "crd", "NFC", "NFC West"),
+    ("Atlanta Falcons", "ATL", "atl", "NFC", "NFC South"),
+    ("Baltimore Ravens", "BAL", "rav", "AFC", "AFC North"),
+    ("Buffalo Bills", "BUF", "buf", "AFC", "AFC East"),
+    ("Carolina Panthers", "CAR", "car", "NFC", "NFC South"),
+    ("Chicago Bears", "CHI", "chi", "NFC", "NFC North"),
+    ("Cincinnati Bengals", "CIN", "cin", "AFC", "AFC North"),
+    ("Cleveland Browns", "CLE", "cle", "AFC", "AFC North"),
+    ("Dallas Cowboys", "DAL", "dal", "NFC", "NFC East"),
+    ("Denver Broncos", "DEN", "den", "AFC", "AFC West"),
+    ("Detroit Lions", "DET", "det", "NFC", "NFC North"),
+    ("Green Bay Packers", "GB", "gnb", "NFC", "NFC North"),
+    ("Houston Texans", "HOU", "htx", "AFC", "AFC South"),
+    ("Indianapolis Colts", "IND", "clt", "AFC", "AFC South"),
+    ("Jacksonville Jaguars", "JAX", "jax", "AFC", "AFC South"),
+    ("Kansas City Chiefs", "KC", "kan", "AFC", "AFC West"),
+    ("Las Vegas Raiders", "LV", "rai", "AFC", "AFC West"),
+    ("Los Angeles Chargers", "LAC", "sdg", "AFC", "AFC West"),
+    ("Los Angeles Rams", "LAR", "ram", "NFC", "NFC West"),
+    ("Miami Dolphins", "MIA", "mia", "AFC", "AFC East"),
+    ("Minnesota Vikings", "MIN", "min", "NFC", "NFC North"),
+    ("New England Patriots", "NE", "nwe", "AFC", "AFC East"),
+    ("New Orleans Saints", "NO", "nor", "NFC", "NFC South"),
+    ("New York Giants", "NYG", "nyg", "NFC", "NFC East"),
+    ("New York Jets", "NYJ", "nyj", "AFC", "AFC East"),
+    ("Philadelphia Eagles", "PHI", "phi", "NFC", "NFC East"),
+    ("Pittsburgh Steelers", "PIT", "pit", "AFC", "AFC North"),
+    ("San Francisco 49ers", "SF", "sfo", "NFC", "NFC West"),
+    ("Seattle Seahawks", "SEA", "sea", "NFC", "NFC West"),
+    ("Tampa Bay Buccaneers", "TB", "tam", "NFC", "NFC South"),
+    ("Tennessee Titans", "TEN", "oti", "AFC", "AFC South"),
+    ("Washington Commanders", "WAS", "was", "NFC", "NFC East"),
+]))
+
+# former names and abbreviations of the franchises, with the seasons they were used in
+# (the current names, abbreviations and site codes are valid for every season).
+ALIASES: Tuple[Alias, ...] = (
+    Alias("Phoenix Cardinals", "ARZ", last_season=1993),
+    Alias("ARI", "ARZ"),
+    Alias("Los Angeles Raiders", "LV", last_season=1994),
+    Alias("Oakland Raiders", "LV", 1995, 2019),
+    Alias("OAK", "LV", 1995, 2019),
+    Alias("San Diego Chargers", "LAC", last_season=2016),
+    Alias("SD", "LAC", last_season=2016),
+    Alias("St. Louis Rams", "LAR", 1995, 2015),
+    Alias("STL", "LAR", 1995, 2015),
+    Alias("Houston Oilers", "TEN", last_season=1996),
+    Alias("Tennessee Oilers", "TEN", 1997, 1998),
+    Alias("Washington Redskins", "WAS", last_season=2019),
+    Alias("Washington Football Team", "WAS", 2020, 2021),
+)
+
+TEAM_NAMES = np.array([team.name for team in TEAMS], dtype=object)
+TEAM_ABBREVIATIONS = np.array([team.abbr for team in TEAMS], dtype=object)
+CONFERENCES = np.array([team.conference for team in TEAMS], dtype=object)
+# conference of every team ID as a number, for lookups in vectorized code
+AFC, NFC = 0, 1
+CONFERENCE_IDS = np.where(CONFERENCES == "NFC", NFC, AFC).astype(np.int8)
+DIVISIONS = np.array([team.division for team in TEAMS], dtype=object)
+
+_ABBR_TO_ID = {team.abbr: team.team_id for team in TEAMS}
+
+
+def _build_lookup() -> Dict[str, Tuple[int, int, int]]:
+    # upper-cased alias -> (team ID, first season, last season)
+    open_period = (np.iinfo(np.int16).min, np.iinfo(np.int16).max)
+    lookup = {}
+    for team in TEAMS:
+        for alias in (team.name, team.abbr, team.site_code):
+            lookup[alias.upper()] = (team.team_id, *open_period)
+    for alias in ALIASES:
+        lookup[alias.alias.upper()] = (
+            _ABBR_TO_ID[alias.abbr],
+            open_period[0] if alias.first_season is None else alias.first_season,
+            open_period[1] if alias.last_season is None else alias.last_season,
+        )
+    return lookup
+
+
+_LOOKUP = _build_lookup()
+
+
+def team_ids(values, seasons=None) -> np.ndarray:
+    """
+    Maps team names, former names, abbreviations or pro-football-reference site codes to team IDs
+    (the position of the franchise in TEAMS). Every distinct value is looked up once and the IDs are
+    spread to the rows with the codes of `pd.factorize`, so there's a single pass over the column.
+
+    Args:
+        values (array-like): team names/abbreviations/site codes (case insensitive)
+        seasons (array-like, optional): season of every value. If given, former names are checked
+        against the seasons they were in use (e.g. "Oakland Raiders" outside 1995-2019 is an error).
+
+    Returns:
+        np.ndarray: int8 team IDs
+
+    Raises:
+        ValueError: for unknown teams, or former names used outside their seasons
+    """
+    # imported here, the tables above only need numpy and are read by the command line
+    import pandas as pd
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        # categoricals already hold the codes, only the categories need a lookup
+        codes, uniques = np.asarray(values.cat.codes), np.asarray(values.cat.categories, dtype=object)
+    else:
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        uniques = np.asarray(uniques, dtype=object)
+    if (codes == -1).any():
+        # missing values, code -1 picks the last entry
+        uniques = np.append(uniques, None)
+    entries = [_LOOKUP.get(value.upper()) if isinstance(value, str) else None for value in uniques]
+    unknown = [value for value, entry in zip(uniques, entries) if entry is None]
+    if unknown:
+        raise ValueError(f"Unknown teams: {unknown}")
+
+    lookup = np.array(entries, dtype=np.int64).reshape(-1, 3)
+    if seasons is not None:
+        seasons = np.asarray(seasons, dtype=np.int64)
+        first, last = lookup[codes, 1], lookup[codes, 2]
+        invalid = (seasons < first) | (seasons > last)
+        if invalid.any():
+            pairs = sorted({(uniques[code], int(season)) for code, season in zip(codes[invalid], seasons[invalid])})
+            raise ValueError(f"Team names used outside the seasons they were in use: {pairs[:10]}")
+
+    return lookup[:, 0].astype(np.int8)[codes]
+
+
+def team_id(value: str) -> int:
+    """
+    Team ID of a single team name, former name, abbreviation or site code (case insensitive), without
+    importing pandas. See `team_ids`.
+
+    Raises:
+        ValueError: for unknown teams
+    """
+    entry = _LOOKUP.get(value.upper()) if isinstance(value, str) else None
+    if entry is None:
+        raise ValueError(f"Unknown teams: {[value]}")
+    return entry[0]
+
+
+def team_names(values, seasons=None) -> np.ndarray:
+    """
+    Current name of the franchise of every value, e.g. "Oakland Raiders"/"OAK"/"rai" -> "Las Vegas Raiders".
+    See `team_ids`.
+    """
+    return TEAM_NAMES[team_ids(values, seasons)]
+
+
+def team_abbreviations(values, seasons=None) -> np.ndarray:
+    """
+    Current abbreviation of the franchise of every value, e.g. "RAI"/"Oakland Raiders" -> "LV".
+    See `team_ids`.
+    """
+    return TEAM_ABBREVIATIONS[team_ids(values, seasons)]
@@ -0,0 +1,358 @@
+########## tuning.py ##########
+"""
+Hyperparameter search for the HistGradientBoostingClassifier of 04_model.ipynb by successive halving (or Hyperband,
+several successive halvings with different trade-offs): many random configurations are tried with few trees
+(`max_iter`), only the best 1/eta of them are tried again with eta times more trees, and so on, so the bad
+configurations are stopped early.
+
+Every trial is scored on time-ordered season folds (train on the seasons before, test on one season), never on
+random splits. Trials run concurrently in worker processes with a memory limit, and every trial is appended to
+a JSONL file as soon as it's done: running the same search again skips the trials already in the file, so an
+interrupted search resumes where it stopped.
+
+Usage:
+    python -m src.tuning --name hgb [--candidates 27] [--min-resource 20] [--eta 3] [--n-jobs -1] [--memory-mb 2048]
+    python -m src.tuning --name hgb --leaderboard
+"""
+
+
+# common imports
+import argparse
+import hashlib
+import json
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.paths import DATA_DIR
+from src import parallel
+from src.predictor import MODEL_PARAMS, PREDICTORS, game_feature_matrix
+
+TUNING_DIR = DATA_DIR / "tuning"
+
+# parameter -> list of values, or ('log', low, high) / ('uniform', low, high) for a continuous range
+SEARCH_SPACE = {
+    'learning_rate': ('log', 0.01, 0.3),
+    'max_depth': [3, 4, 5, 6, 8, None],
+    'max_leaf_nodes': [7, 15, 31, 63],
+    'min_samples_leaf': [10, 20, 40, 80, 160],
+    'l2_regularization': ('log', 1e-3, 10.0),
+}
+# the hand-picked parameters of 04_model.ipynb, always one of the candidates so the leaderboard shows how they compare
+BASELINE = {name: value for name, value in MODEL_PARAMS.items() if name not in ('max_iter', 'random_state')}
+
+
+### SEARCH SPACE AND FOLDS ###
+
+
+def sample_configurations(space: Dict[str, Any], n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    `n` random configurations of the search space, the same ones for the same seed.
+    """
+    rng = np.random.default_rng(seed)
+    configurations = []
+    for _ in range(n):
+        configuration = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                kind, low, high = values
+                if kind == 'log':
+                    configuration[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+                elif kind == 'uniform':
+                    configuration[name] = float(rng.uniform(low, high))
+                else:
+                    raise ValueError(f"Unknown distribution {kind!r} for {name}")
+            else:
+                value = values[rng.integers(len(values))]
+                configuration[name] = value.item() if isinstance(value, np.generic) else value
+        configurations.append(configuration)
+    return configurations
+
+
+def season_folds(seasons: np.ndarray, n_folds: int = 5) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Time-ordered folds: each of the last `n_folds` seasons is a test set, trained on every season before it.
+
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray]]: (train rows, test rows) of every fold
+    """
+    test_seasons = np.unique(seasons)[-n_folds:]
+    return [(np.flatnonzero(seasons < season), np.flatnonzero(seasons == season)) for season in test_seasons]
+
+
+### TRIALS ###
+
+
+# set in every worker process by `_init_worker`, so the data is sent once per process instead of once per trial
+_DATA: Dict[str, Any] = {}
+
+
+def _init_worker(X: np.ndarray, y: np.ndarray, folds: List[Tuple[np.ndarray, np.ndarray]], memory_mb: Optional[int]) -> None:
+    # imported before the memory limit, which is meant for the trials, not for mapping the libraries
+    import sklearn.ensemble  # noqa: F401
+    parallel.limit_memory(memory_mb)
+    # trials already run in parallel, one OpenMP thread per fit
+    parallel.limit_threads()
+    _DATA.update(X=X, y=y, folds=folds)
+
+
+def _run_trial(params: Dict[str, Any], resource: int) -> Dict[str, Any]:
+    # fits and scores one configuration with `resource` trees on every fold
+    from sklearn.ensemble import HistGradientBoostingClassifier
+
+    X, y, folds = _DATA['X'], _DATA['y'], _DATA['folds']
+    try:
+        log_losses, accuracies, fit_times, latencies = [], [], [], []
+        for train, test in folds:
+            start = time.perf_counter()
+            model = HistGradientBoostingClassifier(**{**params, 'max_iter': resource, 'random_state': 42})
+            model.fit(X[train], y[train])
+            fit_times.append(time.perf_counter() - start)
+
+            p = np.clip(model.predict_proba(X[test])[:, 1], 1e-15, 1 - 1e-15)
+            log_losses.append(float(-np.mean(y[test] * np.log(p) + (1 - y[test]) * np.log(1 - p))))
+            accuracies.append(float(np.mean((p >= 0.5) == y[test])))
+
+            # latency of one game the way the Predictor serves it
+            row = X[test[:1]]
+            timings = []
+            for _ in range(20):
+                start = time.perf_counter()
+                model.predict_proba(row)
+                timings.append(time.perf_counter() - start)
+            latencies.append(float(np.median(timings)))
+    except MemoryError:
+        return {'status': 'out of memory'}
+    return {
+        'status': 'ok',
+        'log_loss': float(np.mean(log_losses)),
+        'accuracy': float(np.mean(accuracies)),
+        'fit_time': float(np.mean(fit_times)),
+        'predict_latency_us': float(np.median(latencies) * 1e6),
+        'n_iter': int(model.n_iter_),
+    }
+
+
+class TrialStore:
+    """
+    The trials of one search, one JSON line per trial, keyed by their configuration, resource and folds.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.trials: Dict[str, Dict[str, Any]] = {}
+        if self.path.exists():
+            with open(self.path) as file:
+                for line in file:
+                    if line.strip():
+                        trial = json.loads(line)
+                        self.trials[trial['key']] = trial
+
+    @staticmethod
+    def key(params: Dict[str, Any], resource: int, folds: Dict[str, Any]) -> str:
+        payload = json.dumps({'params': params, 'resource': resource, 'folds': folds}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    def add(self, trial: Dict[str, Any]) -> None:
+        self.trials[trial['key']] = trial
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(trial) + '\n')
+
+
+### SEARCH ###
+
+
+class Search:
+    """
+    Successive halving / Hyperband over HistGradientBoosting parameters, with `max_iter` as the resource.
+
+    Usage:
+        search = Search(game_level_data, name='hgb', n_jobs=-1)
+        search.successive_halving(n_candidates=27, min_resource=20, eta=3)
+        search.leaderboard()
+    """
+
+    def __init__(
+        self,
+        game_level_data: pd.DataFrame,
+        name: str = 'hgb',
+        space: Dict[str, Any] = SEARCH_SPACE,
+        n_folds: int = 5,
+        n_jobs: Optional[int] = -1,
+        memory_mb: Optional[int] = 2048,
+        directory: Path = TUNING_DIR,
+        predictors: Sequence[str] = PREDICTORS,
+        ):
+        """
+        Args:
+            game_level_data (pd.DataFrame): one row per game with the predictors and `home_team_win`
+            name (str, optional): name of the search, its trials are stored in `directory`/<name>.jsonl.
+            Default is 'hgb'.
+            space (Dict[str, Any], optional): search space, see SEARCH_SPACE. Default is SEARCH_SPACE.
+            n_folds (int, optional): number of season folds, see `season_folds`. Default is 5.
+            n_jobs (int, optional): trials run concurrently, see `parallel.resolve_n_jobs`. Default is -1.
+            memory_mb (int, optional): address space limit of every worker process, a trial that goes over
+            it is recorded as 'out of memory'. None for no limit. Default is 2048.
+            directory (Path, optional): where the trials are stored. Default is TUNING_DIR.
+            predictors (Sequence[str], optional): columns the model uses. Default is PREDICTORS.
+        """
+        games = game_level_data.dropna(subset=['home_team_win']).reset_index(drop=True)
+        self.X = game_feature_matrix(games, predictors)
+        self.y = games['home_team_win'].to_numpy(dtype=np.int64)
+        seasons = games['season'].to_numpy()
+        self.folds = season_folds(seasons, n_folds)
+        self.fold_spec = {'test_seasons': [int(seasons[test[0]]) for _, test in self.folds], 'predictors': list(predictors)}
+        self.space = space
+        self.n_jobs = parallel.resolve_n_jobs(n_jobs)
+        self.memory_mb = memory_mb
+        self.store = TrialStore(Path(directory) / f"{name}.jsonl")
+
+    def evaluate(self, configurations: List[Dict[str, Any]], resource: int, rung: int = 0, verbose: bool = True) -> List[Dict[str, Any]]:
+        """
+        Trials of every configuration with `resource` trees, from the store when they were already run.
+        """
+        trials, pending = [], {}
+        for params in configurations:
+            key = TrialStore.key(params, resource, self.fold_spec)
+            # failed trials are retried, except the ones that ran out of memory: they would again
+            if key in self.store.trials and not self.store.trials[key]['status'].startswith('error'):
+                trials.append(self.store.trials[key])
+            else:
+                pending[key] = params
+
+        if pending:
+            with ProcessPoolExecutor(max_workers=min(self.n_jobs, len(pending)), initializer=_init_worker,
+                                     initargs=(self.X, self.y, self.folds, self.memory_mb)) as executor:
+                running = {executor.submit(_run_trial, params, resource): key for key, params in pending.items()}
+                while running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key = running.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as error:
+                            # e.g. a worker killed by the memory limit outside of numpy's allocations
+                            result = {'status': f'error: {error!r}'}
+                        trial = {'key': key, 'params': pending[key], 'resource': resource, 'rung': rung, **result}
+                        self.store.add(trial)
+                        trials.append(trial)
+                        if verbose:
+                            score = f"log-loss {trial['log_loss']:.4f}" if trial['status'] == 'ok' else trial['status']
+                            print(f"rung {rung} max_iter {resource:>4}: {score}  {pending[key]}")
+        order = {TrialStore.key(params, resource, self.fold_spec): i for i, params in enumerate(configurations)}
+        return sorted(trials, key=lambda trial: order[trial['key']])
+
+    def successive_halving(
+        self,
+        n_candidates: int = 27,
+        min_resource: int = 20,
+        max_resource: Optional[int] = None,
+        eta: int = 3,
+        seed: int = 0,
+        verbose: bool = True,
+        ) -> Dict[str, Any]:
+        """
+        Runs `n_candidates` configurations (BASELINE and random ones) with `min_resource` trees, keeps the best
+        1/eta by log-loss and multiplies their trees by eta, until one configuration is left or `max_resource`
+        is reached.
+
+        Returns:
+            Dict[str, Any]: the best trial of the last rung
+        """
+        max_resource = max_resource or min_resource * eta ** max(math.ceil(math.log(n_candidates, eta)), 0)
+        configurations = [BASELINE] + sample_configurations(self.space, n_candidates - 1, seed)
+        resource, rung = min_resource, 0
+        while True:
+            trials = [trial for trial in self.evaluate(configurations, resource, rung, verbose) if trial['status'] == 'ok']
+            if not trials:
+                raise RuntimeError("Every trial of the rung failed")
+            trials.sort(key=lambda trial: trial['log_loss'])
+            if len(trials) == 1 or resource * eta > max_resource:
+                return trials[0]
+            configurations = [trial['params'] for trial in trials[:max(len(trials) // eta, 1)]]
+            resource, rung = resource * eta, rung + 1
+
+    def hyperband(self, min_resource: int = 20, max_resource: int = 540, eta: int = 3, seed: int = 0, verbose: bool = True) -> Dict[str, Any]:
+        """
+        Hyperband: successive halvings from many configurations with few trees to few configurations with many
+        trees, for when it's unclear how many trees are needed to tell the configurations apart.
+
+        Returns:
+            Dict[str, Any]: the best trial of all the brackets
+        """
+        s_max = int(math.floor(math.log(max_resource / min_resource, eta) + 1e-9))
+        best = []
+        for s in range(s_max, -1, -1):
+            n_candidates = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+            best.append(self.successive_halving(n_candidates, max_resource // eta ** s, max_resource, eta, seed + s, verbose))
+        # the brackets end with different resources, the log-loss is comparable since they're all on the same folds
+        return min(best, key=lambda trial: trial['log_loss'])
+
+    def leaderboard(self) -> pd.DataFrame:
+        """
+        Every configuration at the largest resource it was tried with, best log-loss first among the ones that
+        went furthest, with its fit time (s, per fold) and single game predict latency (us).
+        """
+        return leaderboard(self.store)
+
+
+def leaderboard(store: TrialStore) -> pd.DataFrame:
+    trials = [trial for trial in store.trials.values() if trial['status'] == 'ok']
+    if not trials:
+        return pd.DataFrame()
+    table = pd.DataFrame([{
+        'max_iter': trial['resource'],
+        'log_loss': trial['log_loss'],
+        'accuracy': trial['accuracy'],
+        'fit_time': trial['fit_time'],
+        'predict_latency_us': trial['predict_latency_us'],
+        'configuration': json.dumps(trial['params'], sort_keys=True),
+        **trial['params'],
+    } for trial in trials])
+    table = table.sort_values(['max_iter', 'log_loss'], ascending=[False, True])
+    return table.drop_duplicates('configuration').drop(columns='configuration').reset_index(drop=True)
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--name", type=str, default="hgb", help="name of the search (its trials file)")
+    parser.add_argument("--data", type=str, default="transformed.csv", help="game level data file in DATA_DIR")
+    parser.add_argument("--method", choices=["halving", "hyperband"], default="halving")
+    parser.add_argument("--candidates", type=int, default=27, help="configurations of successive halving")
+    parser.add_argument("--min-resource", type=int, default=20, help="max_iter of the first rung")
+    parser.add_argument("--max-resource", type=int, default=None, help="largest max_iter")
+    parser.add_argument("--eta", type=int, default=3)
+    parser.add_argument("--folds", type=int, default=5, help="number of season folds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="concurrent trials, -1 for one per CPU")
+    parser.add_argument("--memory-mb", type=int, default=2048, help="memory limit of every worker, 0 for none")
+    parser.add_argument("--leaderboard", action="store_true", help="only print the leaderboard of the search")
+    args = parser.parse_args(argv)
+
+    if args.leaderboard:
+        table = leaderboard(TrialStore(TUNING_DIR / f"{args.name}.jsonl"))
+    else:
+        from src.data_preparation import load_data_from_disk
+
+        search = Search(load_data_from_disk(args.data), args.name, n_folds=args.folds, n_jobs=args.n_jobs,
+                        memory_mb=args.memory_mb or None)
+        start = time.perf_counter()
+        if args.method == "halving":
+            best = search.successive_halving(args.candidates, args.min_resource, args.max_resource, args.eta, args.seed)
+        else:
+            best = search.hyperband(args.min_resource, args.max_resource or 540, args.eta, args.seed)
+        print(f"\nbest: log-loss {best['log_loss']:.4f} with max_iter {best['resource']} {best['params']} "
+              f"({time.perf_counter() - start:.1f} s)")
+        table = search.leaderboard()
+    pd.set_option('display.width', 200)
+    print(table.head(20).round(4).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+########## test_grouped_rolling.py ##########
+"""
+Property tests of `grouped_lagged_rolling`: on random groups (random sizes, missing values) it matches a naive
+per-group pandas reference for every `how`, lag, window and min_periods combination, and a group never sees the
+rows of another one.
+
+Usage:
+    python -m pytest tests/test_grouped_rolling.py
+"""
+
+
+# common imports
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_preparation import group_offsets, grouped_lagged_rolling
+
+HOWS = ['mean', 'sum', 'std', 'ewm']
+TRIALS = 10
+CASES = [
+    (how, lag, window, min_periods)
+    for how, lag, window, min_periods in itertools.product(HOWS, [0, 1, 2], [1, 3, 5], [None, 1, 2])
+    # pandas has no sample std of one value, and a rolling window can't hold more than `window` values
+    if not (how == 'std' and window == 1) and not (how != 'ewm' and (min_periods or 0) > window)
+]
+
+
+def reference(values: np.ndarray, offsets: np.ndarray, window: int, how: str, lag: int, min_periods) -> np.ndarray:
+    # one pandas call per group: slow, but obviously correct
+    result = np.full(len(values), np.nan)
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        lagged = pd.Series(values[start:end]).shift(lag)
+        if how == 'ewm':
+            stat = lagged.ewm(alpha=2 / (window + 1), adjust=True, min_periods=min_periods or 1).mean()
+        else:
+            stat = getattr(lagged.rolling(window, min_periods=min_periods), how)()
+        result[start:end] = stat.to_numpy()
+    return result
+
+
+def random_groups(rng: np.random.Generator, n_groups: int):
+    sizes = rng.integers(1, 25, size=n_groups)
+    keys = np.repeat(np.arange(n_groups), sizes)
+    values = rng.normal(100, 50, size=len(keys)).round(2)
+    values[rng.random(len(keys)) < 0.1] = np.nan
+    return keys, values
+
+
+@pytest.mark.parametrize('how, lag, window, min_periods', CASES)
+def test_matches_per_group_reference(how, lag, window, min_periods):
+    rng = np.random.default_rng([HOWS.index(how), lag, window, min_periods or 0])
+    for _ in range(TRIALS):
+        keys, values = random_groups(rng, int(rng.integers(1, 40)))
+        offsets = group_offsets(keys)
+        np.testing.assert_allclose(
+            grouped_lagged_rolling(values, offsets, window, how=how, lag=lag, min_periods=min_periods),
+            reference(values, offsets, window, how, lag, min_periods),
+            rtol=1e-9, atol=1e-9,
+        )
+
+
+@pytest.mark.parametrize('how', HOWS)
+def test_groups_are_independent(how):
+    # changing the values of every other group leaves the statistics of a group unchanged, up to the rounding of
+    # the prefix sums that run across the groups
+    rng = np.random.default_rng(HOWS.index(how))
+    keys, values = random_groups(rng, 30)
+    offsets = group_offsets(keys)
+    other = np.where(keys == 7, values, rng.normal(0, 1000, size=len(values)))
+    in_group = keys == 7
+    np.testing.assert_allclose(
+        grouped_lagged_rolling(values, offsets, 4, how=how)[in_group],
+        grouped_lagged_rolling(other, offsets, 4, how=how)[in_group],
+        rtol=1e-9, atol=1e-9,
+    )
+
+
+@pytest.mark.parametrize('how', HOWS)
+def test_windows_and_columns_match_single_calls(how):
+    # a list of windows gives one array per window, and a 2D array one column per column of values
+    rng = np.random.default_rng(len(HOWS) + HOWS.index(how))
+    keys, first = random_groups(rng, 20)
+    second = rng.normal(size=len(keys))
+    offsets = group_offsets(keys)
+    windows = [2, 4, 8]
+    results = grouped_lagged_rolling(np.column_stack([first, second]), offsets, windows, how=how)
+    for window, result in zip(windows, results):
+        for column, values in enumerate((first, second)):
+            np.testing.assert_array_equal(result[:, column], grouped_lagged_rolling(values, offsets, window, how=how))
+
+
+@pytest.mark.parametrize('arguments', [{'how': 'median'}, {'lag': -1}])
+def test_invalid_arguments(arguments):
+    with pytest.raises(ValueError):
+        grouped_lagged_rolling(np.zeros(3), group_offsets(np.zeros(3)), 2, **arguments)